@@ -0,0 +1,266 @@
+import asyncio
+import socket
+import sys
+import traceback
+from argparse import ArgumentParser, Namespace
+from typing import Any, Coroutine, Optional
+
+from rich import print
+from rich.markup import escape
+from rich.panel import Panel
+
+from multistage import errors
+from multistage.archive_cache import create_archive_cache
+from multistage.artifact_store import create_artifact_store
+from multistage.config import DriverConfig, LaneConfig
+from multistage.constants import ADMISSION_DEFAULT_FOLDER, NODE_PROCESS_ULIMIT
+from multistage.driver import (add_services_arguments, create_resumed_lane,
+                               load_driver_config, resolve_initial_stage_name)
+from multistage.lane_controller import LaneController
+from multistage.metrics import MetricsServer
+from multistage.resources import (create_admission_scheduler,
+                                  raise_open_files_limit)
+from multistage.rpc import RpcHandler, RpcServer
+from multistage.run_history import create_run_history
+from multistage.services import SharedServices
+
+
+def main(cli_args: list[str] = sys.argv[1:]):
+    try:
+        return _do_main(cli_args)
+    except errors.KnownError as err:
+        print(Panel(f"[red]{traceback.format_exc()}"))
+        print(Panel(f"[red]{err.get_pretty()}"))
+        return 1
+
+
+# Handles the lanes of this host on behalf of a coordinator (or of any JSON-RPC client): start, stop, status, skip a stage.
+# Lanes are only taken from the local configuration: clients refer to them by name.
+def _do_main(cli_args: list[str]):
+    parser = ArgumentParser()
+    parser.add_argument("--config", required=True, help="path of the 'driver' configuration file (lanes that can be handled by this agent)")
+    parser.add_argument("--listen", required=True, help="where to serve requests: 'unix:<path>', or '<host>:<port>' (no authentication: bind to a trusted network)")
+    add_services_arguments(parser)
+    args = parser.parse_args(cli_args)
+
+    raise_open_files_limit(NODE_PROCESS_ULIMIT)
+
+    driver_config = load_driver_config(args.config)
+    agent = Agent(driver_config)
+    agent.start(args)
+    return 0
+
+
+# One lane of the agent: it can be started again, once over (e.g. resumed after having been stopped).
+class AgentLane:
+    def __init__(self, config: LaneConfig) -> None:
+        self.config = config
+        self.controller: Optional[LaneController] = None
+        self.task: Optional[asyncio.Task[None]] = None
+        self.error: Optional[str] = None
+        # Set if the lane was found completed when asked to resume (thus, not started).
+        self.is_completed = False
+
+    def is_running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def on_done(self, task: "asyncio.Task[None]"):
+        if task.cancelled():
+            return
+
+        error = task.exception()
+        if error is not None:
+            print(f"[red]Lane {self.config.name} failed:[/red] {escape(repr(error))}")
+            self.error = str(error)
+
+    def get_state(self) -> str:
+        controller = self.controller
+
+        if self.is_completed:
+            return "completed"
+        if self.task is None or controller is None:
+            return "idle"
+        if not self.task.done():
+            return "running"
+        if self.error is None and controller.succeeded:
+            return "completed"
+        if self.error is None and controller.stopping.is_set():
+            return "stopped"
+
+        return "failed"
+
+    def to_dictionary(self) -> dict[str, Any]:
+        controller = self.controller
+        stage_controller = controller.current_stage_controller if controller else None
+        metrics = controller.metrics if controller else None
+
+        return {
+            "lane": self.config.name,
+            "state": self.get_state(),
+            "stages": self.config.get_stages_names(),
+            "stage": controller.current_stage_name if controller else None,
+            "heavy": stage_controller.config.heavy if stage_controller else False,
+            "awaitingGrant": controller.is_awaiting_grant if controller else False,
+            "epoch": metrics.epoch if metrics else None,
+            "nonce": metrics.nonce if metrics else None,
+            "blocksPerSecond": metrics.blocks_per_second if metrics else None,
+            "eta": metrics.eta if metrics else None,
+            "returnCode": controller.return_code if controller else None,
+            "restarts": len(controller.restarts) if controller else 0,
+            "error": self.error,
+        }
+
+
+class Agent:
+    def __init__(self, driver_config: DriverConfig) -> None:
+        self.lanes = {lane.name: AgentLane(lane) for lane in driver_config.lanes}
+        self.host = socket.gethostname()
+        self.services: Optional[SharedServices] = None
+        # Strong references to the (fire-and-forget) tasks started by requests.
+        self.background_tasks: set[asyncio.Task[Any]] = set()
+
+    def start(self, args: Namespace):
+        try:
+            asyncio.run(self._do_start(args))
+        except KeyboardInterrupt:
+            print("Agent interrupted.")
+
+    async def _do_start(self, args: Namespace):
+        self.services = SharedServices(
+            args.max_parallel_transitions,
+            create_archive_cache(args.archives_cache, args.archives_cache_budget_gb, args.download_segments),
+            create_admission_scheduler(ADMISSION_DEFAULT_FOLDER, args.max_parallel_heavy_stages, args.heavy_stages_stagger),
+            create_artifact_store(args.artifacts_store),
+            create_run_history(args.history),
+        )
+
+        server = RpcServer(self.get_handlers())
+        metrics_server = MetricsServer(self.services.metrics, args.metrics_address) if args.metrics_address else None
+
+        try:
+            await server.start(args.listen)
+            print(f"[bold]Agent of {self.host} listening on {args.listen}, lanes: {', '.join(self.lanes)}")
+
+            if metrics_server is not None:
+                metrics_server.start()
+
+            await server.serve_forever()
+        finally:
+            server.close()
+
+            if metrics_server is not None:
+                metrics_server.close()
+
+            self.services.close()
+
+    def get_handlers(self) -> dict[str, RpcHandler]:
+        return {
+            "start": self.start_lane,
+            "stop": self.stop_lane,
+            "skipStage": self.skip_stage,
+            "admit": self.admit,
+            "status": self.get_status,
+        }
+
+    # "coordinated": heavy stages wait for a grant of the coordinator (see "admit").
+    async def start_lane(self, lane: str, stage: Optional[str] = None, resume: bool = False, coordinated: bool = False) -> dict[str, Any]:
+        agent_lane = self.get_lane(lane)
+
+        if agent_lane.is_running():
+            raise errors.KnownError(f"lane {lane} is already running")
+
+        if resume:
+            controller = create_resumed_lane(agent_lane.config)
+        else:
+            controller = LaneController(agent_lane.config, resolve_initial_stage_name(agent_lane.config, stage))
+
+        agent_lane.error = None
+        agent_lane.is_completed = controller is None
+
+        if controller is None:
+            return agent_lane.to_dictionary()
+
+        controller.services = self.services
+        controller.admission_grant = asyncio.Event() if coordinated else None
+        agent_lane.controller = controller
+        agent_lane.task = asyncio.create_task(controller.run(), name=lane)
+        agent_lane.task.add_done_callback(agent_lane.on_done)
+
+        print(f"[bold yellow]Lane {lane} started, at stage {controller.initial_stage_name}.")
+        return agent_lane.to_dictionary()
+
+    # Returns immediately: the node may take a while to shut down (see the state of the lane).
+    async def stop_lane(self, lane: str) -> dict[str, Any]:
+        agent_lane = self.get_running_lane(lane)
+        controller = agent_lane.controller
+        assert controller is not None and agent_lane.task is not None
+
+        print(f"[bold yellow]Stopping lane {lane} ...")
+        self.run_in_background(controller.stop())
+
+        # Waiting for a slot could take forever.
+        if controller.is_awaiting_admission:
+            agent_lane.task.cancel()
+
+        return agent_lane.to_dictionary()
+
+    async def skip_stage(self, lane: str) -> dict[str, Any]:
+        agent_lane = self.get_running_lane(lane)
+        controller = agent_lane.controller
+        assert controller is not None
+
+        stage_controller = controller.current_stage_controller
+        if stage_controller is None or not stage_controller.is_running():
+            raise errors.KnownError(f"lane {lane} has no running node (stage {controller.current_stage_name})")
+
+        self.run_in_background(controller.skip_stage())
+        return agent_lane.to_dictionary()
+
+    async def admit(self, lane: str) -> dict[str, Any]:
+        agent_lane = self.get_running_lane(lane)
+        controller = agent_lane.controller
+        assert controller is not None
+
+        if controller.admission_grant is None or not controller.is_awaiting_grant:
+            raise errors.KnownError(f"lane {lane} is not waiting for a grant")
+
+        print(f"{lane}: heavy stage {controller.current_stage_name} granted by the coordinator.")
+        controller.admission_grant.set()
+        controller.is_awaiting_grant = False
+        return agent_lane.to_dictionary()
+
+    async def get_status(self) -> dict[str, Any]:
+        return {
+            "host": self.host,
+            "lanes": [agent_lane.to_dictionary() for agent_lane in self.lanes.values()],
+        }
+
+    def get_lane(self, lane: str) -> AgentLane:
+        agent_lane = self.lanes.get(lane)
+        if agent_lane is None:
+            raise errors.KnownError(f"unknown lane: {lane} (not in the configuration of the agent)")
+
+        return agent_lane
+
+    def get_running_lane(self, lane: str) -> AgentLane:
+        agent_lane = self.get_lane(lane)
+        if not agent_lane.is_running():
+            raise errors.KnownError(f"lane {lane} is not running")
+
+        return agent_lane
+
+    def run_in_background(self, coroutine: Coroutine[Any, Any, Any]):
+        task = asyncio.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.on_background_task_done)
+
+    def on_background_task_done(self, task: "asyncio.Task[Any]"):
+        self.background_tasks.discard(task)
+
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[red]Request failed:[/red] {escape(repr(task.exception()))}")
+
+
+if __name__ == "__main__":
+    ret = main(sys.argv[1:])
+    sys.exit(ret)
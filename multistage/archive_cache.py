@@ -0,0 +1,204 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from rich import print
+
+from multistage.constants import (ARCHIVES_CACHE_DEFAULT_BUDGET_GB,
+                                  ARCHIVES_CACHE_DEFAULT_FOLDER,
+                                  ARCHIVES_CACHE_PARTIAL_MAX_AGE, ONE_GB,
+                                  READ_CHUNK_SIZE)
+from multistage.downloader import Downloader
+
+
+# Persistent, content-addressed store of downloaded archives.
+#
+# Layout:
+#   blobs/<sha256>        the archives themselves (the modification time is the "last used" time)
+#   urls/<sha256(url)>    which blob holds the archive of a given URL
+#   locks/<sha256(url)>   serializes downloads of the same URL (across processes)
+#   downloads/            in-progress (or interrupted, thus resumable) downloads
+#
+# Users of blobs hold a shared lock on "cache.lock", while eviction requires an exclusive one (and is skipped if the cache is busy).
+class ArchiveCache:
+    def __init__(self, folder: Path, max_bytes: int, downloader: Optional[Downloader] = None) -> None:
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.downloader = downloader or Downloader()
+        self.blobs_folder = folder / "blobs"
+        self.urls_folder = folder / "urls"
+        self.locks_folder = folder / "locks"
+        self.downloads_folder = folder / "downloads"
+        self.cache_lock_path = folder / "cache.lock"
+
+        for item in [self.blobs_folder, self.urls_folder, self.locks_folder, self.downloads_folder]:
+            item.mkdir(parents=True, exist_ok=True)
+
+    @contextmanager
+    def acquire(self, url: str, expected_checksum: Optional[str] = None) -> Iterator[Path]:
+        expected_checksum = normalize_checksum(expected_checksum)
+
+        with hold_lock(self.cache_lock_path, fcntl.LOCK_SH):
+            yield self._get_or_download(url, expected_checksum)
+
+        self.evict()
+
+    def _get_or_download(self, url: str, expected_checksum: Optional[str]) -> Path:
+        url_key = compute_text_checksum(url)
+
+        with hold_lock(self.locks_folder / url_key, fcntl.LOCK_EX):
+            cached_checksum = self._get_checksum_of_url(url_key)
+
+            if expected_checksum and cached_checksum and cached_checksum != expected_checksum:
+                print(f"[yellow]Cached archive of {url} does not match the expected checksum, will download again.")
+                cached_checksum = None
+
+            blob_checksum = expected_checksum or cached_checksum
+            if blob_checksum:
+                blob_path = self.blobs_folder / blob_checksum
+
+                if blob_path.exists():
+                    print(f"Archive {url} found in cache: {blob_path}.")
+                    self._set_checksum_of_url(url_key, url, blob_checksum)
+                    os.utime(blob_path)
+                    return blob_path
+
+            return self._download(url, url_key, expected_checksum)
+
+    def _download(self, url: str, url_key: str, expected_checksum: Optional[str]) -> Path:
+        # Downloads of a given URL are serialized (see "locks"), thus the path of the (partial) download can be deterministic.
+        download_path = self.downloads_folder / url_key
+        result = self.downloader.download(url, download_path, expected_checksum)
+        checksum = result.checksum
+
+        blob_path = self.blobs_folder / checksum
+        os.replace(download_path, blob_path)
+
+        self._set_checksum_of_url(url_key, url, checksum)
+        print(f"Archive {url} stored in cache: {blob_path}.")
+        return blob_path
+
+    # Read-only lookup (no locks taken, nothing downloaded), e.g. for the pre-flight checks.
+    def find(self, url: str, expected_checksum: Optional[str] = None) -> Optional[Path]:
+        expected_checksum = normalize_checksum(expected_checksum)
+        cached_checksum = self._get_checksum_of_url(compute_text_checksum(url))
+        # As in "acquire": a pinned checksum takes precedence over the one recorded for the URL.
+        blob_checksum = expected_checksum or cached_checksum
+        if not blob_checksum:
+            return None
+
+        blob_path = self.blobs_folder / blob_checksum
+        return blob_path if blob_path.exists() else None
+
+    def _get_checksum_of_url(self, url_key: str) -> Optional[str]:
+        entry_path = self.urls_folder / url_key
+
+        try:
+            entry: dict[str, Any] = json.loads(entry_path.read_text())
+            return entry.get("checksum")
+        except (OSError, ValueError):
+            return None
+
+    def _set_checksum_of_url(self, url_key: str, url: str, checksum: str):
+        entry_path = self.urls_folder / url_key
+        entry = {"url": url, "checksum": checksum}
+
+        temporary_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+        temporary_path.write_text(json.dumps(entry))
+        os.replace(temporary_path, entry_path)
+
+    def evict(self):
+        with open(self.cache_lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Cache is in use (by this or other processes), eviction will happen later.
+                return
+
+            try:
+                self._do_evict()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _do_evict(self):
+        # No downloads can be in progress (we hold the exclusive lock), so these are leftovers of interrupted processes.
+        # Recent ones are kept, so that they can be resumed; the files of a download (partial data, segments, validator) go together.
+        items = list(self.downloads_folder.iterdir())
+        last_modified: dict[str, float] = {}
+
+        for item in items:
+            url_key = item.name.split(".")[0]
+            last_modified[url_key] = max(last_modified.get(url_key, 0), item.stat().st_mtime)
+
+        for item in items:
+            if time.time() - last_modified[item.name.split(".")[0]] > ARCHIVES_CACHE_PARTIAL_MAX_AGE:
+                item.unlink(missing_ok=True)
+
+        blobs = [(item.stat(), item) for item in self.blobs_folder.iterdir()]
+        blobs.sort(key=lambda blob: blob[0].st_mtime)
+        total_size = sum(stat.st_size for stat, _ in blobs)
+
+        for stat, path in blobs:
+            if total_size <= self.max_bytes:
+                break
+
+            print(f"Evicting archive {path} from cache ({stat.st_size} bytes) ...")
+            path.unlink(missing_ok=True)
+            total_size -= stat.st_size
+
+    def clear(self):
+        with hold_lock(self.cache_lock_path, fcntl.LOCK_EX):
+            shutil.rmtree(self.blobs_folder, ignore_errors=True)
+            shutil.rmtree(self.urls_folder, ignore_errors=True)
+            self.blobs_folder.mkdir(parents=True, exist_ok=True)
+            self.urls_folder.mkdir(parents=True, exist_ok=True)
+
+
+def create_default_archive_cache() -> ArchiveCache:
+    folder = Path(ARCHIVES_CACHE_DEFAULT_FOLDER).expanduser().resolve()
+    return ArchiveCache(folder, int(ARCHIVES_CACHE_DEFAULT_BUDGET_GB * ONE_GB))
+
+
+def create_archive_cache(folder: str, budget_gb: float, download_segments: int) -> ArchiveCache:
+    folder_path = Path(folder).expanduser().resolve()
+    return ArchiveCache(folder_path, int(budget_gb * ONE_GB), Downloader(download_segments))
+
+
+@contextmanager
+def hold_lock(path: Path, operation: int) -> Iterator[None]:
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, operation)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def compute_file_checksum(path: Path) -> str:
+    hasher = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        while chunk := file.read(READ_CHUNK_SIZE):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def compute_text_checksum(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def normalize_checksum(checksum: Optional[str]) -> Optional[str]:
+    if not checksum:
+        return None
+
+    checksum = checksum.strip().lower()
+    checksum = checksum.removeprefix("sha256:")
+    return checksum
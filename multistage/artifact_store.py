@@ -0,0 +1,145 @@
+import errno
+import fcntl
+import os
+import shutil
+from pathlib import Path
+
+from rich import print
+
+from multistage.archive_cache import (compute_file_checksum,
+                                      compute_text_checksum, hold_lock)
+from multistage.constants import (ARTIFACTS_STORE_BLOB_MODE,
+                                  ARTIFACTS_STORE_DEFAULT_FOLDER)
+
+
+# Persistent, content-addressed store of build artifacts (node binaries, wasmer libraries), shared by all builds and lanes on the host.
+# Folders are populated with hardlinks to the blobs (or symlinks, across filesystems): each distinct file is stored once,
+# and deploying a version to many folders is near-instant.
+#
+# Layout:
+#   blobs/<sha256>        the artifacts themselves (read-only: a hardlink must never be modified in place)
+#   symlinks/<sha256>     symlinks pointing to the blobs (hardlinks are counted by the filesystem), for garbage collection
+#
+# Users of blobs hold a shared lock on "store.lock", while garbage collection requires an exclusive one.
+class ArtifactStore:
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+        self.blobs_folder = folder / "blobs"
+        self.symlinks_folder = folder / "symlinks"
+        self.store_lock_path = folder / "store.lock"
+        # Checksums of files already added, by (path, inode, size, modification time): deploying the same files to many lanes hashes them once.
+        self.checksums: dict[tuple[str, int, int, int], str] = {}
+
+        for item in [self.blobs_folder, self.symlinks_folder]:
+            item.mkdir(parents=True, exist_ok=True)
+
+    # Returns the checksum (key) of the file.
+    def add(self, path: Path) -> str:
+        stat = path.stat()
+        key = (str(path), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        checksum = self.checksums.get(key) or compute_file_checksum(path)
+        self.checksums[key] = checksum
+        blob_path = self.blobs_folder / checksum
+
+        with hold_lock(self.store_lock_path, fcntl.LOCK_SH):
+            if not blob_path.exists():
+                temporary_path = self.blobs_folder / f".{checksum}.{os.getpid()}.tmp"
+                shutil.copyfile(path, temporary_path)
+                os.chmod(temporary_path, ARTIFACTS_STORE_BLOB_MODE)
+                os.replace(temporary_path, blob_path)
+
+        return checksum
+
+    # The file is replaced atomically (a running node keeps its own copy, and a concurrent reader never sees a partial file).
+    def deploy(self, checksum: str, destination: Path):
+        blob_path = self.blobs_folder / checksum
+        temporary_path = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
+        temporary_path.unlink(missing_ok=True)
+
+        with hold_lock(self.store_lock_path, fcntl.LOCK_SH):
+            # Already deployed (renaming a hardlink onto another one of the same file would be a no-op).
+            if destination.exists() and os.path.samefile(destination, blob_path):
+                return
+
+            try:
+                os.link(blob_path, temporary_path)
+            except OSError as error:
+                if error.errno not in [errno.EXDEV, errno.EPERM, errno.EMLINK]:
+                    raise
+
+                os.symlink(blob_path, temporary_path)
+                self._record_symlink(checksum, destination)
+
+            os.replace(temporary_path, destination)
+
+    def add_and_deploy(self, path: Path, destination: Path) -> str:
+        # The blob cannot be collected in-between.
+        with hold_lock(self.store_lock_path, fcntl.LOCK_SH):
+            checksum = self.add(path)
+            self.deploy(checksum, destination)
+
+        return checksum
+
+    def _record_symlink(self, checksum: str, destination: Path):
+        record_path = self.symlinks_folder / checksum
+        record_path.mkdir(exist_ok=True)
+        (record_path / compute_text_checksum(str(destination))).write_text(str(destination))
+
+    # Removes the blobs no longer referenced by any folder (neither by hardlinks, nor by symlinks).
+    # Returns the number of removed blobs, and their total size.
+    def collect_garbage(self) -> tuple[int, int]:
+        num_removed = 0
+        num_bytes = 0
+
+        with open(self.store_lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Store is in use (by this or other processes), garbage will be collected later.
+                return 0, 0
+
+            try:
+                for blob_path in self.blobs_folder.iterdir():
+                    if blob_path.name.startswith("."):
+                        continue
+
+                    stat = blob_path.stat()
+                    if stat.st_nlink > 1 or self._is_symlinked(blob_path):
+                        continue
+
+                    print(f"Removing unreferenced artifact {blob_path} ({stat.st_size} bytes) ...")
+                    blob_path.unlink()
+                    shutil.rmtree(self.symlinks_folder / blob_path.name, ignore_errors=True)
+                    num_removed += 1
+                    num_bytes += stat.st_size
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        return num_removed, num_bytes
+
+    def _is_symlinked(self, blob_path: Path) -> bool:
+        record_path = self.symlinks_folder / blob_path.name
+        if not record_path.is_dir():
+            return False
+
+        is_symlinked = False
+
+        for item in record_path.iterdir():
+            destination = Path(item.read_text())
+
+            # Symlinks that have been removed, or replaced, are forgotten.
+            if destination.is_symlink() and Path(os.readlink(destination)) == blob_path:
+                is_symlinked = True
+            else:
+                item.unlink()
+
+        return is_symlinked
+
+
+def create_default_artifact_store() -> ArtifactStore:
+    return create_artifact_store(ARTIFACTS_STORE_DEFAULT_FOLDER)
+
+
+def create_artifact_store(folder: str) -> ArtifactStore:
+    folder_path = Path(folder).expanduser().resolve()
+    return ArtifactStore(folder_path)
@@ -0,0 +1,30 @@
+#!/bin/sh
+
+# Stand-in for the node binary, for benchmarks. It does not process blocks: it records its start (and graceful stop)
+# in "fake_node.state" (in the working directory), from which the stand-in status server derives the epoch and the nonce.
+# Kept as a shell script, so that hundreds of instances are cheap.
+
+blocks_per_second=10
+shutdown_delay=0
+
+for arg in "$@"; do
+    case "$arg" in
+        --blocks-per-second=*) blocks_per_second="${arg#*=}" ;;
+        --shutdown-delay=*) shutdown_delay="${arg#*=}" ;;
+    esac
+done
+
+stop() {
+    echo "stop $(date +%s%N)" >> fake_node.state
+    sleep "$shutdown_delay"
+    exit 0
+}
+
+trap stop TERM INT
+
+echo "start $(date +%s%N) $blocks_per_second" >> fake_node.state
+
+while true; do
+    sleep 1 &
+    wait $!
+done
@@ -0,0 +1,385 @@
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import zipfile
+from argparse import SUPPRESS, ArgumentParser, Namespace
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Optional
+
+import requests
+from rich import print
+from rich.panel import Panel
+from rich.table import Table
+
+from multistage import errors
+from multistage.archive_cache import ArchiveCache
+from multistage.artifact_store import create_artifact_store
+from multistage.config import LaneConfig
+from multistage.constants import (BENCHMARK_DEFAULT_BLOCKS_PER_SECOND,
+                                  BENCHMARK_DEFAULT_EPOCHS_PER_STAGE,
+                                  BENCHMARK_DEFAULT_LANES,
+                                  BENCHMARK_DEFAULT_NONCES_PER_EPOCH,
+                                  BENCHMARK_DEFAULT_SHUTDOWN_DELAY,
+                                  BENCHMARK_DEFAULT_STAGES,
+                                  BENCHMARK_LAG_PROBE_PERIOD,
+                                  DEFAULT_MAX_PARALLEL_TRANSITIONS, FILE_MODE_NICE,
+                                  NODE_STOP_DEFAULT_GRACE_PERIOD,
+                                  NODE_STOP_SIGNALS, ONE_GB,
+                                  TEMPORARY_DIRECTORIES_PREFIX)
+from multistage.lane_controller import LaneController
+from multistage.resources import create_admission_scheduler
+from multistage.services import SharedServices
+
+REPOSITORY_ROOT = Path(__file__).parent.parent.parent
+
+
+# Measures the overhead of the driver itself (no actual node), for squads of increasing size.
+# Each scenario (number of lanes) runs in a fresh process, so that its memory usage can be measured.
+def main(cli_args: list[str] = sys.argv[1:]):
+    try:
+        return _do_main(cli_args)
+    except errors.KnownError as err:
+        print(Panel(f"[red]{traceback.format_exc()}"))
+        print(Panel(f"[red]{err.get_pretty()}"))
+        return 1
+
+
+def _do_main(cli_args: list[str]):
+    parser = ArgumentParser()
+    parser.add_argument("--lanes", default=BENCHMARK_DEFAULT_LANES, help="comma-separated numbers of lanes, one scenario for each")
+    parser.add_argument("--stages", type=int, default=BENCHMARK_DEFAULT_STAGES, help="number of stages of each lane")
+    parser.add_argument("--epochs-per-stage", type=int, default=BENCHMARK_DEFAULT_EPOCHS_PER_STAGE)
+    parser.add_argument("--nonces-per-epoch", type=int, default=BENCHMARK_DEFAULT_NONCES_PER_EPOCH)
+    parser.add_argument("--blocks-per-second", type=float, default=BENCHMARK_DEFAULT_BLOCKS_PER_SECOND, help="processing rate of the fake nodes")
+    parser.add_argument("--stop-signal", choices=NODE_STOP_SIGNALS, default="SIGTERM", help="how the fake nodes are stopped")
+    parser.add_argument("--shutdown-delay", type=float, default=BENCHMARK_DEFAULT_SHUTDOWN_DELAY, help="how long the fake nodes take to shut down")
+    parser.add_argument("--max-parallel-transitions", type=int, default=DEFAULT_MAX_PARALLEL_TRANSITIONS)
+    parser.add_argument("--output", default="benchmark.json", help="where to write the results (JSON)")
+    parser.add_argument("--compare-with", help="results of a previous run (e.g. of another commit), to compare against")
+    # Internal: run a single scenario (in the current process), and write its results to the given file.
+    parser.add_argument("--scenario-output", help=SUPPRESS)
+    args = parser.parse_args(cli_args)
+
+    lanes_counts = parse_lanes_counts(args.lanes)
+
+    if args.scenario_output:
+        scenario = asyncio.run(run_scenario(args, lanes_counts[0]))
+        Path(args.scenario_output).write_text(json.dumps(scenario, indent=4))
+        return 0
+
+    scenarios: list[dict[str, Any]] = []
+
+    for lanes_count in lanes_counts:
+        print(f"[bold yellow]Running scenario: {lanes_count} lane(s) ...")
+        scenario = run_scenario_in_subprocess(args, lanes_count)
+        scenarios.append(scenario)
+        print(f"Scenario with {lanes_count} lane(s) completed in {scenario['wallTime']:.1f}s.")
+
+    results = {
+        "commit": get_commit(),
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "settings": get_settings(args),
+        "scenarios": scenarios,
+    }
+
+    output_path = Path(args.output).expanduser().resolve()
+    output_path.write_text(json.dumps(results, indent=4))
+    print(f"Results written to {output_path}.")
+
+    baseline: Optional[dict[str, Any]] = None
+    if args.compare_with:
+        baseline = json.loads(Path(args.compare_with).expanduser().read_text())
+
+    print_results(results, baseline)
+    return 0
+
+
+def parse_lanes_counts(text: str) -> list[int]:
+    try:
+        counts = [int(item) for item in text.split(",") if item.strip()]
+    except ValueError:
+        raise errors.UsageError(f"bad list of lanes counts: {text}")
+
+    if not counts or any(count < 1 for count in counts):
+        raise errors.UsageError(f"bad list of lanes counts: {text}")
+
+    return counts
+
+
+def run_scenario_in_subprocess(args: Namespace, lanes_count: int) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix=TEMPORARY_DIRECTORIES_PREFIX) as tmpdirname:
+        scenario_output = Path(tmpdirname) / "scenario.json"
+        log_path = Path(tmpdirname) / "scenario.log"
+
+        command = [
+            sys.executable, __file__,
+            f"--lanes={lanes_count}",
+            f"--stages={args.stages}",
+            f"--epochs-per-stage={args.epochs_per_stage}",
+            f"--nonces-per-epoch={args.nonces_per_epoch}",
+            f"--blocks-per-second={args.blocks_per_second}",
+            f"--stop-signal={args.stop_signal}",
+            f"--shutdown-delay={args.shutdown_delay}",
+            f"--max-parallel-transitions={args.max_parallel_transitions}",
+            f"--scenario-output={scenario_output}",
+        ]
+
+        env = os.environ.copy()
+        env["PYTHONPATH"] = str(REPOSITORY_ROOT)
+
+        # The (abundant) output of the lanes is not of interest, unless the scenario fails.
+        with open(log_path, "w") as log_file:
+            return_code = subprocess.run(command, stdout=log_file, stderr=subprocess.STDOUT, env=env).returncode
+
+        if return_code != 0 or not scenario_output.exists():
+            tail = "\n".join(log_path.read_text().splitlines()[-30:])
+            raise errors.KnownError(f"scenario with {lanes_count} lane(s) failed, with return code = {return_code}", tail)
+
+        return json.loads(scenario_output.read_text())
+
+
+async def run_scenario(args: Namespace, lanes_count: int) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix=TEMPORARY_DIRECTORIES_PREFIX) as tmpdirname:
+        workspace = Path(tmpdirname)
+        lanes_folder = workspace / "lanes"
+        bin_folder = create_bin_folder(workspace)
+        configuration_archive = create_configuration_archive(workspace)
+        status_server, port = start_status_server(lanes_folder, args.nonces_per_epoch)
+
+        lanes_configs = [create_lane_config(args, f"lane_{index}", lanes_folder, bin_folder, configuration_archive, port) for index in range(lanes_count)]
+        # Everything within the workspace, so that scenarios neither share state with each other nor with real runs.
+        services = SharedServices(
+            args.max_parallel_transitions,
+            ArchiveCache(workspace / "cache", ONE_GB),
+            create_admission_scheduler(str(workspace / "admission"), 0, 0),
+            create_artifact_store(str(workspace / "artifacts")),
+        )
+        lanes = [LaneController(config, config.get_stages_names()[0], services) for config in lanes_configs]
+        lag_probe = EventLoopLagProbe(BENCHMARK_LAG_PROBE_PERIOD)
+        lag_probe_task = asyncio.create_task(lag_probe.run())
+
+        try:
+            cpu_started_at = time.process_time()
+            started_at = time.perf_counter()
+            results = await asyncio.gather(*[lane.run() for lane in lanes], return_exceptions=True)
+            wall_time = time.perf_counter() - started_at
+            cpu_time = time.process_time() - cpu_started_at
+            status_requests = get_status_requests(port)
+        finally:
+            lag_probe_task.cancel()
+            services.close()
+            status_server.terminate()
+            status_server.wait()
+
+    failed_lanes = [lane.config.name for lane, result in zip(lanes, results) if isinstance(result, BaseException) or not lane.succeeded]
+    maximum_resident_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    return {
+        "lanes": lanes_count,
+        "failedLanes": failed_lanes,
+        "wallTime": wall_time,
+        "cpuTime": cpu_time,
+        "statusRequests": status_requests,
+        "cpuTimePerStatusRequest": cpu_time / status_requests if status_requests else None,
+        "maxResidentMemory": maximum_resident_memory,
+        "transitionsDurations": summarize([gap for lane in lanes for gap in lane.transitions_gaps.values()]),
+        "shutdownsDurations": summarize([duration for lane in lanes for duration in lane.shutdowns_durations.values()]),
+        "overshootsBlocks": summarize([overshoot.blocks for lane in lanes for overshoot in lane.overshoots.values()]),
+        "overshootsSeconds": summarize([overshoot.seconds for lane in lanes for overshoot in lane.overshoots.values()]),
+        "eventLoopLag": summarize(lag_probe.lags),
+    }
+
+
+def create_bin_folder(workspace: Path) -> Path:
+    bin_folder = workspace / "bin"
+    bin_folder.mkdir(parents=True)
+
+    program = bin_folder / "node"
+    shutil.copy(Path(__file__).parent / "fake_node.sh", program)
+    program.chmod(FILE_MODE_NICE)
+    return bin_folder
+
+
+def create_configuration_archive(workspace: Path) -> Path:
+    archive_path = workspace / "config.zip"
+
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.writestr("config/config.toml", "# Fake configuration (benchmark).\n")
+
+    return archive_path
+
+
+def start_status_server(lanes_folder: Path, nonces_per_epoch: int) -> tuple["subprocess.Popen[str]", int]:
+    env = os.environ.copy()
+    env["PYTHONPATH"] = str(REPOSITORY_ROOT)
+
+    process = subprocess.Popen(
+        [sys.executable, str(Path(__file__).parent / "status_server.py"), f"--workspace={lanes_folder}", f"--nonces-per-epoch={nonces_per_epoch}"],
+        stdout=subprocess.PIPE,
+        text=True,
+        env=env,
+    )
+
+    assert process.stdout is not None
+    port_line = process.stdout.readline()
+
+    if not port_line.strip().isdigit():
+        process.kill()
+        raise errors.KnownError("cannot start the stand-in status server")
+
+    return process, int(port_line)
+
+
+def get_status_requests(port: int) -> int:
+    response = requests.get(f"http://localhost:{port}/stats", timeout=5)
+    return response.json().get("requests", 0)
+
+
+def create_lane_config(args: Namespace, name: str, lanes_folder: Path, bin_folder: Path, configuration_archive: Path, port: int) -> LaneConfig:
+    stages: list[dict[str, Any]] = []
+
+    for index in range(args.stages):
+        stages.append({
+            "name": f"stage_{index}",
+            "untilEpoch": (index + 1) * args.epochs_per_stage,
+            "nodeStatusUrl": f"http://localhost:{port}/{name}/node/status",
+            "configurationArchive": configuration_archive.as_uri(),
+            "bin": str(bin_folder),
+            "nodeArguments": [f"--blocks-per-second={args.blocks_per_second}", f"--shutdown-delay={args.shutdown_delay}"],
+            "stopSignal": args.stop_signal,
+            "stopGracePeriod": NODE_STOP_DEFAULT_GRACE_PERIOD,
+        })
+
+    return LaneConfig.new_from_dictionary({
+        "name": name,
+        "workingDirectory": str(lanes_folder / name),
+        "stages": stages,
+    })
+
+
+# Measures how late the event loop wakes up a sleeping coroutine (i.e. how long the loop is kept busy by other work).
+class EventLoopLagProbe:
+    def __init__(self, period: float) -> None:
+        self.period = period
+        self.lags: list[float] = []
+
+    async def run(self):
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.period)
+            self.lags.append(max(0, time.perf_counter() - started_at - self.period))
+
+
+def summarize(values: list[float]) -> dict[str, Any]:
+    if not values:
+        return {"count": 0}
+
+    values = sorted(values)
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": get_percentile(values, 50),
+        "p99": get_percentile(values, 99),
+        "max": values[-1],
+    }
+
+
+def get_percentile(sorted_values: list[float], percentile: float) -> float:
+    index = round(percentile / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def get_settings(args: Namespace) -> dict[str, Any]:
+    return {
+        "stages": args.stages,
+        "epochsPerStage": args.epochs_per_stage,
+        "noncesPerEpoch": args.nonces_per_epoch,
+        "blocksPerSecond": args.blocks_per_second,
+        "stopSignal": args.stop_signal,
+        "shutdownDelay": args.shutdown_delay,
+        "maxParallelTransitions": args.max_parallel_transitions,
+    }
+
+
+def get_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPOSITORY_ROOT, capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+
+    return result.stdout.strip() or None
+
+
+def print_results(results: dict[str, Any], baseline: Optional[dict[str, Any]]):
+    baseline_scenarios = {scenario["lanes"]: scenario for scenario in (baseline or {}).get("scenarios", [])}
+
+    title = "Benchmark"
+    if baseline is not None:
+        title += f" (compared with {baseline.get('commit') or 'baseline'})"
+
+    table = Table(title=title)
+    table.add_column("Lanes")
+    table.add_column("Failed")
+    table.add_column("Transition p50")
+    table.add_column("Overshoot p50")
+    table.add_column("Loop lag p99")
+    table.add_column("CPU / poll")
+    table.add_column("Max RSS")
+
+    for scenario in results["scenarios"]:
+        previous = baseline_scenarios.get(scenario["lanes"])
+
+        table.add_row(
+            str(scenario["lanes"]),
+            str(len(scenario["failedLanes"])),
+            format_metric(scenario, previous, ["transitionsDurations", "p50"], "{:.3f}s"),
+            format_metric(scenario, previous, ["overshootsSeconds", "p50"], "{:.2f}s"),
+            format_metric(scenario, previous, ["eventLoopLag", "p99"], "{:.4f}s"),
+            format_metric(scenario, previous, ["cpuTimePerStatusRequest"], "{:.5f}s"),
+            format_metric(scenario, previous, ["maxResidentMemory"], "{:.0f}", scale=1 / (1024 * 1024), suffix=" MB"),
+        )
+
+    print(table)
+
+
+def format_metric(scenario: dict[str, Any], previous: Optional[dict[str, Any]], keys: list[str], pattern: str, scale: float = 1, suffix: str = "") -> str:
+    value = get_nested(scenario, keys)
+    if value is None:
+        return "-"
+
+    text = pattern.format(value * scale) + suffix
+
+    previous_value = get_nested(previous, keys) if previous else None
+    if previous_value:
+        change = (value - previous_value) / previous_value * 100
+        color = "red" if change > 0 else "green"
+        text += f" [{color}]({change:+.0f}%)"
+
+    return text
+
+
+def get_nested(data: Optional[dict[str, Any]], keys: list[str]) -> Optional[float]:
+    value: Any = data
+
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+
+    return value
+
+
+if __name__ == "__main__":
+    ret = main(sys.argv[1:])
+    sys.exit(ret)
@@ -0,0 +1,125 @@
+import json
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Optional
+
+from multistage.constants import BENCHMARK_FAKE_NODE_STATE_FILE_NAME
+
+
+# Stand-in for the "/node/status" endpoint of the nodes of many lanes, for benchmarks (a single process, instead of one per node).
+# Serves "/<lane>/node/status" (derived from the "fake_node.state" file of the lane) and "/stats" (number of status requests).
+def main(cli_args: list[str] = sys.argv[1:]):
+    parser = ArgumentParser()
+    parser.add_argument("--workspace", required=True, help="folder holding the working directories of the lanes")
+    parser.add_argument("--port", type=int, default=0, help="port to listen on (default: any free port)")
+    parser.add_argument("--nonces-per-epoch", type=int, required=True)
+    args = parser.parse_args(cli_args)
+
+    stats = RequestsStats()
+    handler = create_request_handler(Path(args.workspace), args.nonces_per_epoch, stats)
+    server = ThreadingHTTPServer(("localhost", args.port), handler)
+    server.daemon_threads = True
+
+    # The harness reads the port from the first line of the output.
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+class RequestsStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.num_requests = 0
+
+    def increment(self):
+        with self.lock:
+            self.num_requests += 1
+
+
+def create_request_handler(workspace: Path, nonces_per_epoch: int, stats: RequestsStats) -> type[BaseHTTPRequestHandler]:
+    class StatusRequestHandler(BaseHTTPRequestHandler):
+        # Keep-alive, as the node's API.
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+
+            if parts == ["stats"]:
+                self.send_json(HTTPStatus.OK, {"requests": stats.num_requests})
+                return
+
+            if len(parts) != 3 or parts[1:] != ["node", "status"]:
+                self.send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+                return
+
+            stats.increment()
+            nonce = compute_nonce(workspace / parts[0] / BENCHMARK_FAKE_NODE_STATE_FILE_NAME, time.time_ns())
+
+            if nonce is None:
+                # Node not running: its API would not be reachable.
+                self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": "node not running"})
+                return
+
+            metrics = {
+                "drt_epoch_number": nonce // nonces_per_epoch,
+                "drt_nonce": nonce,
+                "drt_current_round": nonce,
+                "drt_is_syncing": 1,
+                "drt_probable_highest_nonce": nonce,
+            }
+
+            self.send_json(HTTPStatus.OK, {"data": {"metrics": metrics}, "code": "successful"})
+
+        def send_json(self, status: HTTPStatus, data: dict[str, Any]):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any):
+            pass
+
+    return StatusRequestHandler
+
+
+# The nonce grows (at the rate given to the node) while the node runs, and is kept across restarts (as the node's storage would).
+# Returns None if the node is not running.
+def compute_nonce(state_path: Path, now_ns: int) -> Optional[int]:
+    try:
+        lines = state_path.read_text().splitlines()
+    except FileNotFoundError:
+        return None
+
+    blocks = 0.0
+    running_since: Optional[int] = None
+    rate = 0.0
+
+    for line in lines:
+        fields = line.split()
+
+        if fields[0] == "start":
+            # If the node has been killed (no "stop" recorded), it ran until (at most) its restart.
+            if running_since is not None:
+                blocks += (int(fields[1]) - running_since) / 1e9 * rate
+
+            running_since = int(fields[1])
+            rate = float(fields[2])
+        elif fields[0] == "stop" and running_since is not None:
+            blocks += (int(fields[1]) - running_since) / 1e9 * rate
+            running_since = None
+
+    if running_since is None:
+        return None
+
+    blocks += (now_ns - running_since) / 1e9 * rate
+    return int(blocks)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -2,18 +2,31 @@ import json
 import os
 import shutil
 import sys
+import time
 import traceback
 from argparse import ArgumentParser
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 from rich import print
+from rich.markup import escape
 from rich.panel import Panel
-from rich.rule import Rule
+from rich.table import Table
 
 from multistage import errors, golang
+from multistage.archive_cache import ArchiveCache, create_archive_cache
+from multistage.artifact_store import ArtifactStore, create_artifact_store
+from multistage.build_manifest import BuildManifest, create_record
 from multistage.config import BuildConfigEntry
-from multistage.constants import FILE_MODE_NICE
+from multistage.constants import (ARCHIVES_CACHE_DEFAULT_BUDGET_GB,
+                                  ARCHIVES_CACHE_DEFAULT_FOLDER,
+                                  ARTIFACTS_STORE_DEFAULT_FOLDER,
+                                  BUILD_DEFAULT_JOBS,
+                                  BUILD_DOWNLOADS_PARALLELISM,
+                                  BUILD_MANIFEST_FILE_NAME,
+                                  DOWNLOAD_DEFAULT_SEGMENTS, ONE_MB)
 from multistage.shared import fetch_archive
 
 
@@ -30,8 +43,21 @@ def _do_main(cli_args: list[str]):
     parser = ArgumentParser()
     parser.add_argument("--workspace", required=True, help="path of the build workspace")
     parser.add_argument("--config", required=True, help="path of the 'build' configuration file")
+    parser.add_argument("--archives-cache", default=ARCHIVES_CACHE_DEFAULT_FOLDER, help="folder of the (persistent) archives cache")
+    parser.add_argument("--archives-cache-budget-gb", type=float, default=ARCHIVES_CACHE_DEFAULT_BUDGET_GB, help="size of the archives cache, before evicting least recently used archives")
+    parser.add_argument("--download-segments", type=int, default=DOWNLOAD_DEFAULT_SEGMENTS, help="how many parallel (ranged) requests to use for downloading large archives")
+    parser.add_argument("--stream-archives", action="store_true", default=False, help="extract tar archives (Go toolchains, sources) while downloading them, bypassing the archives cache")
+    parser.add_argument("--artifacts-store", default=ARTIFACTS_STORE_DEFAULT_FOLDER, help="folder of the (persistent) store of node binaries and libraries, linked into the destination folders")
+    parser.add_argument("--modules-mirror", help="folder of a local (file-based) GOPROXY, filled with all downloaded Go modules, and used before the network")
+    parser.add_argument("--offline", action="store_true", default=False, help="download Go modules only from the modules mirror")
+    parser.add_argument("--jobs", type=int, default=BUILD_DEFAULT_JOBS, help="how many entries to build in parallel (downloads always happen in parallel)")
+    parser.add_argument("--fail-fast", action="store_true", default=False, help="stop scheduling builds as soon as one entry fails")
+    parser.add_argument("--force", action="store_true", default=False, help="build all entries, even if they are up to date (according to the build manifest)")
     args = parser.parse_args(cli_args)
 
+    if args.jobs < 1:
+        raise errors.UsageError("'--jobs' must be at least 1")
+
     workspace_path = Path(args.workspace).expanduser().resolve()
     workspace_path.mkdir(parents=True, exist_ok=True)
 
@@ -39,49 +65,373 @@ def _do_main(cli_args: list[str]):
     config_data = json.loads(config_path.read_text())
     config_entries = [BuildConfigEntry.new_from_dictionary(item) for item in config_data]
 
-    for entry in config_entries:
-        print(Rule(f"[bold yellow]{entry.name}"))
-
-        golang.install_go(workspace_path, entry.go_url, environment_label=entry.name)
-        build_environment = golang.acquire_environment(workspace_path, label=entry.name)
-
-        source_parent_folder = do_download(workspace_path, entry)
-        cmd_node_folder = do_build(source_parent_folder, build_environment)
-        copy_artifacts(cmd_node_folder, entry)
-
-
-def do_download(workspace: Path, entry: BuildConfigEntry) -> Path:
+    archives_cache = create_archive_cache(args.archives_cache, args.archives_cache_budget_gb, args.download_segments)
+
+    artifact_store = create_artifact_store(args.artifacts_store)
+    modules_mirror = Path(args.modules_mirror).expanduser().resolve() if args.modules_mirror else None
+    caches = golang.CachesSettings(modules_mirror, args.offline)
+
+    manifest = BuildManifest(workspace_path)
+    pipeline = BuildPipeline(workspace_path, config_entries, archives_cache, artifact_store, manifest, caches, jobs=args.jobs, fail_fast=args.fail_fast, force=args.force, stream_archives=args.stream_archives)
+    outcomes = pipeline.run()
+    print_outcomes(outcomes)
+
+    num_removed, num_bytes = artifact_store.collect_garbage()
+    if num_removed:
+        print(f"Removed {num_removed} unreferenced artifacts ({num_bytes / ONE_MB:.1f} MB) from {artifact_store.folder}.")
+
+    failed = [outcome.entry.name for outcome in outcomes if not outcome.succeeded]
+    if failed:
+        raise errors.KnownError(f"builds failed or skipped: {', '.join(failed)}")
+
+
+class BuildOutcome:
+    def __init__(self, entry: BuildConfigEntry) -> None:
+        self.entry = entry
+        self.durations: dict[str, float] = {}
+        self.wall_time: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        self.modules: Optional[golang.ModulesStatistics] = None
+        self.build_cache: Optional[golang.BuildCacheStatistics] = None
+        self.up_to_date = False
+        self.skipped = False
+        self.succeeded = False
+
+
+# Entries that are up to date (according to the build manifest) are skipped, unless "force" is set.
+# Downloads (Go toolchains, deduplicated by URL, and sources) run concurrently.
+# As soon as both its toolchain and its source are available, the Go modules of an entry are downloaded (into the shared module cache),
+# then the entry is built (in a pool of "jobs" workers).
+class BuildPipeline:
+    def __init__(self,
+                 workspace: Path,
+                 entries: list[BuildConfigEntry],
+                 cache: Optional[ArchiveCache],
+                 artifact_store: ArtifactStore,
+                 manifest: BuildManifest,
+                 caches: golang.CachesSettings,
+                 jobs: int,
+                 fail_fast: bool,
+                 force: bool = False,
+                 stream_archives: bool = False) -> None:
+        self.workspace = workspace
+        self.entries = entries
+        self.cache = cache
+        self.artifact_store = artifact_store
+        self.manifest = manifest
+        self.caches = caches
+        self.jobs = jobs
+        self.fail_fast = fail_fast
+        self.force = force
+        self.stream_archives = stream_archives
+        self.outcomes = {entry.name: BuildOutcome(entry) for entry in entries}
+        self.started_at = 0.0
+        self.stopping = False
+        # Contents of the shared module cache, before the modules of the entries are downloaded (concurrently).
+        self.cached_modules: set[Path] = set()
+
+        toolchains_by_label: dict[str, str] = {}
+
+        for entry in entries:
+            label = golang.get_toolchain_label(entry.go_url)
+            known_url = toolchains_by_label.setdefault(label, entry.go_url)
+
+            if known_url != entry.go_url:
+                raise errors.BadConfigurationError(f"different Go URLs map to the same toolchain ({label}): {known_url}, {entry.go_url}")
+
+    def run(self) -> list[BuildOutcome]:
+        self.started_at = time.perf_counter()
+        entries = self.skip_up_to_date_entries()
+        self.cached_modules = golang.list_cached_modules(self.workspace)
+
+        with ThreadPoolExecutor(BUILD_DOWNLOADS_PARALLELISM, thread_name_prefix="download") as downloads_executor, \
+                ThreadPoolExecutor(self.jobs, thread_name_prefix="build") as builds_executor:
+            toolchains_futures: dict[str, Future[float]] = {}
+
+            for entry in entries:
+                if entry.go_url not in toolchains_futures:
+                    toolchains_futures[entry.go_url] = downloads_executor.submit(self.install_toolchain, entry)
+
+            sources_futures = {entry.name: downloads_executor.submit(self.download_source, entry) for entry in entries}
+            modules_futures: dict[Future[float], BuildConfigEntry] = {}
+            builds_futures: dict[Future[bool], BuildConfigEntry] = {}
+            waiting = list(entries)
+
+            while waiting or modules_futures or builds_futures:
+                for entry in list(waiting):
+                    toolchain_future = toolchains_futures[entry.go_url]
+                    source_future = sources_futures[entry.name]
+
+                    if not (toolchain_future.done() and source_future.done()):
+                        continue
+
+                    waiting.remove(entry)
+                    outcome = self.outcomes[entry.name]
+
+                    if self.stopping:
+                        outcome.skipped = True
+                        continue
+
+                    error = get_future_error(toolchain_future) or get_future_error(source_future)
+                    if error:
+                        self.on_failure(outcome, error)
+                        continue
+
+                    outcome.durations["toolchain"] = toolchain_future.result()
+                    outcome.durations["source"] = source_future.result()
+                    modules_futures[downloads_executor.submit(self.download_modules, entry)] = entry
+
+                for future in [future for future in modules_futures if future.done()]:
+                    entry = modules_futures.pop(future)
+                    outcome = self.outcomes[entry.name]
+
+                    if self.stopping:
+                        outcome.skipped = True
+                        continue
+
+                    error = get_future_error(future)
+                    if error:
+                        self.on_failure(outcome, error)
+                        continue
+
+                    outcome.durations["modules"] = future.result()
+                    builds_futures[builds_executor.submit(self.build_entry, entry)] = entry
+
+                if self.stopping:
+                    for future in list(toolchains_futures.values()) + list(sources_futures.values()) + list(modules_futures) + list(builds_futures):
+                        future.cancel()
+
+                pending_futures = [toolchains_futures[entry.go_url] for entry in waiting] + [sources_futures[entry.name] for entry in waiting] + list(modules_futures) + list(builds_futures)
+                pending_futures = [future for future in pending_futures if not future.done()]
+                if pending_futures:
+                    wait(pending_futures, return_when=FIRST_COMPLETED)
+
+                for future in [future for future in builds_futures if future.done()]:
+                    entry = builds_futures.pop(future)
+                    outcome = self.outcomes[entry.name]
+
+                    if future.cancelled():
+                        outcome.skipped = True
+                        continue
+
+                    error = get_future_error(future)
+                    if error:
+                        self.on_failure(outcome, error)
+                        continue
+
+                    if not future.result():
+                        outcome.skipped = True
+                        continue
+
+                    outcome.succeeded = True
+                    outcome.wall_time = time.perf_counter() - self.started_at
+                    print(f"[green]{entry.name}: built in {outcome.durations['build']:.1f}s (done after {outcome.wall_time:.1f}s).")
+
+        return [self.outcomes[entry.name] for entry in self.entries]
+
+    def skip_up_to_date_entries(self) -> list[BuildConfigEntry]:
+        if self.force:
+            return list(self.entries)
+
+        entries: list[BuildConfigEntry] = []
+
+        for entry in self.entries:
+            if self.manifest.is_up_to_date(entry):
+                print(f"{entry.name}: up to date in {entry.destination_folder}, skipping.")
+                outcome = self.outcomes[entry.name]
+                outcome.up_to_date = True
+                outcome.succeeded = True
+                outcome.wall_time = time.perf_counter() - self.started_at
+            else:
+                entries.append(entry)
+
+        return entries
+
+    def install_toolchain(self, entry: BuildConfigEntry) -> float:
+        started_at = time.perf_counter()
+        label = golang.get_toolchain_label(entry.go_url)
+        golang.install_go(self.workspace, entry.go_url, environment_label=label, cache=self.cache, checksum=entry.go_checksum, stream=self.stream_archives)
+        return time.perf_counter() - started_at
+
+    def download_source(self, entry: BuildConfigEntry) -> float:
+        started_at = time.perf_counter()
+        do_download(self.workspace, entry, self.cache, self.stream_archives)
+        return time.perf_counter() - started_at
+
+    def download_modules(self, entry: BuildConfigEntry) -> float:
+        started_at = time.perf_counter()
+        environment = self.get_environment(entry)
+        source_folder = get_source_folder(self.workspace / entry.name)
+        outcome = self.outcomes[entry.name]
+
+        outcome.modules = golang.download_modules(source_folder, environment, self.cached_modules)
+        print(f"{entry.name}: {outcome.modules.num_modules} Go modules, {outcome.modules.num_cached} of them already in the cache.")
+
+        if self.caches.modules_mirror is not None and not self.caches.offline:
+            golang.update_modules_mirror(environment, self.caches.modules_mirror)
+
+        return time.perf_counter() - started_at
+
+    def get_environment(self, entry: BuildConfigEntry) -> golang.BuildEnvironment:
+        label = golang.get_toolchain_label(entry.go_url)
+        return golang.acquire_environment(self.workspace, label=label, caches=self.caches)
+
+    def build_entry(self, entry: BuildConfigEntry) -> bool:
+        # Builds already queued when another one fails are skipped, in "fail fast" mode.
+        if self.stopping:
+            return False
+
+        try:
+            self._do_build_entry(entry)
+        except BaseException:
+            if self.fail_fast:
+                self.stopping = True
+            raise
+
+        return True
+
+    def _do_build_entry(self, entry: BuildConfigEntry):
+        outcome = self.outcomes[entry.name]
+        build_environment = self.get_environment(entry)
+        source_parent_folder = self.workspace / entry.name
+        log_path = self.get_log_path(entry)
+
+        # The destination folder is about to be replaced.
+        self.manifest.forget(entry)
+
+        started_at = time.perf_counter()
+        cmd_node_folder, outcome.build_cache = do_build(source_parent_folder, build_environment, self.artifact_store, log_path)
+        outcome.durations["build"] = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        deploy_artifacts(cmd_node_folder, entry, self.artifact_store)
+        outcome.durations["copy"] = time.perf_counter() - started_at
+
+        go_mod = get_source_folder(source_parent_folder) / "go.mod"
+        chain_vm = get_chain_vm_go_folder_name(go_mod)
+        chain_vm_go_mod = Path(build_environment.go_mod_cache) / chain_vm / "go.mod"
+        destination_folder = Path(entry.destination_folder).expanduser().resolve()
+        record = create_record(entry, chain_vm, chain_vm_go_mod, destination_folder)
+        self.manifest.add(record, destination_folder)
+
+    def get_log_path(self, entry: BuildConfigEntry) -> Optional[Path]:
+        # When building one entry at a time, the output of "go build" is shown directly.
+        if self.jobs == 1:
+            return None
+
+        logs_folder = self.workspace / "logs"
+        logs_folder.mkdir(parents=True, exist_ok=True)
+        return logs_folder / f"{entry.name}.log"
+
+    def on_failure(self, outcome: BuildOutcome, error: BaseException):
+        outcome.error = error
+        outcome.wall_time = time.perf_counter() - self.started_at
+
+        pretty_error = error.get_pretty() if isinstance(error, errors.KnownError) else repr(error)
+        print(Panel(f"[red]{outcome.entry.name}: {escape(pretty_error)}"))
+
+        if self.fail_fast:
+            self.stopping = True
+
+
+def get_future_error(future: "Future[Any]") -> Optional[BaseException]:
+    if future.cancelled():
+        return errors.KnownError("cancelled")
+    return future.exception()
+
+
+def print_outcomes(outcomes: list[BuildOutcome]):
+    table = Table(title="Builds")
+    table.add_column("Entry")
+    table.add_column("Outcome")
+    table.add_column("Toolchain (s)", justify="right")
+    table.add_column("Source (s)", justify="right")
+    table.add_column("Modules (s)", justify="right")
+    table.add_column("Modules cached", justify="right")
+    table.add_column("Build (s)", justify="right")
+    table.add_column("Packages cached", justify="right")
+    table.add_column("Copy (s)", justify="right")
+    table.add_column("Done after (s)", justify="right")
+
+    def format_duration(value: Optional[float]) -> str:
+        return f"{value:.1f}" if value is not None else "-"
+
+    def format_ratio(hits: int, total: int) -> str:
+        return f"{hits}/{total} ({hits / total:.0%})" if total else "-"
+
+    modules_hits, modules_total, packages_hits, packages_total = 0, 0, 0, 0
+
+    for outcome in outcomes:
+        if outcome.up_to_date:
+            status = "[green]up to date"
+        elif outcome.succeeded:
+            status = "[green]built"
+        elif outcome.skipped:
+            status = "[yellow]skipped"
+        else:
+            status = "[red]failed"
+
+        modules = outcome.modules or golang.ModulesStatistics(0, 0)
+        build_cache = outcome.build_cache or golang.BuildCacheStatistics(0, 0)
+        modules_hits += modules.num_cached
+        modules_total += modules.num_modules
+        packages_hits += build_cache.get_num_cached()
+        packages_total += build_cache.num_packages
+
+        table.add_row(
+            outcome.entry.name,
+            status,
+            format_duration(outcome.durations.get("toolchain")),
+            format_duration(outcome.durations.get("source")),
+            format_duration(outcome.durations.get("modules")),
+            format_ratio(modules.num_cached, modules.num_modules),
+            format_duration(outcome.durations.get("build")),
+            format_ratio(build_cache.get_num_cached(), build_cache.num_packages),
+            format_duration(outcome.durations.get("copy")),
+            format_duration(outcome.wall_time),
+        )
+
+    print(table)
+
+    if modules_total or packages_total:
+        print(f"Cache hits: Go modules {format_ratio(modules_hits, modules_total)}, packages (build cache) {format_ratio(packages_hits, packages_total)}.")
+
+
+def do_download(workspace: Path, entry: BuildConfigEntry, cache: Optional[ArchiveCache] = None, stream: bool = False) -> Path:
     url = entry.source_url
     extraction_folder = workspace / entry.name
 
-    fetch_archive(url, extraction_folder)
+    fetch_archive(url, extraction_folder, cache, entry.source_checksum, stream)
     return extraction_folder
 
 
-def do_build(source_parent_folder: Path, environment: golang.BuildEnvironment) -> Path:
-    # If has one subfolder, that one is the source code
-    subfolders = [Path(item.path) for item in os.scandir(source_parent_folder) if item.is_dir()]
-    source_folder = subfolders[0] if len(subfolders) == 1 else source_parent_folder
-
+def do_build(source_parent_folder: Path,
+             environment: golang.BuildEnvironment,
+             artifact_store: ArtifactStore,
+             log_path: Optional[Path] = None) -> tuple[Path, golang.BuildCacheStatistics]:
+    source_folder = get_source_folder(source_parent_folder)
     cmd_node = source_folder / "cmd" / "node"
     go_mod = source_folder / "go.mod"
 
-    golang.build(cmd_node, environment)
-    copy_wasmer_libraries(environment, go_mod, cmd_node)
+    build_cache = golang.build(cmd_node, environment, log_path)
+    deploy_wasmer_libraries(environment, go_mod, cmd_node, artifact_store)
 
-    return cmd_node
+    return cmd_node, build_cache
 
 
-def copy_wasmer_libraries(build_environment: golang.BuildEnvironment, go_mod: Path, destination: Path):
-    go_path = Path(build_environment.go_path).expanduser().resolve()
+def get_source_folder(source_parent_folder: Path) -> Path:
+    # If has one subfolder, that one is the source code
+    subfolders = [Path(item.path) for item in os.scandir(source_parent_folder) if item.is_dir()]
+    return subfolders[0] if len(subfolders) == 1 else source_parent_folder
+
+
+def deploy_wasmer_libraries(build_environment: golang.BuildEnvironment, go_mod: Path, destination: Path, artifact_store: ArtifactStore):
     vm_go_folder_name = get_chain_vm_go_folder_name(go_mod)
-    vm_go_path = go_path / "pkg" / "mod" / vm_go_folder_name
+    vm_go_path = Path(build_environment.go_mod_cache) / vm_go_folder_name
     libraries = list((vm_go_path / "wasmer").glob("*.so")) + list((vm_go_path / "wasmer2").glob("*.so"))
 
     for library in libraries:
-        shutil.copy(library, destination)
-
-        os.chmod(destination / library.name, FILE_MODE_NICE)
+        artifact_store.add_and_deploy(library, destination / library.name)
 
 
 def get_chain_vm_go_folder_name(go_mod: Path) -> str:
@@ -96,19 +446,29 @@ def get_chain_vm_go_folder_name(go_mod: Path) -> str:
     return f"{parts[0]}@{parts[1]}"
 
 
-def copy_artifacts(cmd_node_folder: Path, entry: BuildConfigEntry):
-    print(f"Copying artifacts to {entry.destination_folder} ...")
+def deploy_artifacts(cmd_node_folder: Path, entry: BuildConfigEntry, artifact_store: ArtifactStore):
+    print(f"Deploying artifacts to {entry.destination_folder} ...")
 
     libraries = list(cmd_node_folder.glob("*.so"))
     executable = cmd_node_folder / "node"
     artifacts = libraries + [executable]
+    artifacts_names = [artifact.name for artifact in artifacts]
 
     destination_folder = Path(entry.destination_folder).expanduser().resolve()
-    shutil.rmtree(destination_folder, ignore_errors=True)
     destination_folder.mkdir(parents=True, exist_ok=True)
 
+    # Leftovers of a previous build (the build manifest is written afterwards).
+    for item in destination_folder.iterdir():
+        if item.name in artifacts_names or item.name == BUILD_MANIFEST_FILE_NAME:
+            continue
+
+        if item.is_dir() and not item.is_symlink():
+            shutil.rmtree(item)
+        else:
+            item.unlink()
+
     for artifact in artifacts:
-        shutil.copy(artifact, destination_folder)
+        artifact_store.add_and_deploy(artifact, destination_folder / artifact.name)
 
 
 if __name__ == "__main__":
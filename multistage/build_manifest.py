@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+from multistage.archive_cache import (compute_file_checksum,
+                                      normalize_checksum)
+from multistage.config import BuildConfigEntry
+from multistage.constants import BUILD_MANIFEST_FILE_NAME
+
+
+class ArtifactRecord:
+    def __init__(self, checksum: str, size: int, modified_time_ns: int) -> None:
+        self.checksum = checksum
+        self.size = size
+        self.modified_time_ns = modified_time_ns
+
+    @classmethod
+    def new_from_file(cls, path: Path):
+        stat = path.stat()
+
+        return cls(
+            checksum=compute_file_checksum(path),
+            size=stat.st_size,
+            modified_time_ns=stat.st_mtime_ns,
+        )
+
+    @classmethod
+    def new_from_dictionary(cls, data: dict[str, Any]):
+        return cls(
+            checksum=data.get("checksum") or "",
+            size=data.get("size") or 0,
+            modified_time_ns=data.get("modifiedTimeNs") or 0,
+        )
+
+    def to_dictionary(self) -> dict[str, Any]:
+        return {
+            "checksum": self.checksum,
+            "size": self.size,
+            "modifiedTimeNs": self.modified_time_ns,
+        }
+
+    def matches_file(self, path: Path) -> bool:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return False
+
+        if stat.st_size != self.size:
+            return False
+
+        # Fast path: same size & modification time, no need to compute the checksum.
+        if stat.st_mtime_ns == self.modified_time_ns:
+            return True
+
+        return compute_file_checksum(path) == self.checksum
+
+
+class BuildRecord:
+    def __init__(self,
+                 name: str,
+                 source_url: str,
+                 go_url: str,
+                 source_checksum: Optional[str],
+                 go_checksum: Optional[str],
+                 chain_vm: str,
+                 chain_vm_go_mod_checksum: str,
+                 artifacts: dict[str, ArtifactRecord]) -> None:
+        self.name = name
+        self.source_url = source_url
+        self.go_url = go_url
+        self.source_checksum = source_checksum
+        self.go_checksum = go_checksum
+        self.chain_vm = chain_vm
+        self.chain_vm_go_mod_checksum = chain_vm_go_mod_checksum
+        self.artifacts = artifacts
+
+    @classmethod
+    def new_from_dictionary(cls, data: dict[str, Any]):
+        artifacts_records = data.get("artifacts") or {}
+
+        return cls(
+            name=data.get("name") or "",
+            source_url=data.get("sourceUrl") or "",
+            go_url=data.get("goUrl") or "",
+            source_checksum=data.get("sourceChecksum"),
+            go_checksum=data.get("goChecksum"),
+            chain_vm=data.get("chainVm") or "",
+            chain_vm_go_mod_checksum=data.get("chainVmGoModChecksum") or "",
+            artifacts={name: ArtifactRecord.new_from_dictionary(record) for name, record in artifacts_records.items()},
+        )
+
+    def to_dictionary(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "sourceUrl": self.source_url,
+            "goUrl": self.go_url,
+            "sourceChecksum": self.source_checksum,
+            "goChecksum": self.go_checksum,
+            "chainVm": self.chain_vm,
+            "chainVmGoModChecksum": self.chain_vm_go_mod_checksum,
+            "artifacts": {name: record.to_dictionary() for name, record in self.artifacts.items()},
+        }
+
+    def has_same_inputs(self, entry: BuildConfigEntry) -> bool:
+        return all([
+            self.name == entry.name,
+            self.source_url == entry.source_url,
+            self.go_url == entry.go_url,
+            normalize_checksum(self.source_checksum) == normalize_checksum(entry.source_checksum),
+            normalize_checksum(self.go_checksum) == normalize_checksum(entry.go_checksum),
+        ])
+
+    def has_artifacts_in(self, folder: Path) -> bool:
+        if not self.artifacts:
+            return False
+
+        return all(record.matches_file(folder / name) for name, record in self.artifacts.items())
+
+
+# Records the inputs and outputs of the builds, both in the workspace (all entries) and in each destination folder (one entry).
+class BuildManifest:
+    def __init__(self, workspace: Path) -> None:
+        self.path = workspace / BUILD_MANIFEST_FILE_NAME
+        self.lock = threading.Lock()
+        self.records: dict[str, BuildRecord] = {}
+
+        if self.path.exists():
+            data: dict[str, Any] = json.loads(self.path.read_text())
+            self.records = {name: BuildRecord.new_from_dictionary(record) for name, record in data.items()}
+
+    def is_up_to_date(self, entry: BuildConfigEntry) -> bool:
+        record = self.records.get(entry.name)
+        if record is None or not record.has_same_inputs(entry):
+            return False
+
+        destination_folder = Path(entry.destination_folder).expanduser().resolve()
+        destination_record = load_destination_record(destination_folder)
+        if destination_record is None or destination_record.to_dictionary() != record.to_dictionary():
+            return False
+
+        return record.has_artifacts_in(destination_folder)
+
+    def forget(self, entry: BuildConfigEntry):
+        with self.lock:
+            self.records.pop(entry.name, None)
+            self._save()
+
+    def add(self, record: BuildRecord, destination_folder: Path):
+        write_json_atomically(destination_folder / BUILD_MANIFEST_FILE_NAME, record.to_dictionary())
+
+        with self.lock:
+            self.records[record.name] = record
+            self._save()
+
+    def _save(self):
+        data = {name: record.to_dictionary() for name, record in self.records.items()}
+        write_json_atomically(self.path, data)
+
+
+def create_record(entry: BuildConfigEntry, chain_vm: str, chain_vm_go_mod: Path, destination_folder: Path) -> BuildRecord:
+    artifacts = [item for item in destination_folder.iterdir() if item.is_file() and item.name != BUILD_MANIFEST_FILE_NAME]
+    chain_vm_go_mod_checksum = compute_file_checksum(chain_vm_go_mod) if chain_vm_go_mod.exists() else ""
+
+    return BuildRecord(
+        name=entry.name,
+        source_url=entry.source_url,
+        go_url=entry.go_url,
+        source_checksum=entry.source_checksum,
+        go_checksum=entry.go_checksum,
+        chain_vm=chain_vm,
+        chain_vm_go_mod_checksum=chain_vm_go_mod_checksum,
+        artifacts={item.name: ArtifactRecord.new_from_file(item) for item in sorted(artifacts)},
+    )
+
+
+def load_destination_record(destination_folder: Path) -> Optional[BuildRecord]:
+    path = destination_folder / BUILD_MANIFEST_FILE_NAME
+
+    try:
+        return BuildRecord.new_from_dictionary(json.loads(path.read_text()))
+    except (OSError, ValueError):
+        return None
+
+
+def write_json_atomically(path: Path, data: Any):
+    temporary_path = path.with_suffix(f".{os.getpid()}.tmp")
+    temporary_path.write_text(json.dumps(data, indent=4))
+    os.replace(temporary_path, path)
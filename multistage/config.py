@@ -1,13 +1,33 @@
 
 
+import re
+import signal
 from pathlib import Path
-from typing import Any
+from string import Template
+from typing import Any, Optional
 
 from multistage import errors
+from multistage.constants import (CGROUP_DEFAULT_PARENT, IONICE_CLASSES,
+                                  NODE_PROGRESS_DEFAULT_SOURCE,
+                                  NODE_PROGRESS_SOURCES,
+                                  NODE_STOP_DEFAULT_GRACE_PERIOD,
+                                  NODE_STOP_DEFAULT_SIGNAL, NODE_STOP_SIGNALS,
+                                  SIZE_SUFFIXES, SNAPSHOT_METHODS,
+                                  SNAPSHOTS_DEFAULT_KEEP,
+                                  SNAPSHOTS_DEFAULT_THREADS,
+                                  SNAPSHOTS_FOLDER_NAME,
+                                  SUPERVISOR_DEFAULT_BACKOFF,
+                                  SUPERVISOR_DEFAULT_BACKOFF_MAX)
 
 
 class BuildConfigEntry:
-    def __init__(self, name: str, go_url: str, source_url: str, destination_folder: str) -> None:
+    def __init__(self,
+                 name: str,
+                 go_url: str,
+                 source_url: str,
+                 destination_folder: str,
+                 go_checksum: Optional[str] = None,
+                 source_checksum: Optional[str] = None) -> None:
         if not name:
             raise errors.KnownError("build 'name' is required")
         if not go_url:
@@ -21,6 +41,8 @@ class BuildConfigEntry:
         self.go_url = go_url
         self.source_url = source_url
         self.destination_folder = destination_folder
+        self.go_checksum = go_checksum
+        self.source_checksum = source_checksum
 
     @classmethod
     def new_from_dictionary(cls, data: dict[str, Any]):
@@ -28,34 +50,51 @@ class BuildConfigEntry:
         go_url = data.get("goUrl") or ""
         source_url = data.get("sourceUrl") or ""
         destination_folder = data.get("destinationFolder") or ""
+        go_checksum = data.get("goChecksum")
+        source_checksum = data.get("sourceChecksum")
 
         return cls(
             name=name,
             go_url=go_url,
             source_url=source_url,
             destination_folder=destination_folder,
+            go_checksum=go_checksum,
+            source_checksum=source_checksum,
         )
 
 
 class DriverConfig:
-    def __init__(self, lanes: list["LaneConfig"]) -> None:
+    def __init__(self, lanes: list["LaneConfig"], agents: Optional[dict[str, str]] = None) -> None:
         lanes_names = [lane.name for lane in lanes]
+        agents = agents or {}
 
         if not lanes:
             raise errors.BadConfigurationError("'lanes' are required")
         if len(lanes_names) > len(set(lanes_names)):
             raise errors.BadConfigurationError("lanes names must be unique")
 
+        for lane in lanes:
+            if lane.host is not None and lane.host not in agents:
+                raise errors.BadConfigurationError(f"for lane {lane.name}, unknown host: {lane.host} (not in 'agents')")
+
         self.lanes = lanes
         self.lanes_by_name = {lane.name: lane for lane in lanes}
+        # Addresses of the agents (see "agent"), by host name: "unix:<path>" or "<host>:<port>".
+        self.agents = agents
 
     @classmethod
     def new_from_dictionary(cls, data: dict[str, Any]):
-        lanes_records = data.get("lanes") or []
+        lanes_records = list(data.get("lanes") or [])
+        # Lanes that only differ by a few values (e.g. shard, port, working directory) can be declared once, as a template.
+        for template_record in data.get("laneTemplates") or []:
+            lanes_records.extend(expand_lane_template(template_record))
+
         lanes = [LaneConfig.new_from_dictionary(record) for record in lanes_records]
+        agents = data.get("agents") or {}
 
         return cls(
             lanes=lanes,
+            agents=agents,
         )
 
     def get_lanes_names(self) -> list[str]:
@@ -66,7 +105,13 @@ class DriverConfig:
 
 
 class LaneConfig:
-    def __init__(self, name: str, working_directory: str, stages: list["StageConfig"]) -> None:
+    def __init__(self,
+                 name: str,
+                 working_directory: str,
+                 stages: list["StageConfig"],
+                 snapshots: Optional["SnapshotsConfig"] = None,
+                 import_db_source: Optional[str] = None,
+                 host: Optional[str] = None) -> None:
         stages_names = [stage.name for stage in stages]
 
         if not name:
@@ -82,23 +127,62 @@ class LaneConfig:
         self.working_directory = Path(working_directory).expanduser().resolve()
         self.stages = stages
         self.stages_by_name = {stage.name: stage for stage in stages}
+        # None if snapshots (of the database, at stage boundaries) are disabled.
+        self.snapshots = snapshots
+        # Existing database, to be copied (provisioned) into the "import-db" folder(s) of the lane.
+        self.import_db_source = Path(import_db_source).expanduser().resolve() if import_db_source else None
+        # Host (agent) in charge of the lane, when driven by a coordinator.
+        self.host = host
 
     @classmethod
     def new_from_dictionary(cls, data: dict[str, Any]):
         name = data.get("name") or ""
         working_directory = data.get("workingDirectory") or ""
+        snapshots_record = data.get("snapshots")
+        import_db_source = data.get("importDbSource")
+        host = data.get("host")
         stages_records = data.get("stages") or []
-        stages = [StageConfig.new_from_dictionary(record) for record in stages_records]
+        # Resources of the lane apply to all its stages (which can override them, setting by setting).
+        lane_resources = data.get("resources") or {}
+        # Same for the supervisor policy.
+        lane_supervisor = data.get("supervisor") or {}
+        stages = [StageConfig.new_from_dictionary({
+            **record,
+            "resources": {**lane_resources, **(record.get("resources") or {})},
+            "supervisor": {**lane_supervisor, **(record.get("supervisor") or {})},
+        }) for record in stages_records]
+
+        snapshots = SnapshotsConfig.new_from_dictionary(snapshots_record, name, working_directory) if snapshots_record is not None else None
 
         return cls(
             name=name,
             working_directory=working_directory,
             stages=stages,
+            snapshots=snapshots,
+            import_db_source=import_db_source,
+            host=host,
         )
 
     def get_stages_names(self) -> list[str]:
         return [stage.name for stage in self.stages]
 
+    def get_stage(self, stage_name: str) -> "StageConfig":
+        for stage in self.stages:
+            if stage.name == stage_name:
+                return stage
+
+        raise errors.BadConfigurationError(f"unknown stage: {stage_name} (lane {self.name})")
+
+    def get_import_db_paths(self) -> list[Path]:
+        paths: list[Path] = []
+
+        for stage in self.stages:
+            path = stage.get_import_db_path(self.working_directory)
+            if path is not None and path not in paths:
+                paths.append(path)
+
+        return paths
+
     def get_stages_including_and_after(self, initial_stage_name: str) -> list["StageConfig"]:
         stages_names = self.get_stages_names()
         index_of_initial_stage_name = stages_names.index(initial_stage_name)
@@ -114,17 +198,34 @@ class StageConfig:
                  bin: str,
                  node_arguments: list[str],
                  with_db_lookup_extensions: bool,
-                 with_indexing: bool) -> None:
+                 with_indexing: bool,
+                 configuration_archive_checksum: Optional[str] = None,
+                 until_nonce: Optional[int] = None,
+                 until_round: Optional[int] = None,
+                 stop_signal: str = NODE_STOP_DEFAULT_SIGNAL,
+                 stop_grace_period: float = NODE_STOP_DEFAULT_GRACE_PERIOD,
+                 progress_source: str = NODE_PROGRESS_DEFAULT_SOURCE,
+                 resources: Optional["ResourcesConfig"] = None,
+                 heavy: Optional[bool] = None,
+                 supervisor: Optional["SupervisorConfig"] = None) -> None:
         if not name:
             raise errors.BadConfigurationError("for all stages, 'name' is required")
-        if not until_epoch:
-            raise errors.BadConfigurationError(f"for stage {name}, 'until epoch' is required")
+        if not until_epoch and until_nonce is None and until_round is None:
+            raise errors.BadConfigurationError(f"for stage {name}, 'until epoch' (or 'until nonce', or 'until round') is required")
         if not node_status_url:
             raise errors.BadConfigurationError(f"for stage {name}, 'node status url' is required")
         if not configuration_archive:
             raise errors.BadConfigurationError(f"for stage {name}, 'configuration archive' is required")
         if not bin:
             raise errors.BadConfigurationError(f"for stage {name}, 'bin' is required")
+        if stop_signal not in NODE_STOP_SIGNALS:
+            raise errors.BadConfigurationError(f"for stage {name}, 'stop signal' should be one of: {', '.join(NODE_STOP_SIGNALS)}")
+        if stop_grace_period < 0:
+            raise errors.BadConfigurationError(f"for stage {name}, 'stop grace period' cannot be negative")
+        if progress_source not in NODE_PROGRESS_SOURCES:
+            raise errors.BadConfigurationError(f"for stage {name}, 'progress source' should be one of: {', '.join(NODE_PROGRESS_SOURCES)}")
+        if progress_source == "logs" and "--log-save" not in node_arguments:
+            raise errors.BadConfigurationError(f"for stage {name}, 'progress source' = 'logs' requires the node argument '--log-save'")
 
         self.name = name
         self.until_epoch = until_epoch
@@ -134,6 +235,16 @@ class StageConfig:
         self.node_arguments = node_arguments
         self.with_db_lookup_extensions = with_db_lookup_extensions
         self.with_indexing = with_indexing
+        self.configuration_archive_checksum = configuration_archive_checksum
+        self.until_nonce = until_nonce
+        self.until_round = until_round
+        self.stop_signal = signal.Signals[stop_signal]
+        self.stop_grace_period = stop_grace_period
+        self.progress_source = progress_source
+        self.resources = resources or ResourcesConfig()
+        # Heavy stages (by default, the ones importing a database) are subject to admission control.
+        self.heavy = heavy if heavy is not None else any(arg.startswith("--import-db") for arg in node_arguments)
+        self.supervisor = supervisor or SupervisorConfig()
 
     @classmethod
     def new_from_dictionary(cls, data: dict[str, Any]):
@@ -145,6 +256,16 @@ class StageConfig:
         node_arguments = data.get("nodeArguments") or []
         with_db_lookup_extensions = data.get("withDbLookupExtensions") or False
         with_indexing = data.get("withIndexing") or False
+        configuration_archive_checksum = data.get("configurationArchiveChecksum")
+        until_nonce = data.get("untilNonce")
+        until_round = data.get("untilRound")
+        stop_signal = data.get("stopSignal") or NODE_STOP_DEFAULT_SIGNAL
+        stop_grace_period = data.get("stopGracePeriod")
+        stop_grace_period = NODE_STOP_DEFAULT_GRACE_PERIOD if stop_grace_period is None else stop_grace_period
+        progress_source = data.get("progressSource") or NODE_PROGRESS_DEFAULT_SOURCE
+        resources = ResourcesConfig.new_from_dictionary(data.get("resources") or {}, name)
+        heavy = data.get("heavy")
+        supervisor = SupervisorConfig.new_from_dictionary(data.get("supervisor") or {}, name)
 
         return cls(
             name=name,
@@ -155,4 +276,235 @@ class StageConfig:
             node_arguments=node_arguments,
             with_db_lookup_extensions=with_db_lookup_extensions,
             with_indexing=with_indexing,
+            configuration_archive_checksum=configuration_archive_checksum,
+            until_nonce=until_nonce,
+            until_round=until_round,
+            stop_signal=stop_signal,
+            stop_grace_period=stop_grace_period,
+            progress_source=progress_source,
+            resources=resources,
+            heavy=heavy,
+            supervisor=supervisor,
+        )
+
+    # E.g. "--import-db=~/drt-nodes/shard-0/import-db", or "--import-db", "~/drt-nodes/shard-0/import-db".
+    # Relative paths are relative to the working directory (of the node).
+    def get_import_db_path(self, working_directory: Path) -> Optional[Path]:
+        for index, arg in enumerate(self.node_arguments):
+            if arg.startswith("--import-db="):
+                return (working_directory / Path(arg.split("=", 1)[1]).expanduser()).resolve()
+            if arg == "--import-db" and index + 1 < len(self.node_arguments):
+                return (working_directory / Path(self.node_arguments[index + 1]).expanduser()).resolve()
+
+        return None
+
+
+# Snapshots of the database of a lane, taken at stage boundaries.
+class SnapshotsConfig:
+    def __init__(self, folder: str, keep: int = SNAPSHOTS_DEFAULT_KEEP, method: str = "auto", threads: int = SNAPSHOTS_DEFAULT_THREADS) -> None:
+        if keep < 1:
+            raise errors.BadConfigurationError("for snapshots, 'keep' must be positive")
+        if method not in SNAPSHOT_METHODS:
+            raise errors.BadConfigurationError(f"for snapshots, 'method' should be one of: {', '.join(SNAPSHOT_METHODS)}")
+        if threads < 1:
+            raise errors.BadConfigurationError("for snapshots, 'threads' must be positive")
+
+        self.folder = Path(folder).expanduser().resolve()
+        self.keep = keep
+        self.method = method
+        self.threads = threads
+
+    @classmethod
+    def new_from_dictionary(cls, data: dict[str, Any], lane_name: str, working_directory: str):
+        if not working_directory:
+            raise errors.BadConfigurationError(f"for lane {lane_name}, 'working directory' is required")
+
+        # By default, next to the database (same filesystem, thus reflinks or hardlinks can be used).
+        folder = data.get("folder") or str(Path(working_directory).expanduser() / SNAPSHOTS_FOLDER_NAME)
+        keep = data.get("keep") or SNAPSHOTS_DEFAULT_KEEP
+        method = data.get("method") or "auto"
+        threads = data.get("threads") or SNAPSHOTS_DEFAULT_THREADS
+
+        return cls(
+            folder=folder,
+            keep=keep,
+            method=method,
+            threads=threads,
+        )
+
+
+# Limits & priorities of a node process (all optional).
+class ResourcesConfig:
+    def __init__(self,
+                 max_open_files: Optional[int] = None,
+                 nice: Optional[int] = None,
+                 ionice_class: Optional[str] = None,
+                 ionice_level: Optional[int] = None,
+                 cpu_affinity: Optional[list[int]] = None,
+                 memory_max: Optional[int] = None,
+                 io_weight: Optional[int] = None,
+                 cgroup_parent: str = CGROUP_DEFAULT_PARENT) -> None:
+        self.max_open_files = max_open_files
+        self.nice = nice
+        self.ionice_class = ionice_class
+        self.ionice_level = ionice_level
+        self.cpu_affinity = cpu_affinity
+        self.memory_max = memory_max
+        self.io_weight = io_weight
+        self.cgroup_parent = Path(cgroup_parent)
+
+    @classmethod
+    def new_from_dictionary(cls, data: dict[str, Any], stage_name: str):
+        max_open_files = data.get("maxOpenFiles")
+        nice = data.get("nice")
+        ionice_class = data.get("ioniceClass")
+        ionice_level = data.get("ioniceLevel")
+        cpu_affinity = data.get("cpuAffinity")
+        memory_max = data.get("memoryMax")
+        io_weight = data.get("ioWeight")
+        cgroup_parent = data.get("cgroupParent") or CGROUP_DEFAULT_PARENT
+
+        if max_open_files is not None and max_open_files < 1:
+            raise errors.BadConfigurationError(f"for stage {stage_name}, 'max open files' must be positive")
+        if nice is not None and not -20 <= nice <= 19:
+            raise errors.BadConfigurationError(f"for stage {stage_name}, 'nice' must be between -20 and 19")
+        if ionice_class is not None and ionice_class not in IONICE_CLASSES:
+            raise errors.BadConfigurationError(f"for stage {stage_name}, 'ionice class' should be one of: {', '.join(IONICE_CLASSES)}")
+        if ionice_level is not None and not 0 <= ionice_level <= 7:
+            raise errors.BadConfigurationError(f"for stage {stage_name}, 'ionice level' must be between 0 and 7")
+        if io_weight is not None and not 1 <= io_weight <= 10000:
+            raise errors.BadConfigurationError(f"for stage {stage_name}, 'io weight' must be between 1 and 10000")
+
+        return cls(
+            max_open_files=max_open_files,
+            nice=nice,
+            ionice_class=ionice_class,
+            ionice_level=ionice_level,
+            cpu_affinity=parse_cpu_list(cpu_affinity, stage_name) if cpu_affinity is not None else None,
+            memory_max=parse_size(memory_max, stage_name) if memory_max is not None else None,
+            io_weight=io_weight,
+            cgroup_parent=cgroup_parent,
+        )
+
+    def requires_launcher(self) -> bool:
+        return any(item is not None for item in [self.max_open_files, self.nice, self.ionice_class, self.ionice_level, self.cpu_affinity])
+
+    def requires_cgroup(self) -> bool:
+        return self.memory_max is not None or self.io_weight is not None
+
+
+# What to do when the node of a stage stalls (makes no progress) or crashes. By default, nothing: the lane stops.
+class SupervisorConfig:
+    def __init__(self,
+                 stall_window: Optional[float] = None,
+                 max_restarts: int = 0,
+                 backoff: float = SUPERVISOR_DEFAULT_BACKOFF,
+                 backoff_max: float = SUPERVISOR_DEFAULT_BACKOFF_MAX) -> None:
+        # The node is stalled if its block (nonce) does not advance for this long (in seconds). None: no stall detection.
+        self.stall_window = stall_window
+        # Restarts of the node (per stage), with an exponential backoff: "backoff", then twice as much etc., up to "backoff max".
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+    @classmethod
+    def new_from_dictionary(cls, data: dict[str, Any], stage_name: str):
+        stall_window = data.get("stallWindow")
+        max_restarts = data.get("maxRestarts") or 0
+        backoff = data.get("restartBackoff")
+        backoff = SUPERVISOR_DEFAULT_BACKOFF if backoff is None else backoff
+        backoff_max = data.get("restartBackoffMax")
+        backoff_max = SUPERVISOR_DEFAULT_BACKOFF_MAX if backoff_max is None else backoff_max
+
+        if stall_window is not None and stall_window <= 0:
+            raise errors.BadConfigurationError(f"for stage {stage_name}, 'stall window' must be positive")
+        if max_restarts < 0:
+            raise errors.BadConfigurationError(f"for stage {stage_name}, 'max restarts' cannot be negative")
+        if backoff < 0 or backoff_max < backoff:
+            raise errors.BadConfigurationError(f"for stage {stage_name}, 'restart backoff' cannot be negative (nor exceed 'restart backoff max')")
+
+        return cls(
+            stall_window=stall_window,
+            max_restarts=max_restarts,
+            backoff=backoff,
+            backoff_max=backoff_max,
         )
+
+    # Delay before the given restart (counted from 0).
+    def get_backoff(self, restart: int) -> float:
+        return min(self.backoff * 2 ** restart, self.backoff_max)
+
+
+# E.g. {"instances": [{"shard": 0, "port": 8080}, {"shard": 1, "port": 8081}], "lane": {"name": "shard_${shard}", ...}}.
+# Each instance yields a lane: placeholders, in all strings of the lane record, are replaced by the variables of the instance,
+# which override the ones common to all instances ("variables"); "${index}" is the position of the instance.
+def expand_lane_template(data: dict[str, Any]) -> list[dict[str, Any]]:
+    lane_record = data.get("lane")
+    common_variables = data.get("variables") or {}
+    instances = data.get("instances") or []
+
+    if not isinstance(lane_record, dict):
+        raise errors.BadConfigurationError("for all lane templates, 'lane' is required")
+    if not instances or not all(isinstance(instance, dict) for instance in instances):
+        raise errors.BadConfigurationError("for all lane templates, 'instances' are required (variables, as objects)")
+
+    lanes_records: list[dict[str, Any]] = []
+
+    for index, instance in enumerate(instances):
+        variables = {"index": index, **common_variables, **instance}
+        lanes_records.append(substitute_variables(lane_record, variables))
+
+    return lanes_records
+
+
+# A string that is a single placeholder (e.g. "${port}") takes the value of the variable as is (e.g. a number).
+def substitute_variables(value: Any, variables: dict[str, Any]) -> Any:
+    if isinstance(value, dict):
+        return {key: substitute_variables(item, variables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [substitute_variables(item, variables) for item in value]
+    if not isinstance(value, str):
+        return value
+
+    single_placeholder = re.fullmatch(r"\$\{(\w+)\}", value)
+    if single_placeholder and single_placeholder.group(1) in variables:
+        return variables[single_placeholder.group(1)]
+
+    try:
+        return Template(value).substitute(variables)
+    except KeyError as error:
+        raise errors.BadConfigurationError(f"for lane templates, unknown variable: {error.args[0]} (in {value!r})")
+    except ValueError:
+        raise errors.BadConfigurationError(f"for lane templates, bad placeholder (use '${{name}}', or '$$' for '$'): {value!r}")
+
+
+# E.g. [0, 1, 2, 3], or "0-3,8".
+def parse_cpu_list(value: Any, stage_name: str) -> list[int]:
+    if isinstance(value, list):
+        return [int(item) for item in value]
+
+    cpus: list[int] = []
+
+    try:
+        for part in str(value).split(","):
+            first, _, last = part.strip().partition("-")
+            cpus.extend(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise errors.BadConfigurationError(f"for stage {stage_name}, bad 'cpu affinity': {value}")
+
+    return cpus
+
+
+# E.g. 8589934592, or "8G".
+def parse_size(value: Any, stage_name: str) -> int:
+    if isinstance(value, int):
+        return value
+
+    text = str(value).strip().upper()
+    multiplier = SIZE_SUFFIXES.get(text[-1:], 1)
+    number = text[:-1] if text[-1:] in SIZE_SUFFIXES else text
+
+    try:
+        return int(float(number) * multiplier)
+    except ValueError:
+        raise errors.BadConfigurationError(f"for stage {stage_name}, bad size: {value}")
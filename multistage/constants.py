@@ -1,11 +1,105 @@
 import stat
 
 METACHAIN_ID = 4294967295
+# Limit of open files (RLIMIT_NOFILE) for the nodes (inherited from the driver, unless overridden by the resources of a stage).
 NODE_PROCESS_ULIMIT = 1024 * 512
 NODE_MONITORING_PERIOD = 5
+NODE_MONITORING_MIN_PERIOD = 0.25
+NODE_MONITORING_MAX_PERIOD = 60
+PROGRESS_WINDOW_SIZE = 32
+PROGRESS_ETA_FRACTION = 0.5
+NODE_STATUS_TIMEOUT = 5
+NODE_STATUS_MAX_CONNECTIONS = 8
+NODE_STATUS_BACKOFF_BASE = 1
+NODE_STATUS_BACKOFF_MAX = 30
 NODE_RETURN_CODE_SUCCESS = 0
 NODE_RETURN_CODE_SIGKILL = -9
+NODE_STOP_SIGNALS = ["SIGTERM", "SIGINT", "SIGKILL"]
+NODE_STOP_DEFAULT_SIGNAL = "SIGTERM"
+NODE_STOP_DEFAULT_GRACE_PERIOD = 120
+NODE_PROGRESS_SOURCES = ["status", "output", "logs"]
+NODE_PROGRESS_DEFAULT_SOURCE = "status"
+NODE_OUTPUT_TAIL_LINES = 100
+NODE_LOGS_TAIL_PERIOD = 0.25
+NODE_LOGS_FOLDER_NAME = "logs"
+NODE_OUTPUT_DRAIN_TIMEOUT = 1
+DEFAULT_MAX_PARALLEL_TRANSITIONS = 2
+LANES_WILDCARD = "all"
 TEMPORARY_DIRECTORIES_PREFIX = "drt_chain_scripts_multistage_"
+STAGING_DIRECTORY_NAME = ".staging"
+LANE_JOURNAL_FILE_NAME = "lane_journal.jsonl"
+LANE_JOURNAL_PROGRESS_PERIOD = 60
+LANE_EVENTS_FILE_NAME = "lane_events.jsonl"
+RUN_HISTORY_DEFAULT_PATH = "~/.cache/drt-chain-multistage/history.sqlite"
+RUN_HISTORY_BUSY_TIMEOUT = 30
+RUN_HISTORY_SAMPLE_PERIOD = 60
+RUN_HISTORY_FORECAST_RUNS = 10
+# Runs slower than their history by this factor (or more) are flagged.
+RUN_HISTORY_SLOW_FACTOR = 1.5
+RPC_CONNECT_TIMEOUT = 10
+RPC_CALL_TIMEOUT = 30
+# Longest message (line) of the agents' protocol.
+RPC_STREAM_LIMIT = 16 * 1024 * 1024
+COORDINATOR_POLL_PERIOD = 5
+SUPERVISOR_DEFAULT_BACKOFF = 30
+SUPERVISOR_DEFAULT_BACKOFF_MAX = 600
+PREFLIGHT_WORKERS = 32
+PREFLIGHT_DEFAULT_MIN_FREE_DISK_GB = 50
+PREFLIGHT_MAX_LANES_SHOWN = 4
+PROFILER_SAMPLE_PERIOD = 5
+PROFILES_FOLDER_NAME = "profiles"
+NODE_DB_FOLDER_NAME = "db"
+SNAPSHOTS_FOLDER_NAME = "snapshots"
+SNAPSHOTS_DEFAULT_KEEP = 2
+SNAPSHOTS_DEFAULT_THREADS = 4
+SNAPSHOT_METHODS = ["auto", "reflink", "hardlink", "archive"]
+SNAPSHOT_MANIFEST_FILE_NAME = "snapshot.json"
+# Favor speed: snapshots are taken while no node is running.
+SNAPSHOT_ARCHIVE_COMPRESSION_LEVEL = 1
+IMPORT_DB_PROVISIONING_DEFAULT_THREADS = 8
+IMPORT_DB_MANIFEST_SUFFIX = ".provisioned.json"
+ARCHIVES_CACHE_DEFAULT_FOLDER = "~/.cache/drt-chain-multistage/archives"
+ARCHIVES_CACHE_DEFAULT_BUDGET_GB = 20
+ARCHIVES_CACHE_PARTIAL_MAX_AGE = 24 * 60 * 60
+ONE_MB = 1024 * 1024
+ONE_GB = 1024 * 1024 * 1024
+SIZE_SUFFIXES = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024, "T": 1024 * 1024 * 1024 * 1024}
+READ_CHUNK_SIZE = 1024 * 1024
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+DOWNLOAD_DEFAULT_SEGMENTS = 4
+DOWNLOAD_SEGMENTED_THRESHOLD = 64 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_CONNECT_TIMEOUT = 10
+DOWNLOAD_READ_TIMEOUT = 60
+DOWNLOAD_MAX_ATTEMPTS = 5
+DOWNLOAD_RETRY_BASE_DELAY = 2
+DOWNLOAD_POOL_SIZE = 16
+EXTRACTION_WORKERS = 8
+# Larger files are written by the reader itself (in order), instead of being buffered for the writers.
+EXTRACTION_MAX_BUFFERED_FILE_SIZE = 16 * 1024 * 1024
+EXTRACTION_MAX_BUFFERED_BYTES = 256 * 1024 * 1024
+IONICE_CLASSES = ["realtime", "best-effort", "idle"]
+CGROUP_DEFAULT_PARENT = "/sys/fs/cgroup/drt-multistage"
+ADMISSION_DEFAULT_FOLDER = "~/.cache/drt-chain-multistage/admission"
+ADMISSION_DEFAULT_MAX_HEAVY_STAGES = 0
+ADMISSION_RETRY_PERIOD = 5
+ARTIFACTS_STORE_DEFAULT_FOLDER = "~/.cache/drt-chain-multistage/artifacts"
+# Read and execute by all (no write: blobs are shared by hardlinks)
+ARTIFACTS_STORE_BLOB_MODE = stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH
+BUILD_DEFAULT_JOBS = 1
+BUILD_DOWNLOADS_PARALLELISM = 4
+BUILD_OUTPUT_TAIL_LINES = 30
+BUILD_MANIFEST_FILE_NAME = "build_manifest.json"
+GO_SHARED_FOLDER_NAME = "go_shared"
+GO_DEFAULT_PROXY = "https://proxy.golang.org,direct"
+BENCHMARK_DEFAULT_LANES = "1,10,100,500"
+BENCHMARK_DEFAULT_STAGES = 3
+BENCHMARK_DEFAULT_EPOCHS_PER_STAGE = 4
+BENCHMARK_DEFAULT_NONCES_PER_EPOCH = 100
+BENCHMARK_DEFAULT_BLOCKS_PER_SECOND = 20
+BENCHMARK_DEFAULT_SHUTDOWN_DELAY = 0.2
+BENCHMARK_LAG_PROBE_PERIOD = 0.1
+BENCHMARK_FAKE_NODE_STATE_FILE_NAME = "fake_node.state"
 
 # Read, write and execute by owner, read and execute by group and others
 FILE_MODE_NICE = stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH
@@ -0,0 +1,383 @@
+import asyncio
+import signal
+import sys
+import time
+import traceback
+from argparse import ArgumentParser
+from typing import Any, Optional
+
+from rich import print
+from rich.live import Live
+from rich.markup import escape
+from rich.panel import Panel
+from rich.table import Table
+
+from multistage import errors
+from multistage.config import DriverConfig, LaneConfig
+from multistage.constants import COORDINATOR_POLL_PERIOD, LANES_WILDCARD
+from multistage.driver import (load_driver_config, resolve_initial_stage_name,
+                               resolve_lanes_names)
+from multistage.progress import format_duration
+from multistage.rpc import RpcClient
+
+# States (as reported by the agents) after which a lane needs nothing more. "idle": unknown to the agent (e.g. restarted).
+FINAL_STATES = ["completed", "stopped", "failed", "idle"]
+
+
+def main(cli_args: list[str] = sys.argv[1:]):
+    try:
+        return _do_main(cli_args)
+    except errors.KnownError as err:
+        print(Panel(f"[red]{traceback.format_exc()}"))
+        print(Panel(f"[red]{err.get_pretty()}"))
+        return 1
+
+
+# Drives the lanes of a squad spanning several hosts, through their agents (see "agent"): each lane is handled by the agent of its "host".
+def _do_main(cli_args: list[str]):
+    parser = ArgumentParser()
+    parser.add_argument("--config", required=True, help="path of the 'driver' configuration file (with 'agents', and a 'host' for each lane)")
+    parser.add_argument("--lane", required=True, action="append", help=f"which lane to handle (can be repeated; '{LANES_WILDCARD}' for all lanes)")
+    initial_stage_group = parser.add_mutually_exclusive_group()
+    initial_stage_group.add_argument("--stage", help="initial stage on the lane(s) (default: the first stage of each lane)")
+    initial_stage_group.add_argument("--resume", action="store_true", default=False, help="resume each lane where it left off, according to its journal")
+    parser.add_argument("--max-parallel-heavy-stages", type=int, default=0, help="how many heavy stages (e.g. import-db) can run at the same time, across all hosts (default: no limit)")
+    parser.add_argument("--heavy-stages-stagger", type=float, default=0, help="minimum delay (in seconds) between the starts of heavy stages, across all hosts")
+    parser.add_argument("--poll-period", type=float, default=COORDINATOR_POLL_PERIOD, help="how often to ask the agents for the status of their lanes (in seconds)")
+    args = parser.parse_args(cli_args)
+
+    driver_config = load_driver_config(args.config)
+    lanes_names = resolve_lanes_names(driver_config, args.lane)
+    lanes: list[CoordinatedLane] = []
+
+    for lane_name in lanes_names:
+        lane_config = driver_config.get_lane(lane_name)
+
+        if lane_config.host is None:
+            raise errors.BadConfigurationError(f"for lane {lane_name}, 'host' is required (to be driven by a coordinator)")
+
+        initial_stage_name = None if args.resume else resolve_initial_stage_name(lane_config, args.stage)
+        lanes.append(CoordinatedLane(lane_config, initial_stage_name))
+
+    coordinator = Coordinator(
+        driver_config,
+        lanes,
+        resume=args.resume,
+        max_heavy_stages=args.max_parallel_heavy_stages,
+        stagger=args.heavy_stages_stagger,
+        poll_period=args.poll_period,
+    )
+
+    succeeded = coordinator.start()
+    return 0 if succeeded else 1
+
+
+# A lane, as seen by the coordinator: its last status, as reported by its agent.
+class CoordinatedLane:
+    def __init__(self, config: LaneConfig, initial_stage_name: Optional[str]) -> None:
+        assert config.host is not None
+
+        self.config = config
+        self.host = config.host
+        self.initial_stage_name = initial_stage_name
+        self.status: dict[str, Any] = {}
+        self.state = "pending"
+        # E.g. the agent is unreachable, or refused to start the lane.
+        self.problem: Optional[str] = None
+        # Since when the lane waits for a grant (for its heavy stage).
+        self.awaiting_grant_since: Optional[float] = None
+
+    def is_final(self) -> bool:
+        return self.state in FINAL_STATES
+
+    def is_awaiting_grant(self) -> bool:
+        return self.state == "running" and bool(self.status.get("awaitingGrant"))
+
+    # Granted (or not subject to grants), and not over.
+    def is_running_heavy_stage(self) -> bool:
+        return self.state == "running" and bool(self.status.get("heavy")) and not self.status.get("awaitingGrant")
+
+    def update(self, status: dict[str, Any]) -> Optional[str]:
+        previous_state = self.state
+        self.status = status
+        self.state = status.get("state") or "idle"
+        self.problem = None
+
+        if self.is_awaiting_grant():
+            self.awaiting_grant_since = self.awaiting_grant_since or time.time()
+        else:
+            self.awaiting_grant_since = None
+
+        return previous_state if previous_state != self.state else None
+
+
+class Coordinator:
+    def __init__(self,
+                 driver_config: DriverConfig,
+                 lanes: list[CoordinatedLane],
+                 resume: bool,
+                 max_heavy_stages: int,
+                 stagger: float,
+                 poll_period: float) -> None:
+        self.lanes = lanes
+        self.resume = resume
+        self.max_heavy_stages = max_heavy_stages
+        self.stagger = stagger
+        self.poll_period = poll_period
+        # One client per host (thus, one connection per agent).
+        hosts = sorted(set(lane.host for lane in lanes))
+        self.agents = {host: RpcClient(driver_config.agents[host]) for host in hosts}
+        self.last_grant_at = 0.0
+        self.stopping = asyncio.Event()
+        self.num_interrupts = 0
+
+    def start(self) -> bool:
+        asyncio.run(self._do_start())
+        print(self.render())
+        return all(lane.state == "completed" for lane in self.lanes)
+
+    async def _do_start(self):
+        loop = asyncio.get_running_loop()
+        main_task = asyncio.current_task()
+        assert main_task is not None
+
+        for signal_number in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signal_number, self.on_interrupt, main_task)
+
+        try:
+            await asyncio.gather(*[self.start_lane(lane) for lane in self.lanes])
+
+            with Live(self.render(), refresh_per_second=1, transient=True) as live:
+                while not all(lane.is_final() for lane in self.lanes):
+                    await self.start_pending_lanes()
+                    await self.poll()
+                    await self.grant_heavy_stages()
+                    live.update(self.render())
+
+                    try:
+                        await asyncio.wait_for(self.stopping.wait(), timeout=self.poll_period)
+                    except TimeoutError:
+                        continue
+
+                    self.stopping.clear()
+                    await self.stop_lanes()
+        except asyncio.CancelledError:
+            print("[yellow]Coordinator interrupted: the lanes still running on the agents are left as they are.")
+        finally:
+            for signal_number in [signal.SIGINT, signal.SIGTERM]:
+                loop.remove_signal_handler(signal_number)
+
+            for agent in self.agents.values():
+                agent.close()
+
+    # First interrupt: the lanes are stopped (gracefully, by their agents). Second one: the coordinator exits at once.
+    def on_interrupt(self, main_task: "asyncio.Task[None]"):
+        self.num_interrupts += 1
+
+        if self.num_interrupts == 1:
+            print("[yellow]Stopping all lanes (interrupt again to leave them running) ...")
+            self.stopping.set()
+        else:
+            main_task.cancel()
+
+    def get_start_params(self, lane: CoordinatedLane) -> dict[str, Any]:
+        # Heavy stages wait for the coordinator only if it has something to enforce.
+        coordinated = self.max_heavy_stages > 0 or self.stagger > 0
+
+        if self.resume:
+            return {"lane": lane.config.name, "resume": True, "coordinated": coordinated}
+
+        return {"lane": lane.config.name, "stage": lane.initial_stage_name, "coordinated": coordinated}
+
+    # A lane whose agent cannot be reached (e.g. not up yet) stays pending, and is started later (see "start_pending_lanes").
+    # It only fails if the agent refuses to start it.
+    async def start_lane(self, lane: CoordinatedLane):
+        try:
+            status = await self.agents[lane.host].call("start", **self.get_start_params(lane))
+        except errors.TransientError as error:
+            if lane.problem is None:
+                print(f"[yellow]{lane.config.name}: cannot reach the agent of {lane.host}, will retry:[/yellow] {escape(str(error))}")
+
+            lane.problem = f"agent unreachable ({error.inner or error}), will retry"
+            return
+        except errors.KnownError as error:
+            print(f"[red]{lane.config.name}: cannot start the lane on {lane.host}:[/red] {escape(str(error))}")
+            lane.state = "failed"
+            lane.problem = str(error)
+            return
+
+        lane.update(status)
+        print(f"{lane.config.name}: {lane.state} on {lane.host} (stage {status.get('stage') or '-'}).")
+
+    async def start_pending_lanes(self):
+        hosts = sorted(set(lane.host for lane in self.lanes if lane.state == "pending"))
+        await asyncio.gather(*[self.start_pending_lanes_of_agent(host) for host in hosts])
+
+    async def start_pending_lanes_of_agent(self, host: str):
+        lanes = [lane for lane in self.lanes if lane.host == host and lane.state == "pending"]
+
+        try:
+            result = await self.agents[host].call("status")
+        except errors.KnownError as error:
+            for lane in lanes:
+                lane.problem = f"agent unreachable ({error.inner or error}), will retry"
+            return
+
+        statuses = {status["lane"]: status for status in result.get("lanes") or []}
+
+        for lane in lanes:
+            status = statuses.get(lane.config.name)
+
+            # A previous request may have started the lane, after all (e.g. its response was lost).
+            if status is not None and status.get("state") == "running":
+                lane.update(status)
+                self.report_state_change(lane)
+                continue
+
+            await self.start_lane(lane)
+
+    async def poll(self):
+        await asyncio.gather(*[self.poll_agent(host) for host in self.agents])
+
+    # Pending lanes are not started yet: the agent would report them as idle.
+    async def poll_agent(self, host: str):
+        lanes = [lane for lane in self.lanes if lane.host == host and not lane.is_final() and lane.state != "pending"]
+        if not lanes:
+            return
+
+        try:
+            result = await self.agents[host].call("status")
+        except errors.KnownError as error:
+            for lane in lanes:
+                lane.problem = f"agent unreachable ({error.inner or error})"
+            return
+
+        statuses = {status["lane"]: status for status in result.get("lanes") or []}
+
+        for lane in lanes:
+            status = statuses.get(lane.config.name)
+
+            if status is None:
+                lane.state = "failed"
+                lane.problem = "unknown to the agent"
+                continue
+
+            previous_state = lane.update(status)
+            if previous_state is not None:
+                self.report_state_change(lane)
+
+    def report_state_change(self, lane: CoordinatedLane):
+        status = lane.status
+        color = {"completed": "green", "running": "yellow"}.get(lane.state, "red")
+        details = f" (return code = {status.get('returnCode')})" if lane.state == "failed" else ""
+        error = f": {escape(status['error'])}" if status.get("error") else ""
+
+        print(f"[{color}]{lane.config.name}: {lane.state} on {lane.host}, at stage {status.get('stage') or '-'}{details}{error}")
+
+    # Heavy stages (e.g. import-db) start one at a time (spaced by the stagger), up to the limit, on the least loaded hosts first.
+    async def grant_heavy_stages(self):
+        waiting = [lane for lane in self.lanes if lane.is_awaiting_grant()]
+        running = [lane for lane in self.lanes if lane.is_running_heavy_stage()]
+
+        while waiting:
+            if self.max_heavy_stages > 0 and len(running) >= self.max_heavy_stages:
+                return
+            if time.time() - self.last_grant_at < self.stagger:
+                return
+
+            lane = min(waiting, key=lambda item: (sum(1 for other in running if other.host == item.host), item.awaiting_grant_since or 0))
+            waiting.remove(lane)
+
+            try:
+                status = await self.agents[lane.host].call("admit", lane=lane.config.name)
+            except errors.KnownError as error:
+                print(f"[yellow]{lane.config.name}: cannot grant the heavy stage:[/yellow] {escape(str(error))}")
+                continue
+
+            print(f"[bold]{lane.config.name}: heavy stage {status.get('stage')} granted (on {lane.host}, {len(running) + 1} heavy stage(s) running).")
+            lane.update(status)
+            running.append(lane)
+            self.last_grant_at = time.time()
+
+    async def stop_lanes(self):
+        for lane in self.lanes:
+            if lane.state == "pending":
+                lane.state = "stopped"
+                lane.problem = "never started"
+
+        lanes = [lane for lane in self.lanes if not lane.is_final()]
+        await asyncio.gather(*[self.stop_lane(lane) for lane in lanes])
+
+    async def stop_lane(self, lane: CoordinatedLane):
+        try:
+            await self.agents[lane.host].call("stop", lane=lane.config.name)
+        except errors.KnownError as error:
+            print(f"[yellow]{lane.config.name}: cannot stop the lane:[/yellow] {escape(str(error))}")
+
+    def render(self) -> Table:
+        table = Table(title=f"Squad ({len(self.agents)} hosts, {sum(1 for lane in self.lanes if lane.is_final())}/{len(self.lanes)} lanes over)")
+        table.add_column("Lane")
+        table.add_column("Host")
+        table.add_column("State")
+        table.add_column("Stage")
+        table.add_column("Epoch")
+        table.add_column("Block")
+        table.add_column("Blocks/s")
+        table.add_column("Stage ETA")
+        table.add_column("Notes")
+
+        for lane in self.lanes:
+            status = lane.status
+            stages = status.get("stages") or lane.config.get_stages_names()
+            stage = status.get("stage")
+            stage_text = f"{stage} ({stages.index(stage) + 1}/{len(stages)})" if stage in stages else "-"
+            rate = status.get("blocksPerSecond")
+            eta = status.get("eta")
+
+            table.add_row(
+                lane.config.name,
+                lane.host,
+                format_state(lane.state),
+                stage_text,
+                format_optional(status.get("epoch")),
+                format_optional(status.get("nonce")),
+                f"{rate:.1f}" if rate else "-",
+                format_duration(eta) if eta is not None and lane.state == "running" else "-",
+                escape(get_notes(lane)),
+            )
+
+        return table
+
+
+def format_state(state: str) -> str:
+    color = {"completed": "green", "running": "yellow", "pending": "white"}.get(state, "red")
+    return f"[{color}]{state}"
+
+
+def format_optional(value: Optional[Any]) -> str:
+    return str(value) if value is not None else "-"
+
+
+def get_notes(lane: CoordinatedLane) -> str:
+    status = lane.status
+    notes: list[str] = []
+
+    if lane.problem:
+        notes.append(lane.problem)
+    if lane.is_awaiting_grant():
+        notes.append("heavy stage, waiting for its turn")
+    elif lane.is_running_heavy_stage():
+        notes.append("heavy stage")
+    if status.get("restarts"):
+        notes.append(f"{status['restarts']} restart(s)")
+    if status.get("error"):
+        notes.append(status["error"])
+    if lane.state == "failed" and status.get("returnCode") is not None:
+        notes.append(f"return code = {status['returnCode']}")
+
+    return ", ".join(notes)
+
+
+if __name__ == "__main__":
+    ret = main(sys.argv[1:])
+    sys.exit(ret)
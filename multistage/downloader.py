@@ -0,0 +1,562 @@
+import hashlib
+import io
+import math
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from rich import print
+from rich.progress import (BarColumn, DownloadColumn, Progress, TaskID,
+                           TextColumn, TimeRemainingColumn,
+                           TransferSpeedColumn)
+
+from multistage import errors
+from multistage.constants import (DOWNLOAD_CHUNK_SIZE,
+                                  DOWNLOAD_CONNECT_TIMEOUT,
+                                  DOWNLOAD_DEFAULT_SEGMENTS,
+                                  DOWNLOAD_MAX_ATTEMPTS, DOWNLOAD_POOL_SIZE,
+                                  DOWNLOAD_READ_TIMEOUT,
+                                  DOWNLOAD_RETRY_BASE_DELAY,
+                                  DOWNLOAD_SEGMENTED_THRESHOLD, ONE_MB)
+
+RETRYABLE_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class DownloadResult:
+    def __init__(self, url: str, checksum: str, size: int, downloaded_size: int, duration: float) -> None:
+        self.url = url
+        self.checksum = checksum
+        self.size = size
+        # Less than "size" when a partial download has been resumed.
+        self.downloaded_size = downloaded_size
+        self.duration = duration
+
+    def get_throughput(self) -> float:
+        return self.downloaded_size / self.duration if self.duration else 0
+
+
+# A single (rich) live display, shared by all concurrent downloads of the process.
+class DownloadProgress:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.progress: Optional[Progress] = None
+        self.num_tasks = 0
+
+    def add_task(self, description: str, total: Optional[int], completed: int = 0) -> TaskID:
+        with self.lock:
+            if self.progress is None:
+                self.progress = Progress(
+                    TextColumn("{task.description}"),
+                    BarColumn(),
+                    DownloadColumn(),
+                    TransferSpeedColumn(),
+                    TimeRemainingColumn(),
+                )
+                self.progress.start()
+
+            self.num_tasks += 1
+            return self.progress.add_task(description, total=total, completed=completed)
+
+    def update(self, task_id: TaskID, **kwargs: Any):
+        assert self.progress is not None
+        self.progress.update(task_id, **kwargs)
+
+    def advance(self, task_id: TaskID, amount: int):
+        assert self.progress is not None
+        self.progress.advance(task_id, amount)
+
+    def remove_task(self, task_id: TaskID):
+        with self.lock:
+            assert self.progress is not None
+            self.progress.remove_task(task_id)
+            self.num_tasks -= 1
+
+            if self.num_tasks == 0:
+                self.progress.stop()
+                self.progress = None
+
+
+download_progress = DownloadProgress()
+
+
+# Totals of the downloads of the process (e.g. for metrics).
+class DownloadStatistics:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.num_downloads = 0
+        self.downloaded_bytes = 0
+        self.duration = 0.0
+        self.last_throughput = 0.0
+
+    def add(self, result: DownloadResult):
+        with self.lock:
+            self.num_downloads += 1
+            self.downloaded_bytes += result.downloaded_size
+            self.duration += result.duration
+            self.last_throughput = result.get_throughput()
+
+
+download_statistics = DownloadStatistics()
+
+
+# Downloads files over a pooled HTTP session:
+#   - interrupted downloads are resumed (HTTP Range), both within a run (with retries) and across runs (using the ".partial" file),
+#     provided the remote file did not change in-between (HTTP If-Range, with the validator stored next to the ".partial" file),
+#   - large files are fetched as parallel ranged segments (if the server supports ranges),
+#   - the SHA-256 is computed while streaming and checked against the expected one (if any).
+class Downloader:
+    def __init__(self, segments: int = DOWNLOAD_DEFAULT_SEGMENTS, session: Optional[requests.Session] = None) -> None:
+        self.segments = max(1, segments)
+        self.session = session or create_session()
+
+    def download(self, url: str, destination: Path, expected_checksum: Optional[str] = None) -> DownloadResult:
+        partial_path = get_partial_path(destination)
+        started_at = time.perf_counter()
+        parsed_url = urlparse(url)
+
+        print(f"Downloading {url} to {destination} ...")
+
+        if parsed_url.scheme in ["", "file"]:
+            size, downloaded_size, checksum = self._copy_local_file(url, partial_path)
+        else:
+            total_size, accepts_ranges, validator = self._probe(url)
+
+            if self.segments > 1 and accepts_ranges and total_size >= DOWNLOAD_SEGMENTED_THRESHOLD:
+                size, downloaded_size, checksum = self._download_segmented(url, partial_path, total_size, validator)
+            else:
+                size, downloaded_size, checksum = self._download_with_retries(url, partial_path)
+
+        if expected_checksum and checksum != expected_checksum:
+            # Do not resume from corrupted data.
+            partial_path.unlink(missing_ok=True)
+            get_validator_path(partial_path).unlink(missing_ok=True)
+            raise errors.KnownError(f"checksum mismatch for {url}: expected {expected_checksum}, got {checksum}")
+
+        os.replace(partial_path, destination)
+        get_validator_path(partial_path).unlink(missing_ok=True)
+
+        result = DownloadResult(url, checksum, size, downloaded_size, time.perf_counter() - started_at)
+        download_statistics.add(result)
+        print(f"Downloaded {url}: {size / ONE_MB:.1f} MB in {result.duration:.1f}s ({result.get_throughput() / ONE_MB:.1f} MB/s).")
+        return result
+
+    def _probe(self, url: str) -> tuple[int, bool, Optional[str]]:
+        try:
+            response = self.session.head(url, allow_redirects=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT))
+        except RETRYABLE_ERRORS:
+            return 0, False, None
+
+        if response.status_code != HTTPStatus.OK:
+            return 0, False, None
+
+        total_size = int(response.headers.get("Content-Length", 0))
+        accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return total_size, accepts_ranges, get_validator(response)
+
+    def _download_with_retries(self, url: str, partial_path: Path) -> tuple[int, int, str]:
+        task_id = download_progress.add_task(get_short_name(url), total=None)
+
+        try:
+            for attempt in range(1, DOWNLOAD_MAX_ATTEMPTS + 1):
+                try:
+                    return self._download_stream(url, partial_path, task_id)
+                except RETRYABLE_ERRORS as error:
+                    handle_retryable_error(url, attempt, error)
+
+            raise errors.TransientError(f"cannot download {url}")
+        finally:
+            download_progress.remove_task(task_id)
+
+    def _download_stream(self, url: str, partial_path: Path, task_id: TaskID) -> tuple[int, int, str]:
+        offset = partial_path.stat().st_size if partial_path.exists() else 0
+        validator = read_validator(partial_path)
+
+        if offset and validator is None:
+            # Whether the remote file changed since cannot be told: start over.
+            print(f"[yellow]Partial download of {url} cannot be validated, will download again.")
+            partial_path.unlink()
+            offset = 0
+
+        headers = {"Range": f"bytes={offset}-", "If-Range": validator} if offset and validator else {}
+
+        with self.session.get(url, headers=headers, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)) as response:
+            if response.status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+                # The partial file is either complete, or not a prefix of the file: start over, in the second case.
+                total_size = parse_content_range_total(response.headers.get("Content-Range", ""))
+                if total_size == offset:
+                    return offset, 0, compute_checksum_of_prefix(partial_path, offset).hexdigest()
+
+                partial_path.unlink()
+                return self._download_stream(url, partial_path, task_id)
+
+            if response.status_code == HTTPStatus.PARTIAL_CONTENT and get_validator(response) != validator:
+                # A server that ignored "If-Range" (the remote file changed): start over.
+                print(f"[yellow]Remote file {url} changed, will download again.")
+                partial_path.unlink()
+                get_validator_path(partial_path).unlink(missing_ok=True)
+                return self._download_stream(url, partial_path, task_id)
+
+            if response.status_code == HTTPStatus.PARTIAL_CONTENT:
+                print(f"Resuming download of {url} from byte {offset} ...")
+                mode = "ab"
+            elif response.status_code == HTTPStatus.OK:
+                # A fresh download: either the first one, or the remote file changed (see "If-Range").
+                if offset:
+                    print(f"[yellow]Remote file {url} changed (or ranges are not supported), downloading it again.")
+
+                offset = 0
+                mode = "wb"
+                write_validator(partial_path, get_validator(response))
+            else:
+                raise errors.KnownError(f"cannot download {url}: HTTP {response.status_code}")
+
+            hasher = compute_checksum_of_prefix(partial_path, offset)
+            content_length = response.headers.get("Content-Length")
+            total_size = offset + int(content_length) if content_length else None
+            download_progress.update(task_id, total=total_size, completed=offset)
+
+            size = offset
+
+            with open(partial_path, mode) as file:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    download_progress.advance(task_id, len(chunk))
+
+        if total_size is not None and size != total_size:
+            raise requests.ConnectionError(f"incomplete download: {size} of {total_size} bytes")
+
+        return size, size - offset, hasher.hexdigest()
+
+    def _download_segmented(self, url: str, partial_path: Path, total_size: int, validator: Optional[str]) -> tuple[int, int, str]:
+        segment_size = math.ceil(total_size / self.segments)
+        segments = [(start, min(start + segment_size, total_size) - 1) for start in range(0, total_size, segment_size)]
+        segments_paths = [partial_path.with_name(f"{partial_path.name}.{index}") for index in range(len(segments))]
+
+        # Segments of a previous run are only kept if they belong to the same version of the remote file.
+        if validator is None or read_validator(partial_path) != validator:
+            for path in partial_path.parent.glob(f"{partial_path.name}.[0-9]*"):
+                path.unlink()
+
+        write_validator(partial_path, validator)
+        task_id = download_progress.add_task(get_short_name(url), total=total_size)
+
+        print(f"Downloading {url} in {len(segments)} segments ...")
+
+        try:
+            with ThreadPoolExecutor(len(segments), thread_name_prefix="segment") as executor:
+                futures = [executor.submit(self._download_segment_with_retries, url, path, start, end, validator, task_id)
+                           for (start, end), path in zip(segments, segments_paths)]
+                downloaded_size = sum(future.result() for future in futures)
+        finally:
+            download_progress.remove_task(task_id)
+
+        # Segments are joined (and hashed) in order.
+        hasher = hashlib.sha256()
+
+        with open(partial_path, "wb") as file:
+            for path in segments_paths:
+                with open(path, "rb") as segment_file:
+                    while chunk := segment_file.read(DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+                        hasher.update(chunk)
+
+        for path in segments_paths:
+            path.unlink()
+
+        return total_size, downloaded_size, hasher.hexdigest()
+
+    def _download_segment_with_retries(self, url: str, path: Path, start: int, end: int, validator: Optional[str], task_id: TaskID) -> int:
+        expected_size = end - start + 1
+        downloaded_size = 0
+
+        for attempt in range(1, DOWNLOAD_MAX_ATTEMPTS + 1):
+            offset = path.stat().st_size if path.exists() else 0
+            download_progress.advance(task_id, offset if attempt == 1 else 0)
+
+            if offset == expected_size:
+                return downloaded_size
+            if offset > expected_size:
+                path.unlink()
+                offset = 0
+
+            try:
+                downloaded_size += self._download_segment(url, path, start + offset, end, validator, task_id)
+            except RETRYABLE_ERRORS as error:
+                handle_retryable_error(url, attempt, error)
+
+        if path.exists() and path.stat().st_size == expected_size:
+            return downloaded_size
+
+        raise errors.TransientError(f"cannot download {url} (segment {start}-{end})")
+
+    def _download_segment(self, url: str, path: Path, start: int, end: int, validator: Optional[str], task_id: TaskID) -> int:
+        headers = {"Range": f"bytes={start}-{end}"}
+        size = 0
+
+        if validator:
+            headers["If-Range"] = validator
+
+        with self.session.get(url, headers=headers, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)) as response:
+            is_changed = response.status_code == HTTPStatus.OK or get_validator(response) != validator
+            if validator and is_changed:
+                # Segments of different versions must not be joined (the next run starts over).
+                raise errors.TransientError(f"remote file {url} changed during the download")
+            if response.status_code != HTTPStatus.PARTIAL_CONTENT:
+                raise errors.KnownError(f"cannot download {url} (segment {start}-{end}): HTTP {response.status_code}")
+
+            with open(path, "ab") as file:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    size += len(chunk)
+                    download_progress.advance(task_id, len(chunk))
+
+        return size
+
+    def _copy_local_file(self, url: str, partial_path: Path) -> tuple[int, int, str]:
+        source_path = Path(urllib.request.url2pathname(urlparse(url).path))
+        hasher = hashlib.sha256()
+        size = 0
+
+        with open(source_path, "rb") as source_file, open(partial_path, "wb") as file:
+            while chunk := source_file.read(DOWNLOAD_CHUNK_SIZE):
+                file.write(chunk)
+                hasher.update(chunk)
+                size += len(chunk)
+
+        return size, size, hasher.hexdigest()
+
+    # For archives extracted while they are downloaded: the file is never written to disk.
+    def open_stream(self, url: str) -> "DownloadStream":
+        print(f"Downloading {url} (streaming) ...")
+        return DownloadStream(self.session, url)
+
+    def close(self):
+        self.session.close()
+
+
+# Sequential reader of a remote (or local) file. Interrupted transfers are resumed from the current position (HTTP Range),
+# and the SHA-256 is computed while reading.
+class DownloadStream(io.RawIOBase):
+    def __init__(self, session: requests.Session, url: str) -> None:
+        super().__init__()
+        self.session = session
+        self.url = url
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.total_size: Optional[int] = None
+        self.response: Optional[requests.Response] = None
+        self.chunks: Optional[Iterator[bytes]] = None
+        self.chunk = b""
+        self.chunk_offset = 0
+        self.num_failures = 0
+        # Of the first response: transfers are only resumed from the same version of the remote file.
+        self.validator: Optional[str] = None
+        self.started_at = time.perf_counter()
+        self.task_id: Optional[TaskID] = download_progress.add_task(get_short_name(url), total=None)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while True:
+            try:
+                data = self._read(len(buffer))
+                break
+            except RETRYABLE_ERRORS as error:
+                self._close_response()
+                self.num_failures += 1
+                handle_retryable_error(self.url, self.num_failures, error)
+
+        self.num_failures = 0
+        buffer[:len(data)] = data
+        return len(data)
+
+    def _read(self, size: int) -> bytes:
+        if self.chunk_offset >= len(self.chunk):
+            if self.chunks is None:
+                self.chunks = self._open()
+
+            self.chunk = next(self.chunks, b"")
+            self.chunk_offset = 0
+
+            if not self.chunk:
+                if self.total_size is not None and self.size < self.total_size:
+                    raise requests.ConnectionError(f"incomplete download: {self.size} of {self.total_size} bytes")
+                return b""
+
+        data = self.chunk[self.chunk_offset:self.chunk_offset + size]
+        self.chunk_offset += len(data)
+        self.size += len(data)
+        self.hasher.update(data)
+        assert self.task_id is not None
+        download_progress.advance(self.task_id, len(data))
+        return data
+
+    def _open(self) -> Iterator[bytes]:
+        parsed_url = urlparse(self.url)
+
+        if parsed_url.scheme in ["", "file"]:
+            source_path = Path(urllib.request.url2pathname(parsed_url.path))
+            self.total_size = source_path.stat().st_size
+            return read_file_chunks(source_path, self.size)
+
+        headers = {"Range": f"bytes={self.size}-"} if self.size else {}
+        if self.size and self.validator:
+            headers["If-Range"] = self.validator
+
+        self.response = self.session.get(self.url, headers=headers, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT))
+        content_length = self.response.headers.get("Content-Length")
+        validator = get_validator(self.response)
+
+        if self.size and self.validator and validator != self.validator:
+            raise errors.KnownError(f"cannot download {self.url}: the remote file changed during the download")
+
+        self.validator = validator
+
+        if self.response.status_code == HTTPStatus.PARTIAL_CONTENT:
+            print(f"Resuming download of {self.url} from byte {self.size} ...")
+            self.total_size = self.size + int(content_length) if content_length else None
+            chunks = self.response.iter_content(DOWNLOAD_CHUNK_SIZE)
+        elif self.response.status_code == HTTPStatus.OK:
+            # Ranges not supported: the part already read is skipped.
+            self.total_size = int(content_length) if content_length else None
+            chunks = skip_bytes(self.response.iter_content(DOWNLOAD_CHUNK_SIZE), self.size)
+        else:
+            raise errors.KnownError(f"cannot download {self.url}: HTTP {self.response.status_code}")
+
+        assert self.task_id is not None
+        download_progress.update(self.task_id, total=self.total_size, completed=self.size)
+        return chunks
+
+    def _close_response(self):
+        if self.response is not None:
+            self.response.close()
+
+        self.response = None
+        self.chunks = None
+        self.chunk = b""
+        self.chunk_offset = 0
+
+    # Reads (and hashes) the remaining data (e.g. the padding after the end of an archive), then checks the checksum.
+    def finish(self, expected_checksum: Optional[str] = None) -> DownloadResult:
+        while self.read(DOWNLOAD_CHUNK_SIZE):
+            pass
+
+        checksum = self.hasher.hexdigest()
+        if expected_checksum and checksum != expected_checksum:
+            raise errors.KnownError(f"checksum mismatch for {self.url}: expected {expected_checksum}, got {checksum}")
+
+        result = DownloadResult(self.url, checksum, self.size, self.size, time.perf_counter() - self.started_at)
+        download_statistics.add(result)
+        print(f"Downloaded {self.url}: {self.size / ONE_MB:.1f} MB in {result.duration:.1f}s ({result.get_throughput() / ONE_MB:.1f} MB/s).")
+        return result
+
+    def close(self):
+        self._close_response()
+
+        if self.task_id is not None:
+            download_progress.remove_task(self.task_id)
+            self.task_id = None
+
+        super().close()
+
+
+def create_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_partial_path(destination: Path) -> Path:
+    return destination.with_name(f"{destination.name}.partial")
+
+
+def get_validator_path(partial_path: Path) -> Path:
+    return partial_path.with_name(f"{partial_path.name}.validator")
+
+
+# Strong ETag (weak ones cannot be used in "If-Range"), or else Last-Modified.
+def get_validator(response: requests.Response) -> Optional[str]:
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+
+    return response.headers.get("Last-Modified")
+
+
+def read_validator(partial_path: Path) -> Optional[str]:
+    try:
+        return get_validator_path(partial_path).read_text() or None
+    except OSError:
+        return None
+
+
+def write_validator(partial_path: Path, validator: Optional[str]):
+    validator_path = get_validator_path(partial_path)
+
+    if validator is None:
+        validator_path.unlink(missing_ok=True)
+    else:
+        validator_path.write_text(validator)
+
+
+def get_short_name(url: str) -> str:
+    return Path(urlparse(url).path).name or url
+
+
+def read_file_chunks(path: Path, offset: int) -> Iterator[bytes]:
+    with open(path, "rb") as file:
+        file.seek(offset)
+
+        while chunk := file.read(DOWNLOAD_CHUNK_SIZE):
+            yield chunk
+
+
+def skip_bytes(chunks: Iterator[bytes], count: int) -> Iterator[bytes]:
+    for chunk in chunks:
+        if count >= len(chunk):
+            count -= len(chunk)
+            continue
+
+        yield chunk[count:]
+        count = 0
+
+
+def compute_checksum_of_prefix(path: Path, size: int) -> "hashlib._Hash":
+    hasher = hashlib.sha256()
+    remaining = size
+
+    if remaining:
+        with open(path, "rb") as file:
+            while remaining and (chunk := file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))):
+                hasher.update(chunk)
+                remaining -= len(chunk)
+
+    return hasher
+
+
+def parse_content_range_total(content_range: str) -> Optional[int]:
+    # E.g. "bytes */12345"
+    _, _, total = content_range.rpartition("/")
+    return int(total) if total.isdigit() else None
+
+
+def handle_retryable_error(url: str, attempt: int, error: Exception):
+    if attempt == DOWNLOAD_MAX_ATTEMPTS:
+        raise errors.TransientError(f"cannot download {url}, after {attempt} attempts", error)
+
+    delay = DOWNLOAD_RETRY_BASE_DELAY * 2 ** (attempt - 1)
+    print(f"[yellow]Download of {url} interrupted ({error}), will resume in {delay}s ...")
+    time.sleep(delay)
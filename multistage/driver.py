@@ -1,21 +1,42 @@
 import json
+import sqlite3
 import sys
+import time
 import traceback
 from argparse import ArgumentParser
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 from rich import print
 from rich.panel import Panel
+from rich.table import Table
 
 from multistage import errors
-from multistage.config import DriverConfig
+from multistage.archive_cache import create_archive_cache
+from multistage.artifact_store import create_artifact_store
+from multistage.config import DriverConfig, LaneConfig
+from multistage.constants import (ADMISSION_DEFAULT_FOLDER,
+                                  ADMISSION_DEFAULT_MAX_HEAVY_STAGES,
+                                  ARCHIVES_CACHE_DEFAULT_BUDGET_GB,
+                                  ARCHIVES_CACHE_DEFAULT_FOLDER,
+                                  ARTIFACTS_STORE_DEFAULT_FOLDER,
+                                  DEFAULT_MAX_PARALLEL_TRANSITIONS,
+                                  DOWNLOAD_DEFAULT_SEGMENTS, LANES_WILDCARD,
+                                  NODE_DB_FOLDER_NAME, NODE_PROCESS_ULIMIT,
+                                  RUN_HISTORY_DEFAULT_PATH)
 from multistage.lane_controller import LaneController
+from multistage.lane_journal import LaneJournal
+from multistage.progress import format_duration
+from multistage.resources import (create_admission_scheduler,
+                                  raise_open_files_limit)
+from multistage.run_history import RunHistory, create_run_history
+from multistage.snapshots import SnapshotStore
+from multistage.squad_controller import SquadController
 
 
 def main(cli_args: list[str] = sys.argv[1:]):
     try:
-        _do_main(cli_args)
+        return _do_main(cli_args)
     except errors.KnownError as err:
         print(Panel(f"[red]{traceback.format_exc()}"))
         print(Panel(f"[red]{err.get_pretty()}"))
@@ -25,29 +46,201 @@ def main(cli_args: list[str] = sys.argv[1:]):
 def _do_main(cli_args: list[str]):
     parser = ArgumentParser()
     parser.add_argument("--config", required=True, help="path of the 'driver' configuration file")
-    parser.add_argument("--lane", required=True, help="which lane to handle")
-    parser.add_argument("--stage", required=True, help="initial stage on the lane")
+    parser.add_argument("--lane", required=True, action="append", help=f"which lane to handle (can be repeated; '{LANES_WILDCARD}' for all lanes)")
+    initial_stage_group = parser.add_mutually_exclusive_group()
+    initial_stage_group.add_argument("--stage", help="initial stage on the lane(s) (default: the first stage of each lane)")
+    initial_stage_group.add_argument("--resume", action="store_true", default=False, help="resume each lane where it left off, according to its journal")
+    initial_stage_group.add_argument("--restore-from-stage", help="restore the database of each lane from its snapshot for the given stage, then start the lane at that stage")
+    add_services_arguments(parser)
     args = parser.parse_args(cli_args)
 
-    config_path = Path(args.config).expanduser().resolve()
+    raise_open_files_limit(NODE_PROCESS_ULIMIT)
+
+    driver_config = load_driver_config(args.config)
+    lanes_names = resolve_lanes_names(driver_config, args.lane)
+    initial_stage_name: Optional[str] = args.stage
+
+    lanes: list[LaneController] = []
+
+    for lane_name in lanes_names:
+        lane_config = driver_config.get_lane(lane_name)
+
+        if args.resume:
+            lane = create_resumed_lane(lane_config)
+            if lane is not None:
+                lanes.append(lane)
+            continue
+
+        if args.restore_from_stage:
+            lanes.append(create_restored_lane(lane_config, args.restore_from_stage))
+            continue
+
+        lane_initial_stage_name = resolve_initial_stage_name(lane_config, initial_stage_name)
+
+        print(f"[bold yellow]Lane: {lane_name}")
+        print(f"[bold yellow]Initial stage: {lane_initial_stage_name}")
+
+        lanes.append(LaneController(lane_config, lane_initial_stage_name))
+
+    if not lanes:
+        print("[green]All lanes are completed, nothing to do.")
+        return 0
+
+    archives_cache = create_archive_cache(args.archives_cache, args.archives_cache_budget_gb, args.download_segments)
+    admission = create_admission_scheduler(ADMISSION_DEFAULT_FOLDER, args.max_parallel_heavy_stages, args.heavy_stages_stagger)
+    artifact_store = create_artifact_store(args.artifacts_store)
+    history = create_run_history(args.history)
+    print_forecasts(lanes, history)
+
+    squad = SquadController(
+        lanes,
+        max_parallel_transitions=args.max_parallel_transitions,
+        archives_cache=archives_cache,
+        metrics_address=args.metrics_address,
+        admission=admission,
+        artifact_store=artifact_store,
+        history=history,
+    )
+    succeeded = squad.start()
+    return 0 if succeeded else 1
+
+
+def load_driver_config(path: str) -> DriverConfig:
+    config_path = Path(path).expanduser().resolve()
     config_data = json.loads(config_path.read_text())
-    driver_config = DriverConfig.new_from_dictionary(config_data)
-    lane_name = args.lane
-    initial_stage_name = args.stage
+    return DriverConfig.new_from_dictionary(config_data)
 
-    if lane_name not in driver_config.get_lanes_names():
-        raise errors.BadConfigurationError(f"unknown lane: {lane_name}")
 
-    lane_config = driver_config.get_lane(lane_name)
+# Options of the resources shared by the lanes of a driver process (see "SharedServices"); also used by the agent.
+def add_services_arguments(parser: ArgumentParser):
+    parser.add_argument("--max-parallel-transitions", type=int, default=DEFAULT_MAX_PARALLEL_TRANSITIONS, help="how many lanes can prepare a stage at the same time")
+    parser.add_argument("--archives-cache", default=ARCHIVES_CACHE_DEFAULT_FOLDER, help="folder of the (persistent) archives cache")
+    parser.add_argument("--archives-cache-budget-gb", type=float, default=ARCHIVES_CACHE_DEFAULT_BUDGET_GB, help="size of the archives cache, before evicting least recently used archives")
+    parser.add_argument("--artifacts-store", default=ARTIFACTS_STORE_DEFAULT_FOLDER, help="folder of the (persistent) store of node libraries, linked into the working directories")
+    parser.add_argument("--max-parallel-heavy-stages", type=int, default=ADMISSION_DEFAULT_MAX_HEAVY_STAGES, help="how many heavy stages (e.g. import-db) can run at the same time on this host (default: no limit)")
+    parser.add_argument("--heavy-stages-stagger", type=float, default=0, help="minimum delay (in seconds) between the starts of heavy stages on this host")
+    parser.add_argument("--metrics-address", help="where to serve metrics for Prometheus (e.g. 'localhost:9110'; default: not served)")
+    parser.add_argument("--history", default=RUN_HISTORY_DEFAULT_PATH, help="path of the (persistent) database of stage runs, used to forecast durations")
+    parser.add_argument("--download-segments", type=int, default=DOWNLOAD_DEFAULT_SEGMENTS, help="how many parallel (ranged) requests to use for downloading large archives")
 
-    if initial_stage_name not in lane_config.get_stages_names():
-        raise errors.BadConfigurationError(f"unknown stage: {initial_stage_name}")
 
-    print(f"[bold yellow]Lane: {lane_name}")
-    print(f"[bold yellow]Initial stage: {initial_stage_name}")
+def resolve_lanes_names(driver_config: DriverConfig, requested_names: list[str]) -> list[str]:
+    if LANES_WILDCARD in requested_names:
+        return driver_config.get_lanes_names()
+
+    lanes_names: list[str] = []
+
+    for lane_name in requested_names:
+        if lane_name not in driver_config.get_lanes_names():
+            raise errors.BadConfigurationError(f"unknown lane: {lane_name}")
+        if lane_name not in lanes_names:
+            lanes_names.append(lane_name)
+
+    return lanes_names
+
+
+def create_resumed_lane(lane_config: LaneConfig) -> Optional[LaneController]:
+    resume_point = LaneJournal.new_for_lane(lane_config).get_resume_point(lane_config)
+
+    print(f"[bold yellow]Lane: {lane_config.name}")
+
+    if resume_point.stage_name is None:
+        print(f"[green]Lane {lane_config.name} is completed, skipping it.")
+        return None
+
+    last_observed = ""
+    if resume_point.last_nonce is not None:
+        last_observed = f" (last observed: epoch {resume_point.last_epoch}, block {resume_point.last_nonce})"
+
+    print(f"[bold yellow]Resuming at stage: {resume_point.stage_name}{last_observed}")
+    return LaneController(
+        lane_config,
+        resume_point.stage_name,
+        is_initial_stage_configured=resume_point.is_configured,
+        is_initial_stage_partial=resume_point.last_nonce is not None,
+    )
+
+
+def create_restored_lane(lane_config: LaneConfig, stage_name: str) -> LaneController:
+    stage_name = resolve_initial_stage_name(lane_config, stage_name)
+    snapshots = SnapshotStore.new_for_lane(lane_config)
+
+    print(f"[bold yellow]Lane: {lane_config.name}")
+
+    if snapshots is None:
+        raise errors.BadConfigurationError(f"for lane {lane_config.name}, 'snapshots' are not configured")
+
+    print(f"Restoring the database from the snapshot for stage {stage_name} ...")
+    statistics = snapshots.restore(stage_name, lane_config.working_directory / NODE_DB_FOLDER_NAME)
+    print(f"[green]Database restored: {statistics}.")
+
+    print(f"[bold yellow]Initial stage: {stage_name}")
+    return LaneController(lane_config, stage_name)
+
+
+# Expected durations of the remaining stages of each lane, according to the history of their runs.
+def print_forecasts(lanes: list[LaneController], history: RunHistory):
+    table = Table(title="Forecast (according to previous runs)")
+    table.add_column("Lane")
+    table.add_column("Stage")
+    table.add_column("Runs")
+    table.add_column("Blocks/s")
+    table.add_column("Expected duration")
+    table.add_column("Expected end (cumulative)")
+
+    longest_lane_duration = 0.0
+    all_known = True
+
+    try:
+        for lane in lanes:
+            stages = lane.config.get_stages_including_and_after(lane.initial_stage_name)
+            lane_duration = 0.0
+
+            for index, stage in enumerate(stages):
+                binary_checksum = history.get_binary_checksum(stage.bin / "node")
+                forecast = history.get_forecast(lane.config.name, stage.name, binary_checksum)
+                # A resumed stage should take less than a whole run.
+                is_partial = index == 0 and lane.is_initial_stage_partial
+
+                if forecast.duration is None:
+                    all_known = False
+                    table.add_row(lane.config.name, stage.name, "0", "-", "unknown", "-")
+                    continue
+
+                lane_duration += forecast.duration
+                binary_note = "" if forecast.same_binary else " (other binaries)"
+                partial_note = " (at most, resumed)" if is_partial else ""
+
+                table.add_row(
+                    lane.config.name,
+                    stage.name,
+                    f"{forecast.num_runs}{binary_note}",
+                    f"{forecast.blocks_per_second:.1f}" if forecast.blocks_per_second else "-",
+                    f"{format_duration(forecast.duration)}{partial_note}",
+                    f"+{format_duration(lane_duration)}",
+                )
+
+            longest_lane_duration = max(longest_lane_duration, lane_duration)
+    except (sqlite3.Error, OSError) as error:
+        print(f"[yellow]Cannot read the history of runs ({history.path}):[/yellow] {error}")
+        return
+
+    print(table)
+
+    if longest_lane_duration:
+        qualifier = "" if all_known else "at least "
+        end_time = time.strftime("%Y-%m-%d %H:%M", time.localtime(time.time() + longest_lane_duration))
+        print(f"[bold]Expected total duration: {qualifier}~{format_duration(longest_lane_duration)} (around {end_time}).")
+
+
+def resolve_initial_stage_name(lane_config: LaneConfig, initial_stage_name: Optional[str]) -> str:
+    if initial_stage_name is None:
+        return lane_config.get_stages_names()[0]
+
+    if initial_stage_name not in lane_config.get_stages_names():
+        raise errors.BadConfigurationError(f"unknown stage: {initial_stage_name} (lane {lane_config.name})")
 
-    lane = LaneController(lane_config, initial_stage_name)
-    lane.start()
+    return initial_stage_name
 
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional, TextIO
+
+from rich import print
+
+
+# Writes structured events (JSON lines) in a background thread, so that emitting an event never blocks the event loop.
+class EventsWriter:
+    def __init__(self) -> None:
+        self.queue: queue.SimpleQueue[Optional[tuple[Path, dict[str, Any]]]] = queue.SimpleQueue()
+        self.files: dict[Path, TextIO] = {}
+        self.thread = threading.Thread(target=self._run, name="events", daemon=True)
+        self.thread.start()
+
+    def emit(self, path: Path, event: str, fields: dict[str, Any]):
+        entry = {"event": event, "time": time.time(), **fields}
+        self.queue.put((path, entry))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            path, entry = item
+
+            try:
+                file = self._get_file(path)
+                file.write(json.dumps(entry) + "\n")
+
+                # Flush once the burst of events is written.
+                if self.queue.empty():
+                    for file in self.files.values():
+                        file.flush()
+            except OSError as error:
+                print(f"[red]Cannot write event to {path}:[/red] {error}")
+
+        for file in self.files.values():
+            file.close()
+
+    def _get_file(self, path: Path) -> TextIO:
+        file = self.files.get(path)
+
+        if file is None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            file = open(path, "a")
+            self.files[path] = file
+
+        return file
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Optional
+
+from multistage import errors
+from multistage.constants import (COPY_BUFFER_SIZE,
+                                  EXTRACTION_MAX_BUFFERED_BYTES,
+                                  EXTRACTION_MAX_BUFFERED_FILE_SIZE,
+                                  EXTRACTION_WORKERS)
+from multistage.file_copy import TransferStatistics, list_files
+
+TAR_FORMATS = ["tar", "gztar", "bztar", "xztar"]
+
+
+def extract_archive(archive_path: Path, archive_format: Optional[str], destination: Path, workers: int = EXTRACTION_WORKERS) -> TransferStatistics:
+    if archive_format == "zip":
+        return extract_zip(archive_path, destination, workers)
+
+    if archive_format in TAR_FORMATS:
+        with open(archive_path, "rb") as archive_file:
+            return extract_tar(archive_file, destination, workers)
+
+    started_at = time.perf_counter()
+    shutil.unpack_archive(archive_path, destination, format=archive_format)
+    files = list_files(destination)
+    return TransferStatistics(len(files), sum(size for _, size in files), time.perf_counter() - started_at)
+
+
+# Members are read (and decompressed) in parallel, each worker having its own handle on the archive.
+def extract_zip(archive_path: Path, destination: Path, workers: int = EXTRACTION_WORKERS) -> TransferStatistics:
+    started_at = time.perf_counter()
+
+    with zipfile.ZipFile(archive_path) as archive:
+        members = archive.infolist()
+
+    files: list[tuple[zipfile.ZipInfo, Path]] = []
+
+    for member in members:
+        path = get_member_path(destination, member.filename)
+
+        if member.is_dir():
+            path.mkdir(parents=True, exist_ok=True)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            files.append((member, path))
+
+    # Largest files first, for a better balance between workers.
+    files.sort(key=lambda item: item[0].compress_size, reverse=True)
+    local = threading.local()
+    handles: list[zipfile.ZipFile] = []
+
+    def extract_member(member: zipfile.ZipInfo, path: Path):
+        archive = getattr(local, "archive", None)
+        if archive is None:
+            archive = local.archive = zipfile.ZipFile(archive_path)
+            handles.append(archive)
+
+        with archive.open(member) as source_file, open(path, "wb") as destination_file:
+            shutil.copyfileobj(source_file, destination_file, COPY_BUFFER_SIZE)
+
+        mode = (member.external_attr >> 16) & 0o777
+        if mode:
+            os.chmod(path, mode)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as executor:
+            futures = [executor.submit(extract_member, member, path) for member, path in files]
+            for future in futures:
+                future.result()
+    finally:
+        for handle in handles:
+            handle.close()
+
+    num_bytes = sum(member.file_size for member, _ in files)
+    return TransferStatistics(len(files), num_bytes, time.perf_counter() - started_at)
+
+
+# Compressed tar archives can only be read sequentially (thus, they can be extracted while being downloaded): a single reader decompresses
+# the members, and hands the (small) files to a pool of writers. Large files, links and special files are extracted by the reader itself.
+def extract_tar(archive_file: IO[bytes], destination: Path, workers: int = EXTRACTION_WORKERS) -> TransferStatistics:
+    started_at = time.perf_counter()
+    pending: deque[tuple[Future[None], int]] = deque()
+    pending_paths: set[Path] = set()
+    buffered_bytes = 0
+    num_files = 0
+    num_bytes = 0
+
+    def wait_pending(max_buffered_bytes: int):
+        nonlocal buffered_bytes
+
+        while pending and buffered_bytes > max_buffered_bytes:
+            future, size = pending.popleft()
+            future.result()
+            buffered_bytes -= size
+
+        if not pending:
+            pending_paths.clear()
+
+    try:
+        with tarfile.open(fileobj=archive_file, mode="r|*") as archive, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="extract") as executor:
+            for member in archive:
+                filtered_member = tarfile.data_filter(member, str(destination))
+                path = destination / filtered_member.name
+
+                if member.isdir():
+                    path.mkdir(parents=True, exist_ok=True)
+                    continue
+
+                if member.isreg():
+                    num_files += 1
+                    num_bytes += member.size
+
+                if member.isreg() and member.size <= EXTRACTION_MAX_BUFFERED_FILE_SIZE and path not in pending_paths:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    file = archive.extractfile(member)
+                    assert file is not None
+                    data = file.read()
+
+                    pending.append((executor.submit(write_file, path, data, filtered_member.mode, filtered_member.mtime), len(data)))
+                    pending_paths.add(path)
+                    buffered_bytes += len(data)
+                    wait_pending(EXTRACTION_MAX_BUFFERED_BYTES)
+                    continue
+
+                # Targets of links (and previous versions of the same file) must be written first.
+                wait_pending(-1)
+                archive.extract(member, destination, filter="data")
+
+            wait_pending(-1)
+    except (tarfile.TarError, EOFError) as error:
+        raise errors.KnownError(f"cannot extract archive to {destination}", error)
+
+    return TransferStatistics(num_files, num_bytes, time.perf_counter() - started_at)
+
+
+def write_file(path: Path, data: bytes, mode: Optional[int], mtime: Optional[float]):
+    with open(path, "wb") as file:
+        file.write(data)
+
+    if mode is not None:
+        os.chmod(path, mode)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def get_member_path(destination: Path, name: str) -> Path:
+    relative_path = Path(name)
+
+    if relative_path.is_absolute() or ".." in relative_path.parts:
+        raise errors.KnownError(f"unsafe path in archive: {name}")
+
+    return destination / relative_path
+
+
+def is_streamable_format(archive_format: Optional[str]) -> bool:
+    return archive_format in TAR_FORMATS
@@ -0,0 +1,120 @@
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+from multistage.constants import COPY_BUFFER_SIZE, ONE_MB
+
+# ioctl to clone a file (reflink), on copy-on-write filesystems (e.g. Btrfs, XFS).
+FICLONE = 0x40049409
+# Errors meaning "reflinks are not possible here" (as opposed to actual I/O errors).
+REFLINK_UNSUPPORTED_ERRORS = [errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS]
+# Errors meaning "copy_file_range() is not possible here" (e.g. across filesystems, on older kernels).
+COPY_RANGE_UNSUPPORTED_ERRORS = [errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL]
+
+
+class TransferStatistics:
+    def __init__(self, num_files: int, num_bytes: int, duration: float) -> None:
+        self.num_files = num_files
+        self.num_bytes = num_bytes
+        self.duration = duration
+
+    def get_throughput(self) -> float:
+        # In MB/s.
+        return self.num_bytes / ONE_MB / max(self.duration, 0.001)
+
+    def __str__(self) -> str:
+        return f"{self.num_files} files, {self.num_bytes / ONE_MB:.1f} MB in {self.duration:.2f}s ({self.get_throughput():.1f} MB/s)"
+
+
+# Returns whether the file has been cloned. If not, the destination is left absent.
+def try_reflink(source: Path, destination: Path) -> bool:
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+            reflinked = True
+        except OSError as error:
+            if error.errno not in REFLINK_UNSUPPORTED_ERRORS:
+                raise
+            reflinked = False
+
+    if not reflinked:
+        destination.unlink()
+        return False
+
+    shutil.copystat(source, destination)
+    return True
+
+
+# Copies only the data segments of the file (holes are preserved), in the kernel if possible, else with large buffers.
+def copy_sparse_file(source: Path, destination: Path):
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        source_fd = source_file.fileno()
+        destination_fd = destination_file.fileno()
+        size = os.fstat(source_fd).st_size
+        offset = 0
+
+        while offset < size:
+            try:
+                data_start = os.lseek(source_fd, offset, os.SEEK_DATA)
+            except OSError as error:
+                # Only a hole remains.
+                if error.errno == errno.ENXIO:
+                    break
+                raise
+
+            data_end = os.lseek(source_fd, data_start, os.SEEK_HOLE)
+            copy_range(source_fd, destination_fd, data_start, data_end)
+            offset = data_end
+
+        # Trailing hole (if any).
+        destination_file.truncate(size)
+
+    shutil.copystat(source, destination)
+
+
+def copy_range(source_fd: int, destination_fd: int, start: int, end: int):
+    offset = start
+
+    while offset < end:
+        count = min(COPY_BUFFER_SIZE, end - offset)
+
+        try:
+            copied = os.copy_file_range(source_fd, destination_fd, count, offset, offset)
+        except OSError as error:
+            if error.errno not in COPY_RANGE_UNSUPPORTED_ERRORS:
+                raise
+
+            data = os.pread(source_fd, count, offset)
+            copied = os.pwrite(destination_fd, data, offset)
+
+        if copied == 0:
+            # The source has been truncated in the meantime.
+            break
+
+        offset += copied
+
+
+def hash_file(path: Path) -> str:
+    # Large reads: hashlib releases the GIL, thus files are hashed in parallel (in threads).
+    digest = hashlib.blake2b()
+
+    with open(path, "rb") as file:
+        while chunk := file.read(COPY_BUFFER_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# Returns (relative path, size) pairs.
+def list_files(folder: Path) -> list[tuple[Path, int]]:
+    files: list[tuple[Path, int]] = []
+
+    for root, _, names in os.walk(folder):
+        for name in names:
+            path = Path(root) / name
+            files.append((path.relative_to(folder), path.stat().st_size))
+
+    return files
@@ -1,38 +1,113 @@
+import json
 import os
+import re
+import shutil
 import subprocess
+import sys
 from pathlib import Path
+from typing import Any, Optional
 
 from rich import print
 
 from multistage import errors
-from multistage.shared import fetch_archive
+from multistage.archive_cache import ArchiveCache
+from multistage.constants import (BUILD_OUTPUT_TAIL_LINES, GO_DEFAULT_PROXY,
+                                  GO_SHARED_FOLDER_NAME)
+from multistage.shared import fetch_archive, get_archive_file_name
+
+# Lines of "go build -v" naming a (compiled) package, e.g. "github.com/TerraDharitri/drt-go-chain/node".
+COMPILED_PACKAGE_PATTERN = re.compile(r"^[\w.\-~]+(/[\w.\-~]+)*$")
 
 
 class BuildEnvironment:
-    def __init__(self, system_path: str, go_path: str, go_cache: str, go_root: str) -> None:
+    def __init__(self,
+                 system_path: str,
+                 go_path: str,
+                 go_cache: str,
+                 go_root: str,
+                 go_mod_cache: str,
+                 go_proxy: Optional[str] = None,
+                 offline: bool = False) -> None:
         self.system_path = system_path
         self.go_path = go_path
         self.go_cache = go_cache
         self.go_root = go_root
+        self.go_mod_cache = go_mod_cache
+        self.go_proxy = go_proxy
+        self.offline = offline
 
     def to_dictionary(self) -> dict[str, str]:
-        return {
+        env = {
             "PATH": self.system_path,
             "GOPATH": self.go_path,
             "GOCACHE": self.go_cache,
             "GOROOT": self.go_root,
+            "GOMODCACHE": self.go_mod_cache,
         }
 
+        if self.go_proxy:
+            env["GOPROXY"] = self.go_proxy
+
+        if self.offline:
+            # Checksums are still verified against "go.sum"; no toolchain downloads, either.
+            env["GOSUMDB"] = "off"
+            env["GOTOOLCHAIN"] = "local"
+
+        return env
+
+
+# Settings of the module & build caches, shared by all the entries (and toolchains) of a workspace.
+class CachesSettings:
+    def __init__(self, modules_mirror: Optional[Path] = None, offline: bool = False) -> None:
+        if offline and modules_mirror is None:
+            raise errors.UsageError("offline builds require a modules mirror")
+
+        # Local GOPROXY (a folder), filled with all the modules ever downloaded.
+        self.modules_mirror = modules_mirror
+        self.offline = offline
+
+    def get_go_proxy(self) -> Optional[str]:
+        if self.modules_mirror is None:
+            return None
+
+        mirror_url = f"file://{self.modules_mirror}"
+        if self.offline:
+            return mirror_url
+
+        return f"{mirror_url},{os.environ.get('GOPROXY', GO_DEFAULT_PROXY)}"
+
+
+class ModulesStatistics:
+    def __init__(self, num_modules: int, num_cached: int) -> None:
+        self.num_modules = num_modules
+        self.num_cached = num_cached
+
+
+class BuildCacheStatistics:
+    def __init__(self, num_packages: int, num_compiled: int) -> None:
+        self.num_packages = num_packages
+        self.num_compiled = num_compiled
+
+    def get_num_cached(self) -> int:
+        return max(self.num_packages - self.num_compiled, 0)
 
-def acquire_environment(workspace: Path, label: str) -> BuildEnvironment:
+
+# Module cache and build cache are shared by all toolchains: the former is content-addressed (thus independent of the Go version),
+# while the keys of the latter include the toolchain's version (thus entries of different toolchains do not collide). Both support concurrent builds.
+def acquire_environment(workspace: Path, label: str, caches: Optional[CachesSettings] = None) -> BuildEnvironment:
+    caches = caches or CachesSettings()
     directory = get_environment_directory(workspace, label)
+    shared_directory = get_shared_directory(workspace)
     current_system_path = os.environ.get("PATH", "")
 
     return BuildEnvironment(
         system_path=f"{directory / 'bin'}:{current_system_path}",
         go_path=str(directory / "gopath"),
-        go_cache=str(directory / "gocache"),
+        go_cache=str(shared_directory / "gocache"),
         go_root=str(directory),
+        go_mod_cache=str(shared_directory / "gomodcache"),
+        go_proxy=caches.get_go_proxy(),
+        offline=caches.offline,
     )
 
 
@@ -40,23 +115,157 @@ def get_environment_directory(workspace: Path, label: str) -> Path:
     return workspace / f"go_{label}"
 
 
-def install_go(workspace: Path, download_url: str, environment_label: str):
+def get_shared_directory(workspace: Path) -> Path:
+    return workspace / GO_SHARED_FOLDER_NAME
+
+
+def get_toolchain_label(download_url: str) -> str:
+    # E.g. "go1.20.7.linux-amd64" for "https://golang.org/dl/go1.20.7.linux-amd64.tar.gz"
+    file_name = get_archive_file_name(download_url)
+
+    for extension in [".tar.gz", ".tgz", ".zip"]:
+        if file_name.endswith(extension):
+            return file_name[:-len(extension)]
+
+    return file_name
+
+
+def install_go(workspace: Path,
+               download_url: str,
+               environment_label: str,
+               cache: Optional[ArchiveCache] = None,
+               checksum: Optional[str] = None,
+               stream: bool = False):
     environment_directory = get_environment_directory(workspace, environment_label)
 
     if environment_directory.exists():
         print(f"Go already installed in {environment_directory} ({environment_label}).")
         return
 
-    fetch_archive(download_url, environment_directory)
+    fetch_archive(download_url, environment_directory, cache, checksum, stream)
 
     print(f"Creating go environment directories ...")
     (environment_directory / "gopath").mkdir()
-    (environment_directory / "gocache").mkdir()
 
 
-def build(source_code: Path, environment: BuildEnvironment):
-    print(f"Building {source_code} ...")
+# Resolves and downloads (into the shared module cache) all the modules required by "go.mod", ahead of the build.
+# Hits are counted against the contents of the cache before the (concurrent) downloads of all entries started (see "list_cached_modules"):
+# a module fetched meanwhile, by another entry, is not a hit.
+def download_modules(source_code: Path, environment: BuildEnvironment, cached_modules: set[Path]) -> ModulesStatistics:
+    result = subprocess.run(["go", "mod", "download", "-json"], cwd=source_code, env=environment.to_dictionary(), capture_output=True, text=True)
+    modules = parse_json_stream(result.stdout)
+    failed = [module for module in modules if module.get("Error")]
+
+    if result.returncode != 0 or failed:
+        details = "\n".join([f"{module.get('Path')}@{module.get('Version')}: {module.get('Error')}" for module in failed] + result.stderr.splitlines()[-BUILD_OUTPUT_TAIL_LINES:])
+        raise errors.KnownError(f"cannot download the Go modules of {source_code}", details)
+
+    num_cached = sum(1 for module in modules if module.get("Zip") and Path(module["Zip"]).resolve() in cached_modules)
+    return ModulesStatistics(len(modules), num_cached)
+
+
+# Snapshot of the modules (their zip files) in the shared module cache of the workspace.
+def list_cached_modules(workspace: Path) -> set[Path]:
+    download_cache = get_shared_directory(workspace) / "gomodcache" / "cache" / "download"
+    return {path.resolve() for path in download_cache.rglob("*.zip")}
+
+
+# "go mod download -json" writes a sequence of JSON objects (not an array).
+def parse_json_stream(text: str) -> list[dict[str, Any]]:
+    decoder = json.JSONDecoder()
+    items: list[dict[str, Any]] = []
+    position = 0
+
+    while True:
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position >= len(text):
+            break
+
+        item, position = decoder.raw_decode(text, position)
+        items.append(item)
+
+    return items
+
+
+# The download cache ("cache/download" in the module cache) has the layout of a GOPROXY: its files are copied (or linked) to the mirror.
+def update_modules_mirror(environment: BuildEnvironment, mirror: Path) -> int:
+    download_cache = Path(environment.go_mod_cache) / "cache" / "download"
+    num_added = 0
+
+    for root, folders, names in os.walk(download_cache):
+        # Checksum database (not part of the GOPROXY protocol).
+        if Path(root) == download_cache and "sumdb" in folders:
+            folders.remove("sumdb")
+
+        for name in names:
+            if name.endswith(".lock") or name.endswith(".partial") or ".tmp" in name:
+                continue
+
+            source = Path(root) / name
+            destination = mirror / source.relative_to(download_cache)
+
+            # Version lists may grow, other files never change.
+            if destination.exists() and (name != "list" or destination.stat().st_size == source.stat().st_size):
+                continue
+
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path = destination.with_name(f".{name}.{os.getpid()}.{os.urandom(4).hex()}.tmp")
+
+            try:
+                os.link(source, temporary_path)
+            except OSError:
+                shutil.copyfile(source, temporary_path)
+
+            os.replace(temporary_path, destination)
+            num_added += 1
+
+    return num_added
+
+
+def build(source_code: Path, environment: BuildEnvironment, log_path: Optional[Path] = None) -> BuildCacheStatistics:
+    num_packages = count_packages(source_code, environment)
+
+    if log_path is None:
+        print(f"Building {source_code} ...")
+        return_code, num_compiled = run_build(source_code, environment, sys.stdout)
+        if return_code != 0:
+            raise errors.KnownError(f"error code = {return_code}, see output")
+        return BuildCacheStatistics(num_packages, num_compiled)
+
+    print(f"Building {source_code} (output in {log_path}) ...")
+
+    with open(log_path, "w") as log_file:
+        return_code, num_compiled = run_build(source_code, environment, log_file)
 
-    return_code = subprocess.call(["go", "build"], cwd=source_code, env=environment.to_dictionary())
     if return_code != 0:
-        raise errors.KnownError(f"error code = {return_code}, see output")
+        output_tail = "\n".join(log_path.read_text().splitlines()[-BUILD_OUTPUT_TAIL_LINES:])
+        raise errors.KnownError(f"error code = {return_code}, see {log_path}", output_tail)
+
+    return BuildCacheStatistics(num_packages, num_compiled)
+
+
+# Packages found in the build cache are not compiled, thus not listed by "go build -v".
+# Returns the return code, and the number of compiled packages.
+def run_build(source_code: Path, environment: BuildEnvironment, output: Any) -> tuple[int, int]:
+    process = subprocess.Popen(["go", "build", "-v"], cwd=source_code, env=environment.to_dictionary(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    assert process.stdout is not None
+
+    num_compiled = 0
+
+    for line in process.stdout:
+        output.write(line)
+        output.flush()
+
+        if COMPILED_PACKAGE_PATTERN.match(line.strip()):
+            num_compiled += 1
+
+    return process.wait(), num_compiled
+
+
+def count_packages(source_code: Path, environment: BuildEnvironment) -> int:
+    result = subprocess.run(["go", "list", "-deps", "."], cwd=source_code, env=environment.to_dictionary(), capture_output=True, text=True)
+    if result.returncode != 0:
+        return 0
+
+    return len(result.stdout.splitlines())
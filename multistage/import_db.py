@@ -0,0 +1,157 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+from rich import print
+
+from multistage import errors
+from multistage.constants import IMPORT_DB_MANIFEST_SUFFIX
+from multistage.file_copy import (TransferStatistics, copy_sparse_file,
+                                  hash_file, try_reflink)
+
+
+class ProvisioningResult:
+    def __init__(self, copied: TransferStatistics, num_skipped_files: int, num_skipped_bytes: int, num_removed_files: int, num_reflinked_files: int) -> None:
+        self.copied = copied
+        self.num_skipped_files = num_skipped_files
+        self.num_skipped_bytes = num_skipped_bytes
+        self.num_removed_files = num_removed_files
+        self.num_reflinked_files = num_reflinked_files
+
+
+# Copies an existing database into an "import-db" folder (mirroring it), in parallel, using copy-on-write clones where possible.
+# Incremental: files already identical (same size, modification time and, unless "quick", content hash) are skipped.
+# Once complete, a manifest (next to the folder) records the provisioned files, so that the folder can be checked before the import starts.
+class ImportDbProvisioner:
+    def __init__(self, threads: int, quick: bool = False) -> None:
+        self.threads = threads
+        self.quick = quick
+        # Reflinks are tried until the first "not supported" error.
+        self.allow_reflinks = True
+
+    def provision(self, source: Path, destination: Path) -> ProvisioningResult:
+        if not source.is_dir():
+            raise errors.KnownError(f"import-db source not found: {source}")
+
+        started_at = time.perf_counter()
+        manifest_path = get_manifest_path(destination)
+        # Until provisioning completes, the folder is not considered complete.
+        manifest_path.unlink(missing_ok=True)
+
+        source_files = scan_files(source)
+        destination_files = scan_files(destination) if destination.exists() else {}
+
+        removed = [relative_path for relative_path in destination_files if relative_path not in source_files]
+        for relative_path in removed:
+            (destination / relative_path).unlink()
+
+        candidates = [relative_path for relative_path, stats in source_files.items() if destination_files.get(relative_path) == stats]
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            if self.quick:
+                skipped = set(candidates)
+            else:
+                same_content = executor.map(lambda relative_path: hash_file(source / relative_path) == hash_file(destination / relative_path), candidates)
+                skipped = {relative_path for relative_path, is_same in zip(candidates, same_content) if is_same}
+
+            to_copy = [relative_path for relative_path in source_files if relative_path not in skipped]
+
+            for folder in sorted({(destination / relative_path).parent for relative_path in to_copy} | {destination}):
+                folder.mkdir(parents=True, exist_ok=True)
+
+            futures = [executor.submit(self._copy_file, source / relative_path, destination / relative_path) for relative_path in to_copy]
+            num_reflinked_files = sum(1 for future in futures if future.result())
+
+        num_copied_bytes = sum(source_files[relative_path][0] for relative_path in to_copy)
+        num_skipped_bytes = sum(source_files[relative_path][0] for relative_path in skipped)
+        write_manifest(manifest_path, source, scan_files(destination))
+
+        return ProvisioningResult(
+            copied=TransferStatistics(len(to_copy), num_copied_bytes, time.perf_counter() - started_at),
+            num_skipped_files=len(skipped),
+            num_skipped_bytes=num_skipped_bytes,
+            num_removed_files=len(removed),
+            num_reflinked_files=num_reflinked_files,
+        )
+
+    # Returns whether the file has been cloned (reflink).
+    def _copy_file(self, source: Path, destination: Path) -> bool:
+        destination.unlink(missing_ok=True)
+
+        if self.allow_reflinks:
+            if try_reflink(source, destination):
+                return True
+
+            self.allow_reflinks = False
+
+        copy_sparse_file(source, destination)
+        return False
+
+
+# Checks that an "import-db" folder is complete, according to its manifest (written by the provisioning).
+# Once an import has started with it, the folder may be modified by the node (thus, it is only checked for existence).
+def verify_import_db(path: Path):
+    if not path.is_dir() or not any(path.iterdir()):
+        raise errors.KnownError(f"import-db folder is missing or empty: {path}")
+
+    manifest_path = get_manifest_path(path)
+    manifest = load_manifest(manifest_path)
+
+    if manifest is None:
+        print(f"[yellow]import-db folder {path} has not been provisioned by 'provision.py', its completeness cannot be checked.")
+        return
+
+    if manifest.get("usedAt") is not None:
+        return
+
+    expected_files: dict[str, list[int]] = manifest["files"]
+    actual_files = {str(relative_path): list(stats) for relative_path, stats in scan_files(path).items()}
+    missing = [name for name in expected_files if name not in actual_files]
+    changed = [name for name in expected_files if name in actual_files and actual_files[name] != expected_files[name]]
+
+    if missing or changed:
+        raise errors.KnownError(f"import-db folder {path} is incomplete: {len(missing)} missing and {len(changed)} changed files (provision it again)")
+
+    manifest["usedAt"] = time.time()
+    manifest_path.write_text(json.dumps(manifest))
+
+
+# Returns, by relative path: (size, modification time in nanoseconds).
+def scan_files(folder: Path) -> dict[Path, tuple[int, int]]:
+    files: dict[Path, tuple[int, int]] = {}
+
+    for root, _, names in os.walk(folder):
+        for name in names:
+            path = Path(root) / name
+            stats = path.stat()
+            files[path.relative_to(folder)] = (stats.st_size, stats.st_mtime_ns)
+
+    return files
+
+
+def get_manifest_path(path: Path) -> Path:
+    # Next to the folder (not inside it), so that the node does not see it.
+    return path.parent / f"{path.name}{IMPORT_DB_MANIFEST_SUFFIX}"
+
+
+def write_manifest(manifest_path: Path, source: Path, files: dict[Path, tuple[int, int]]):
+    manifest = {
+        "source": str(source),
+        "provisionedAt": time.time(),
+        "usedAt": None,
+        "files": {str(relative_path): list(stats) for relative_path, stats in files.items()},
+    }
+
+    partial_path = manifest_path.with_name(f"{manifest_path.name}.partial")
+    partial_path.write_text(json.dumps(manifest))
+    partial_path.rename(manifest_path)
+
+
+def load_manifest(manifest_path: Path) -> Optional[dict[str, Any]]:
+    try:
+        return json.loads(manifest_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
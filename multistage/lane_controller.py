@@ -1,67 +1,623 @@
 import asyncio
+import sqlite3
+import time
 from typing import Any, Coroutine, Optional
 
 from rich import print
+from rich.markup import escape
 from rich.rule import Rule
+from rich.table import Table
 
-from multistage.config import LaneConfig
-from multistage.constants import (NODE_MONITORING_PERIOD,
-                                  NODE_RETURN_CODE_SIGKILL,
-                                  NODE_RETURN_CODE_SUCCESS)
+from multistage import errors
+from multistage.config import LaneConfig, StageConfig
+from multistage.constants import (LANE_EVENTS_FILE_NAME, NODE_DB_FOLDER_NAME,
+                                  NODE_MONITORING_PERIOD, ONE_MB,
+                                  PROFILES_FOLDER_NAME, PROGRESS_WINDOW_SIZE)
+from multistage.import_db import verify_import_db
+from multistage.lane_journal import LaneJournal
+from multistage.metrics import LaneMetrics
+from multistage.profiler import EpochProfile
+from multistage.progress import Overshoot, ProgressEstimator, format_duration
+from multistage.resources import AdmissionSlot
+from multistage.run_history import RunRecorder
+from multistage.services import SharedServices
+from multistage.snapshots import SnapshotStore
 from multistage.stage_controller import StageController
+from multistage.status_poller import NodeStatus
 
 
 class LaneController:
-    def __init__(self, config: LaneConfig, initial_stage_name: str) -> None:
+    def __init__(self,
+                 config: LaneConfig,
+                 initial_stage_name: str,
+                 services: Optional[SharedServices] = None,
+                 is_initial_stage_configured: bool = False,
+                 is_initial_stage_partial: bool = False) -> None:
         self.config = config
         self.initial_stage_name = initial_stage_name
+        self.services = services
+        # When resuming, the configuration of the initial stage may already be in place.
+        self.is_initial_stage_configured = is_initial_stage_configured
+        # When resuming in the middle of a stage (its run is then not representative of the stage's duration).
+        self.is_initial_stage_partial = is_initial_stage_partial
+        self.journal = LaneJournal.new_for_lane(config)
+        self.metrics = LaneMetrics(config.name)
+        self.events_path = config.working_directory / LANE_EVENTS_FILE_NAME
+        self.snapshots = SnapshotStore.new_for_lane(config)
+        # Held while a heavy stage runs.
+        self.admission_slot: Optional[AdmissionSlot] = None
+        # Set if heavy stages must also be granted by a coordinator (see "agent"), which spreads them across hosts.
+        self.admission_grant: Optional[asyncio.Event] = None
+        # While waiting for a slot for a heavy stage (either from the coordinator or on the host).
+        self.is_awaiting_admission = False
+        self.is_awaiting_grant = False
+        # Set if the lane was asked to stop (without advancing).
+        self.stopping = asyncio.Event()
+        # Restarts of nodes (by the supervisor): stage, and downtime.
+        self.restarts: list[tuple[str, Optional[float]]] = []
         self.current_stage_controller: Optional[StageController] = None
+        self.current_stage_name: Optional[str] = None
+        # Records the current stage run in the history (if any).
+        self.recorder: Optional[RunRecorder] = None
+        self.return_code: Optional[int] = None
+        self.succeeded = False
+        self.transitions_gaps: dict[str, float] = {}
+        self.overshoots: dict[str, Overshoot] = {}
+        self.shutdowns_durations: dict[str, float] = {}
+        # Time from the start of the node until it processes blocks again (e.g. after opening, maybe recovering, its storage).
+        self.recoveries_durations: dict[str, float] = {}
 
     def start(self):
         try:
-            asyncio.run(self._do_start())
+            asyncio.run(self._do_start_with_own_services())
         except KeyboardInterrupt:
             print("Processing lane interrupted.")
 
-    async def _do_start(self):
+    async def _do_start_with_own_services(self):
+        self.services = SharedServices()
+
+        try:
+            await self.run()
+        finally:
+            self.services.close()
+
+    async def run(self):
+        assert self.services is not None
+
+        self.services.metrics.register(self.metrics)
         stages = self.config.get_stages_including_and_after(self.initial_stage_name)
+        controllers = [self.create_stage_controller(stage) for stage in stages]
+        working_directory = self.config.working_directory
+        working_directory.mkdir(parents=True, exist_ok=True)
 
-        for stage in stages:
-            print(Rule(f"[bold yellow]{stage.name}"))
+        previous_controller: Optional[StageController] = None
+        preparation: Optional[asyncio.Task[None]] = None
 
-            self.current_stage_controller = StageController(stage)
+        try:
+            for index, controller in enumerate(controllers):
+                if self.stopping.is_set():
+                    return
 
-            working_directory = self.config.working_directory
-            working_directory.mkdir(parents=True, exist_ok=True)
+                print(Rule(f"[bold yellow]{self.config.name} / {controller.config.name}"))
 
-            self.current_stage_controller.configure(working_directory)
+                self.current_stage_name = controller.config.name
+                self.current_stage_controller = controller
 
-            coroutines: list[Coroutine[Any, Any, None]] = [
-                self.current_stage_controller.start(working_directory),
-                self.monitor_stage()
-            ]
+                if index == 0 and self.is_initial_stage_configured:
+                    print(f"{self.config.name}: configuration of stage {controller.config.name} is already installed, skipping its preparation.")
+                else:
+                    await self.ensure_prepared(controller, preparation)
+                    preparation = None
 
-            tasks = [asyncio.create_task(item) for item in coroutines]
-            await asyncio.gather(*tasks, return_exceptions=False)
+                    # The actual transition: swap the configuration, then start the node.
+                    # Off the event loop (shared by all lanes): libraries are hashed (and possibly copied) into the artifact store, under a file lock.
+                    await asyncio.to_thread(controller.install_prepared, working_directory)
+                    # The fingerprint walks the configuration tree, and the journal is synced: off the event loop, as well.
+                    await asyncio.to_thread(self.journal.record_config_installed, controller.config, controller.prepared_checksum, working_directory / "config")
 
-            return_code = self.current_stage_controller.return_code
+                await self.verify_import_db(controller)
+                await self.admit(controller)
+                restarts = 0
+                restart_reason = ""
+                restarted_from: Optional[StageController] = None
 
-            if return_code == NODE_RETURN_CODE_SIGKILL:
-                continue
-            if return_code != NODE_RETURN_CODE_SUCCESS:
-                break
+                # The node of the stage is restarted (by the supervisor) if it stalls or crashes, within the limits of its policy.
+                while True:
+                    if self.stopping.is_set():
+                        return
+
+                    await controller.spawn(working_directory)
+                    await asyncio.to_thread(self.journal.record_stage_started, controller.config)
+                    self.metrics.on_stage_started(controller.config.name, controller.started_at)
+                    # Runs of restarted nodes are not representative of the stage's duration, either.
+                    await self.start_recording(controller, (index == 0 and self.is_initial_stage_partial) or restarted_from is not None)
+                    self.emit_event("stageStarted", controller, {"nodeStarts": self.metrics.node_starts, "restarts": restarts})
+
+                    if restarted_from is not None:
+                        await self.report_restart(restarted_from, controller, restarts, restart_reason)
+                    else:
+                        self.report_transition(previous_controller, controller)
+                        await asyncio.to_thread(controller.clean_staging, working_directory)
+
+                        # The next stage is prepared while the current one is running.
+                        if index + 1 < len(controllers):
+                            preparation = asyncio.create_task(self.prepare_in_background(controllers[index + 1]))
+
+                    await self.wait_for_node(controller)
+
+                    try:
+                        self.check_outcome(controller)
+                        break
+                    except errors.TransientError as error:
+                        if not await self.wait_before_restart(controller, error, restarts):
+                            return
+
+                        restarts += 1
+                        restart_reason = str(error)
+                        restarted_from = controller
+                        controller = self.create_stage_controller(controller.config)
+                        self.current_stage_controller = controller
+
+                self.release_admission()
+                previous_controller = controller
+
+                # Stopped on purpose: the lane advances, whatever the return code (e.g. non-zero after a signal, or -9 after escalation).
+                # Unless interrupted (the lane was stopped).
+                if not controller.is_completed():
+                    return
+
+                if index + 1 < len(controllers):
+                    await self.take_snapshot(controller, controllers[index + 1])
+
+            self.succeeded = True
+        finally:
+            self.release_admission()
+
+            if preparation is not None:
+                preparation.cancel()
+
+    # Until the node exits (while monitoring the stage), then records the outcome of the run.
+    async def wait_for_node(self, controller: StageController):
+        coroutines: list[Coroutine[Any, Any, None]] = [
+            controller.wait(),
+            self.monitor_stage()
+        ]
+
+        tasks = [asyncio.create_task(item) for item in coroutines]
+        await asyncio.gather(*tasks, return_exceptions=False)
+
+        return_code = controller.return_code
+        self.return_code = return_code
+        await asyncio.to_thread(self.journal.record_stage_completed, controller.config, return_code, controller.stop_requested, controller.interrupted)
+
+        shutdown_duration = controller.get_shutdown_duration()
+        if shutdown_duration is not None:
+            self.shutdowns_durations[controller.config.name] = shutdown_duration
+
+        stage_duration = controller.get_duration()
+        self.metrics.on_stage_completed(controller.config.name, stage_duration, return_code)
+        profile = await self.report_profile(controller)
+        await self.complete_recording(controller, stage_duration, profile)
+        self.emit_event("stageCompleted", controller, {
+            "returnCode": return_code,
+            "stopRequested": controller.stop_requested,
+            "interrupted": controller.interrupted,
+            "stalled": controller.stall_duration is not None,
+            "duration": stage_duration,
+            "shutdownDuration": shutdown_duration,
+        })
+
+    # Raises a "TransientError" if the node failed in a way that a restart may fix: it stalled, or crashed.
+    # Other errors (e.g. a missing binary, a bad configuration) are raised as they happen, and end the lane.
+    def check_outcome(self, controller: StageController):
+        stage_name = controller.config.name
+
+        if controller.stall_duration is not None:
+            raise errors.TransientError(f"node of stage {stage_name} stalled (no progress for {format_duration(controller.stall_duration)})")
+        if not controller.is_completed() and not self.stopping.is_set():
+            raise errors.TransientError(f"node of stage {stage_name} exited with return code {controller.return_code}")
+
+    # Returns whether to restart the node (once the backoff is over), according to the supervisor policy of the stage.
+    async def wait_before_restart(self, controller: StageController, error: errors.TransientError, restarts: int) -> bool:
+        supervisor = controller.config.supervisor
+
+        if self.stopping.is_set():
+            return False
+
+        if restarts >= supervisor.max_restarts:
+            if supervisor.max_restarts > 0:
+                print(f"[bold red]{self.config.name}: {escape(str(error))}, giving up after {restarts} restart(s).")
+                self.emit_event("restartsExhausted", controller, {"reason": str(error), "restarts": restarts})
+
+            return False
+
+        backoff = supervisor.get_backoff(restarts)
+        print(f"[bold yellow]{self.config.name}: {escape(str(error))}, restarting the node in {format_duration(backoff)} (restart {restarts + 1} of {supervisor.max_restarts}) ...")
+
+        # Stopping the lane cuts the backoff short (and cancels the restart).
+        try:
+            await asyncio.wait_for(self.stopping.wait(), backoff)
+        except TimeoutError:
+            pass
+
+        return not self.stopping.is_set()
+
+    # Downtime: from the exit of the failed node (or, if it stalled, from its last progress) to the start of the new one.
+    async def report_restart(self, failed_controller: StageController, controller: StageController, restarts: int, reason: str):
+        downtime: Optional[float] = None
+
+        if failed_controller.stopped_at is not None and controller.started_at is not None:
+            downtime = controller.started_at - failed_controller.stopped_at + (failed_controller.stall_duration or 0)
+
+        stage_name = controller.config.name
+        self.restarts.append((stage_name, downtime))
+        self.metrics.on_node_restarted(downtime)
+        await asyncio.to_thread(self.journal.record_node_restarted, controller.config, restarts, reason, downtime)
+
+        downtime_text = f", after {format_duration(downtime)} of downtime" if downtime is not None else ""
+        print(f"[bold]{self.config.name}: node of stage {stage_name} restarted (restart {restarts}){downtime_text}.")
+        self.emit_event("nodeRestarted", controller, {"restarts": restarts, "reason": reason, "downtime": downtime})
+
+    def create_stage_controller(self, stage: StageConfig) -> StageController:
+        assert self.services is not None
+
+        return StageController(
+            stage,
+            lane_name=self.config.name,
+            status_poller=self.services.status_poller,
+            archives_cache=self.services.archives_cache,
+            artifact_store=self.services.artifact_store,
+        )
+
+    async def verify_import_db(self, controller: StageController):
+        import_db_path = controller.config.get_import_db_path(self.config.working_directory)
+
+        if import_db_path is not None:
+            # Raises if incomplete: better fail now than halfway through the import.
+            await asyncio.to_thread(verify_import_db, import_db_path)
+
+    async def admit(self, controller: StageController):
+        assert self.services is not None
+
+        if not controller.config.heavy:
+            return
+
+        self.is_awaiting_admission = True
+
+        try:
+            if self.admission_grant is not None:
+                await self.wait_for_grant(controller)
+
+            self.admission_slot = await self.services.admission.acquire(f"{self.config.name} / {controller.config.name}")
+        finally:
+            self.is_awaiting_admission = False
+
+    async def wait_for_grant(self, controller: StageController):
+        assert self.admission_grant is not None
+
+        print(f"{self.config.name} / {controller.config.name}: heavy stage waits for the coordinator ...")
+        self.is_awaiting_grant = True
+
+        try:
+            await self.admission_grant.wait()
+        finally:
+            self.is_awaiting_grant = False
+
+        # Each heavy stage needs its own grant.
+        self.admission_grant.clear()
+
+    def release_admission(self):
+        if self.admission_slot is not None:
+            self.admission_slot.release()
+            self.admission_slot = None
+
+    # Stops the node of the current stage (gracefully), without advancing: the lane ends, and can be resumed later.
+    # If no node is running (e.g. the next stage is being prepared), the lane ends before starting one.
+    async def stop(self):
+        self.stopping.set()
+        controller = self.current_stage_controller
+
+        if controller is not None and controller.is_running():
+            await controller.stop(interrupted=True)
+
+    # Ends the current stage now (as if the node reached its target): the lane advances to the next stage.
+    async def skip_stage(self) -> bool:
+        controller = self.current_stage_controller
+
+        if controller is None or not controller.is_running():
+            return False
+
+        print(f"{self.config.name}: skipping (the rest of) stage {controller.config.name} ...")
+        self.emit_event("stageSkipped", controller, {"epoch": self.metrics.epoch, "nonce": self.metrics.nonce})
+        await controller.stop()
+        return True
+
+    async def ensure_prepared(self, controller: StageController, preparation: Optional["asyncio.Task[None]"]):
+        if preparation is not None:
+            try:
+                await preparation
+                return
+            except Exception:
+                print(f"[yellow]{self.config.name}: retrying the preparation of stage {controller.config.name} ...")
+
+        await self.prepare(controller)
+
+    async def prepare(self, controller: StageController):
+        assert self.services is not None
+
+        async with self.services.transitions:
+            started_at = time.perf_counter()
+            await asyncio.to_thread(controller.prepare, self.config.working_directory)
+            self.emit_event("stagePrepared", controller, {"duration": time.perf_counter() - started_at, "checksum": controller.prepared_checksum})
+
+    async def prepare_in_background(self, controller: StageController):
+        try:
+            await self.prepare(controller)
+            print(f"{self.config.name}: stage {controller.config.name} is prepared.")
+        except Exception as error:
+            # Reported as soon as possible, instead of at the stage boundary.
+            print(f"[red]{self.config.name}: cannot prepare stage {controller.config.name}:[/red] {escape(str(error))}")
+            raise
+
+    async def take_snapshot(self, controller: StageController, next_controller: StageController):
+        if self.snapshots is None:
+            return
+
+        next_stage_name = next_controller.config.name
+        print(f"{self.config.name}: taking a snapshot of the database, for stage {next_stage_name} ...")
+
+        try:
+            statistics = await asyncio.to_thread(self.snapshots.take, self.config.working_directory / NODE_DB_FOLDER_NAME, controller.config.name, next_stage_name)
+        except Exception as error:
+            # Snapshots are a safety net: the lane goes on without them.
+            print(f"[yellow]{self.config.name}: cannot take a snapshot for stage {next_stage_name}:[/yellow] {escape(str(error))}")
+            self.emit_event("snapshotFailed", controller, {"nextStage": next_stage_name, "error": str(error)})
+            return
+
+        print(f"{self.config.name}: snapshot for stage {next_stage_name} taken: {statistics}.")
+        self.emit_event("snapshotTaken", controller, {
+            "nextStage": next_stage_name,
+            "files": statistics.num_files,
+            "bytes": statistics.num_bytes,
+            "duration": statistics.duration,
+            "throughput": statistics.get_throughput(),
+        })
+
+    async def start_recording(self, controller: StageController, partial: bool):
+        assert self.services is not None
+
+        self.recorder = None
+        if self.services.history is None:
+            return
+
+        recorder = RunRecorder(self.services.history, self.config.name, controller.config, partial)
+
+        try:
+            await asyncio.to_thread(recorder.start)
+        except (sqlite3.Error, OSError) as error:
+            # The history is informative: the lane goes on without it.
+            print(f"[yellow]{self.config.name}: cannot record the run of stage {controller.config.name} in the history:[/yellow] {escape(str(error))}")
+            return
+
+        self.recorder = recorder
+        forecast = recorder.forecast
+
+        if forecast.duration is not None:
+            binary_text = "same node binary" if forecast.same_binary else "any node binary"
+            print(f"{self.config.name}: stage {controller.config.name} is expected to take ~{format_duration(forecast.duration)} (median of {forecast.num_runs} previous runs, {binary_text}).")
+
+    async def record_status(self, controller: StageController, estimator: ProgressEstimator, status: NodeStatus):
+        recorder = self.recorder
+        if recorder is None:
+            return
+
+        nonce_rate = estimator.get_nonce_rate()
+
+        if recorder.observe(status) and controller.started_at is not None:
+            try:
+                await asyncio.to_thread(recorder.add_sample, status, status.received_at - controller.started_at, nonce_rate)
+            except (sqlite3.Error, OSError) as error:
+                print(f"[yellow]{self.config.name}: cannot record a sample in the history:[/yellow] {escape(str(error))}")
+
+        # Only once the rate is measured over a full window (e.g. not while the node recovers its storage).
+        if recorder.is_flagged_slow or len(estimator.samples) < PROGRESS_WINDOW_SIZE or not recorder.is_much_slower(nonce_rate):
+            return
+
+        recorder.is_flagged_slow = True
+        expected_rate = recorder.forecast.blocks_per_second
+        print(f"[bold yellow]{self.config.name}: stage {controller.config.name} is much slower than its history: {nonce_rate:.1f} blocks/s, instead of ~{expected_rate:.1f} blocks/s.")
+        self.emit_event("slowerThanHistory", controller, {"blocksPerSecond": nonce_rate, "expectedBlocksPerSecond": expected_rate})
+
+    async def complete_recording(self, controller: StageController, duration: Optional[float], profile: Optional[EpochProfile]):
+        recorder = self.recorder
+        if recorder is None:
+            return
+
+        self.recorder = None
+        completed = controller.is_completed()
+
+        try:
+            await asyncio.to_thread(recorder.complete, duration, controller.return_code, completed, profile)
+        except (sqlite3.Error, OSError) as error:
+            print(f"[yellow]{self.config.name}: cannot record the outcome of stage {controller.config.name} in the history:[/yellow] {escape(str(error))}")
+
+        expected_duration = recorder.forecast.duration
+        if completed and duration is not None and expected_duration is not None and recorder.is_much_longer(duration):
+            print(f"[bold yellow]{self.config.name}: stage {controller.config.name} took {format_duration(duration)}, much longer than its history (~{format_duration(expected_duration)}).")
+            self.emit_event("slowerThanHistory", controller, {"duration": duration, "expectedDuration": expected_duration})
+
+    # Prints (and exports, in the working directory) the resource usage of the node, per epoch. Returns the total.
+    async def report_profile(self, controller: StageController) -> Optional[EpochProfile]:
+        profiler = controller.profiler
+        if profiler is None or not profiler.profiles:
+            return None
+
+        total = profiler.get_total()
+        name = f"{controller.config.name}.{time.strftime('%Y%m%d-%H%M%S')}"
+
+        table = Table(title=f"{self.config.name} / {controller.config.name}: resource usage of the node")
+        table.add_column("Epoch")
+        table.add_column("Blocks")
+        table.add_column("Duration")
+        table.add_column("CPU (s)")
+        table.add_column("Cores (avg)")
+        table.add_column("Read (MB)")
+        table.add_column("Written (MB)")
+        table.add_column("Peak RSS (MB)")
+        table.add_column("Peak open files")
+        table.add_column("Peak threads")
+
+        for profile in profiler.get_profiles() + [total]:
+            if profile is total:
+                label = "[bold]total"
+            else:
+                label = str(profile.epoch) if profile.epoch is not None else "(start)"
+
+            num_blocks = profile.get_num_blocks()
+
+            table.add_row(
+                label,
+                str(num_blocks) if num_blocks is not None else "-",
+                format_duration(profile.duration),
+                f"{profile.cpu_seconds:.1f}",
+                f"{profile.get_cpu_usage():.2f}",
+                f"{profile.read_bytes / ONE_MB:.1f}",
+                f"{profile.written_bytes / ONE_MB:.1f}",
+                f"{profile.peak_rss_bytes / ONE_MB:.0f}",
+                str(profile.peak_open_files),
+                str(profile.peak_threads),
+            )
+
+        print(table)
+
+        try:
+            summary_path = await asyncio.to_thread(profiler.export, self.config.working_directory / PROFILES_FOLDER_NAME, name)
+            print(f"{self.config.name}: resource usage per epoch exported to {summary_path}.")
+        except OSError as error:
+            print(f"[yellow]{self.config.name}: cannot export the resource usage of stage {controller.config.name}:[/yellow] {escape(str(error))}")
+
+        self.emit_event("stageProfile", controller, total.to_dictionary())
+        return total
+
+    def report_transition(self, previous_controller: Optional[StageController], controller: StageController):
+        if previous_controller is None or previous_controller.stopped_at is None or controller.started_at is None:
+            return
+
+        gap = controller.started_at - previous_controller.stopped_at
+        self.transitions_gaps[controller.config.name] = gap
+        self.metrics.transitions_durations[controller.config.name] = gap
+        self.emit_event("transition", controller, {"previousStage": previous_controller.config.name, "duration": gap})
+        print(f"[bold]{self.config.name}: transition {previous_controller.config.name} -> {controller.config.name} took {gap:.2f}s (no node running).")
 
     async def monitor_stage(self):
         controller = self.current_stage_controller
 
         assert controller is not None
 
+        estimator = ProgressEstimator.new_for_stage(controller.config)
+        delay = NODE_MONITORING_PERIOD
+        last_report_at = 0.0
+        first_nonce: Optional[int] = None
+        stall_window = controller.config.supervisor.stall_window
+        # Initially, the start of the node: it should open (maybe recover) its storage within the stall window, too.
+        last_progress_at = time.perf_counter()
+        last_nonce: Optional[int] = None
+
         while True:
-            await asyncio.sleep(NODE_MONITORING_PERIOD)
+            status = await controller.wait_for_status(delay)
 
             if not controller.is_running():
                 return
 
-            if controller.should_stop():
-                controller.stop()
+            now = time.perf_counter()
+
+            if status is not None and (last_nonce is None or status.nonce > last_nonce):
+                last_nonce = status.nonce
+                last_progress_at = now
+            elif stall_window is not None and now - last_progress_at >= stall_window:
+                await self.stop_stalled(controller, now - last_progress_at)
+                return
+
+            if status is None:
+                delay = NODE_MONITORING_PERIOD
+                continue
+
+            estimator.add(status)
+            # Kept on the event loop: throttled (at most one record per period) and not synced, thus a cheap append to the page cache.
+            self.journal.record_stage_progress(controller.config, status.epoch, status.nonce)
+            await self.record_status(controller, estimator, status)
+            self.metrics.epoch = status.epoch
+            self.metrics.nonce = status.nonce
+
+            if first_nonce is None:
+                first_nonce = status.nonce
+            elif status.nonce > first_nonce and controller.config.name not in self.recoveries_durations:
+                self.report_recovery(controller, status)
+
+            if estimator.is_target_reached(status):
+                overshoot = estimator.get_overshoot(status)
+                if overshoot is not None:
+                    self.overshoots[controller.config.name] = overshoot
+
+                print(f"{self.config.name}: stage {controller.config.name} reached its target at epoch {status.epoch}, block {status.nonce} ({overshoot or 'overshoot unknown'}).")
+                self.emit_event("targetReached", controller, {
+                    "epoch": status.epoch,
+                    "nonce": status.nonce,
+                    "overshootBlocks": overshoot.blocks if overshoot else None,
+                    "overshootSeconds": overshoot.seconds if overshoot else None,
+                })
+
+                if controller.is_running():
+                    await controller.stop()
                 return
+
+            delay = estimator.get_next_poll_delay()
+            if stall_window is not None:
+                delay = min(delay, stall_window)
+
+            if status.received_at - last_report_at >= NODE_MONITORING_PERIOD:
+                self.report_progress(controller, estimator, status)
+                last_report_at = status.received_at
+
+    async def stop_stalled(self, controller: StageController, stall_duration: float):
+        print(f"[bold red]{self.config.name}: node of stage {controller.config.name} made no progress for {format_duration(stall_duration)} (last block: {self.metrics.nonce}), stopping it ...")
+        self.emit_event("stalled", controller, {"duration": stall_duration, "epoch": self.metrics.epoch, "nonce": self.metrics.nonce})
+        controller.stall_duration = stall_duration
+
+        if controller.is_running():
+            await controller.stop(interrupted=True)
+
+    def report_recovery(self, controller: StageController, status: NodeStatus):
+        if controller.started_at is None:
+            return
+
+        # Upper bound: the first block after the start is observed at the next poll.
+        recovery_duration = status.received_at - controller.started_at
+        self.recoveries_durations[controller.config.name] = recovery_duration
+        print(f"{self.config.name}: node of stage {controller.config.name} resumed processing blocks {recovery_duration:.2f}s after its start.")
+        self.emit_event("recovery", controller, {"duration": recovery_duration})
+
+    def report_progress(self, controller: StageController, estimator: ProgressEstimator, status: NodeStatus):
+        nonce_rate = estimator.get_nonce_rate()
+        epochs_per_hour = estimator.get_epochs_per_hour()
+        eta = estimator.get_eta()
+        rate_text = f", {nonce_rate:.1f} blocks/s" if nonce_rate is not None else ""
+        eta_text = f", target in ~{format_duration(eta)}" if eta is not None else ""
+
+        print(f"{self.config.name}: Epoch = {status.epoch}, block = {status.nonce}{rate_text}{eta_text}")
+
+        self.metrics.blocks_per_second = nonce_rate or 0
+        self.metrics.epochs_per_hour = epochs_per_hour or 0
+        self.metrics.eta = eta
+        self.emit_event("progress", controller, {
+            "epoch": status.epoch,
+            "nonce": status.nonce,
+            "blocksPerSecond": nonce_rate,
+            "epochsPerHour": epochs_per_hour,
+            "eta": eta,
+        })
+
+    # Structured events (JSON lines) of the lane, written in the background.
+    def emit_event(self, event: str, controller: StageController, fields: dict[str, Any]):
+        assert self.services is not None
+        self.services.events.emit(self.events_path, event, {"lane": self.config.name, "stage": controller.config.name, **fields})
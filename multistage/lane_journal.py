@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from rich import print
+
+from multistage import errors
+from multistage.archive_cache import normalize_checksum
+from multistage.config import LaneConfig, StageConfig
+from multistage.constants import (LANE_JOURNAL_FILE_NAME,
+                                  LANE_JOURNAL_PROGRESS_PERIOD)
+
+EVENT_CONFIG_INSTALLED = "configInstalled"
+EVENT_STAGE_STARTED = "stageStarted"
+EVENT_STAGE_PROGRESS = "stageProgress"
+EVENT_STAGE_COMPLETED = "stageCompleted"
+EVENT_NODE_RESTARTED = "nodeRestarted"
+
+
+# Where (and how) a lane should resume, according to its journal.
+class ResumePoint:
+    def __init__(self, stage_name: Optional[str], is_configured: bool, last_epoch: Optional[int] = None, last_nonce: Optional[int] = None) -> None:
+        # None if all the stages of the lane are completed.
+        self.stage_name = stage_name
+        # Whether the configuration of the stage is already installed (and intact), thus the preparation can be skipped.
+        self.is_configured = is_configured
+        self.last_epoch = last_epoch
+        self.last_nonce = last_nonce
+
+
+# Append-only record (JSON lines) of the progress of a lane, kept in its working directory.
+# Events are flushed (and synced) as they are recorded, so that the journal survives crashes of the driver (or of the host).
+class LaneJournal:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.last_progress_at = 0.0
+
+    @classmethod
+    def new_for_lane(cls, config: LaneConfig):
+        return cls(config.working_directory / LANE_JOURNAL_FILE_NAME)
+
+    def record_config_installed(self, stage: StageConfig, checksum: Optional[str], config_directory: Path):
+        self._append(EVENT_CONFIG_INSTALLED, {
+            "stage": stage.name,
+            "archive": stage.configuration_archive,
+            "checksum": checksum,
+            "fingerprint": compute_directory_fingerprint(config_directory),
+        })
+
+    def record_stage_started(self, stage: StageConfig):
+        self._append(EVENT_STAGE_STARTED, {"stage": stage.name})
+
+    def record_stage_progress(self, stage: StageConfig, epoch: int, nonce: int):
+        # Throttled: the journal should stay small, and the monitoring loop cheap.
+        now = time.perf_counter()
+        if now - self.last_progress_at < LANE_JOURNAL_PROGRESS_PERIOD:
+            return
+
+        self.last_progress_at = now
+        self._append(EVENT_STAGE_PROGRESS, {"stage": stage.name, "epoch": epoch, "nonce": nonce}, sync=False)
+
+    # "interrupted": the node was stopped before the end of the stage (e.g. the lane was stopped), thus the lane does not advance.
+    def record_stage_completed(self, stage: StageConfig, return_code: int, stop_requested: bool, interrupted: bool = False):
+        self._append(EVENT_STAGE_COMPLETED, {"stage": stage.name, "returnCode": return_code, "stopRequested": stop_requested, "interrupted": interrupted})
+
+    # Informative (not used for resuming): restarts of the node within a stage, and the downtime they caused.
+    def record_node_restarted(self, stage: StageConfig, restart: int, reason: str, downtime: Optional[float]):
+        self._append(EVENT_NODE_RESTARTED, {"stage": stage.name, "restart": restart, "reason": reason, "downtime": downtime})
+
+    def _append(self, event: str, fields: dict[str, Any], sync: bool = True):
+        entry = {"event": event, "time": time.time(), **fields}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with open(self.path, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+            file.flush()
+
+            if sync:
+                os.fsync(file.fileno())
+
+    def load_entries(self) -> list[dict[str, Any]]:
+        if not self.path.exists():
+            return []
+
+        entries: list[dict[str, Any]] = []
+
+        for line in self.path.read_text().splitlines():
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # E.g. a line truncated by a crash (should only happen for the last one).
+                print(f"[yellow]Ignoring malformed line in journal {self.path}.")
+
+        return entries
+
+    def get_resume_point(self, config: LaneConfig) -> ResumePoint:
+        stages_names = config.get_stages_names()
+        stage_name: Optional[str] = stages_names[0]
+        installed: Optional[dict[str, Any]] = None
+        last_progress: dict[str, Any] = {}
+
+        for entry in self.load_entries():
+            event = entry.get("event")
+            entry_stage_name = entry.get("stage")
+
+            if entry_stage_name not in stages_names:
+                raise errors.BadConfigurationError(f"journal {self.path} refers to an unknown stage: {entry_stage_name} (lane {config.name})")
+
+            if event == EVENT_CONFIG_INSTALLED:
+                installed = entry
+            elif event in [EVENT_STAGE_STARTED, EVENT_STAGE_PROGRESS]:
+                stage_name = entry_stage_name
+                last_progress = entry
+            elif event == EVENT_STAGE_COMPLETED:
+                stage_name = entry_stage_name
+                advanced = not entry.get("interrupted") and (entry.get("stopRequested") or entry.get("returnCode") == 0)
+
+                if advanced:
+                    index = stages_names.index(entry_stage_name)
+                    stage_name = stages_names[index + 1] if index + 1 < len(stages_names) else None
+                    last_progress = {}
+
+        if stage_name is None:
+            return ResumePoint(None, False)
+
+        stage = config.get_stage(stage_name)
+        is_configured = installed is not None and is_installed_config_valid(installed, stage, config.working_directory / "config")
+        return ResumePoint(stage_name, is_configured, last_progress.get("epoch"), last_progress.get("nonce"))
+
+
+def is_installed_config_valid(installed: dict[str, Any], stage: StageConfig, config_directory: Path) -> bool:
+    if installed.get("stage") != stage.name or installed.get("archive") != stage.configuration_archive:
+        return False
+
+    expected_checksum = normalize_checksum(stage.configuration_archive_checksum)
+    if expected_checksum and normalize_checksum(installed.get("checksum")) != expected_checksum:
+        return False
+
+    if not config_directory.is_dir():
+        return False
+
+    # Detects configuration files altered (or removed) since the installation.
+    return installed.get("fingerprint") == compute_directory_fingerprint(config_directory)
+
+
+# Cheap (metadata-only) fingerprint of a directory tree.
+def compute_directory_fingerprint(directory: Path) -> str:
+    hasher = hashlib.sha256()
+
+    for root, folders, files in os.walk(directory):
+        folders.sort()
+
+        for file_name in sorted(files):
+            path = Path(root) / file_name
+            stat = path.stat()
+            hasher.update(f"{path.relative_to(directory)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+
+    return hasher.hexdigest()
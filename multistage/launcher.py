@@ -0,0 +1,82 @@
+import ctypes
+import os
+import platform
+import resource
+import sys
+from argparse import ArgumentParser
+
+# Applies limits & priorities to itself, then replaces itself with the node (same process, thus all the node's threads inherit them).
+# Self-contained (no imports of "multistage"), since it runs in the working directory of the node.
+
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+# Number of the "ioprio_set" system call, by architecture.
+SYSCALL_IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314}
+
+
+def main(cli_args: list[str] = sys.argv[1:]):
+    parser = ArgumentParser()
+    parser.add_argument("--max-open-files", type=int)
+    parser.add_argument("--nice", type=int)
+    parser.add_argument("--ionice-class", choices=list(IOPRIO_CLASSES.keys()))
+    parser.add_argument("--ionice-level", type=int)
+    parser.add_argument("--cpu-affinity", help="comma-separated CPUs")
+    parser.add_argument("program")
+    parser.add_argument("args", nargs="*")
+    args = parser.parse_args(cli_args)
+
+    if args.max_open_files is not None:
+        set_max_open_files(args.max_open_files)
+    if args.nice is not None:
+        set_priority(args.nice)
+    if args.ionice_class is not None or args.ionice_level is not None:
+        set_io_priority(args.ionice_class or "best-effort", args.ionice_level if args.ionice_level is not None else 4)
+    if args.cpu_affinity:
+        set_cpu_affinity([int(cpu) for cpu in args.cpu_affinity.split(",")])
+
+    os.execv(args.program, [args.program, *args.args])
+
+
+def set_max_open_files(limit: int):
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (limit, max(limit, hard)))
+    except (ValueError, PermissionError):
+        # Only privileged processes can raise the hard limit.
+        print(f"launcher: cannot raise the limit of open files to {limit}, using {hard}", file=sys.stderr)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(limit, hard), hard))
+
+
+def set_priority(nice: int):
+    try:
+        os.setpriority(os.PRIO_PROCESS, 0, nice)
+    except OSError as error:
+        # E.g. only privileged processes can lower the niceness.
+        print(f"launcher: cannot set niceness to {nice}: {error.strerror}", file=sys.stderr)
+
+
+def set_cpu_affinity(cpus: list[int]):
+    try:
+        os.sched_setaffinity(0, cpus)
+    except OSError as error:
+        # E.g. CPUs that do not exist (or are not available to this process).
+        print(f"launcher: cannot set CPU affinity to {cpus}: {error.strerror}", file=sys.stderr)
+
+
+def set_io_priority(io_class: str, level: int):
+    syscall_number = SYSCALL_IOPRIO_SET.get(platform.machine())
+    if syscall_number is None:
+        print(f"launcher: I/O priority not supported on {platform.machine()}", file=sys.stderr)
+        return
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    priority = (IOPRIO_CLASSES[io_class] << IOPRIO_CLASS_SHIFT) | level
+
+    if libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, priority) != 0:
+        print(f"launcher: cannot set I/O priority: {os.strerror(ctypes.get_errno())}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,185 @@
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+from rich import print
+
+from multistage import errors
+from multistage.downloader import download_statistics
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Plain attributes, updated in place by the lane (no allocations, no I/O); rendered only when scraped.
+class LaneMetrics:
+    def __init__(self, lane_name: str) -> None:
+        self.lane_name = lane_name
+        self.stage_name = ""
+        self.epoch = 0
+        self.nonce = 0
+        self.blocks_per_second = 0.0
+        self.epochs_per_hour = 0.0
+        # Estimated time (in seconds) until the target of the current stage, if known.
+        self.eta: Optional[float] = None
+        # Monotonic time (time.perf_counter()) of the start of the current stage's node.
+        self.stage_started_at: Optional[float] = None
+        self.stages_durations: dict[str, float] = {}
+        self.transitions_durations: dict[str, float] = {}
+        self.node_starts = 0
+        # Restarts by the supervisor (after a stall or a crash), and the downtime they caused.
+        self.node_restarts = 0
+        self.restarts_downtime = 0.0
+        self.return_code: Optional[int] = None
+
+    def on_stage_started(self, stage_name: str, started_at: Optional[float]):
+        self.stage_name = stage_name
+        self.stage_started_at = started_at
+        self.eta = None
+        self.node_starts += 1
+
+    def on_stage_completed(self, stage_name: str, duration: Optional[float], return_code: int):
+        if duration is not None:
+            self.stages_durations[stage_name] = duration
+
+        self.stage_started_at = None
+        self.eta = None
+        self.return_code = return_code
+
+    def on_node_restarted(self, downtime: Optional[float]):
+        self.node_restarts += 1
+        self.restarts_downtime += downtime or 0
+
+    def get_current_stage_duration(self) -> Optional[float]:
+        if self.stage_started_at is None:
+            return None
+
+        return time.perf_counter() - self.stage_started_at
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.lanes: dict[str, LaneMetrics] = {}
+
+    def register(self, lane_metrics: LaneMetrics):
+        self.lanes[lane_metrics.lane_name] = lane_metrics
+
+    def render(self) -> str:
+        writer = MetricsWriter()
+        lanes = list(self.lanes.values())
+
+        writer.add_family("multistage_lane_epoch", "gauge", "Last observed epoch.",
+                          [({"lane": lane.lane_name}, lane.epoch) for lane in lanes])
+        writer.add_family("multistage_lane_nonce", "gauge", "Last observed block (nonce).",
+                          [({"lane": lane.lane_name}, lane.nonce) for lane in lanes])
+        writer.add_family("multistage_lane_blocks_per_second", "gauge", "Recent block processing rate.",
+                          [({"lane": lane.lane_name}, lane.blocks_per_second) for lane in lanes])
+        writer.add_family("multistage_lane_epochs_per_hour", "gauge", "Recent epoch processing rate.",
+                          [({"lane": lane.lane_name}, lane.epochs_per_hour) for lane in lanes])
+        writer.add_family("multistage_lane_stage_eta_seconds", "gauge", "Estimated time until the target of the current stage.",
+                          [({"lane": lane.lane_name}, lane.eta) for lane in lanes if lane.eta is not None])
+        writer.add_family("multistage_lane_stage_info", "gauge", "Current stage of the lane.",
+                          [({"lane": lane.lane_name, "stage": lane.stage_name}, 1) for lane in lanes if lane.stage_name])
+        writer.add_family("multistage_lane_current_stage_seconds", "gauge", "Time spent in the current stage.",
+                          [({"lane": lane.lane_name}, duration) for lane in lanes if (duration := lane.get_current_stage_duration()) is not None])
+        writer.add_family("multistage_lane_stage_seconds", "gauge", "Time spent in completed stages.",
+                          [({"lane": lane.lane_name, "stage": stage}, duration) for lane in lanes for stage, duration in list(lane.stages_durations.items())])
+        writer.add_family("multistage_lane_transition_seconds", "gauge", "Duration of stage transitions (no node running).",
+                          [({"lane": lane.lane_name, "stage": stage}, duration) for lane in lanes for stage, duration in list(lane.transitions_durations.items())])
+        writer.add_family("multistage_lane_node_starts", "counter", "Number of node (re)starts.",
+                          [({"lane": lane.lane_name}, lane.node_starts) for lane in lanes])
+        writer.add_family("multistage_lane_node_restarts", "counter", "Number of node restarts by the supervisor (after a stall or a crash).",
+                          [({"lane": lane.lane_name}, lane.node_restarts) for lane in lanes])
+        writer.add_family("multistage_lane_restarts_downtime_seconds", "counter", "Downtime caused by the node restarts.",
+                          [({"lane": lane.lane_name}, lane.restarts_downtime) for lane in lanes])
+        writer.add_family("multistage_lane_return_code", "gauge", "Return code of the last stopped node.",
+                          [({"lane": lane.lane_name}, lane.return_code) for lane in lanes if lane.return_code is not None])
+
+        with download_statistics.lock:
+            writer.add_family("multistage_downloads", "counter", "Number of completed downloads.", [({}, download_statistics.num_downloads)])
+            writer.add_family("multistage_download_bytes", "counter", "Downloaded bytes.", [({}, download_statistics.downloaded_bytes)])
+            writer.add_family("multistage_download_seconds", "counter", "Time spent downloading.", [({}, download_statistics.duration)])
+            writer.add_family("multistage_download_last_throughput_bytes_per_second", "gauge", "Throughput of the last download.", [({}, download_statistics.last_throughput)])
+
+        return writer.get_text()
+
+
+# Prometheus text exposition format (version 0.0.4).
+class MetricsWriter:
+    def __init__(self) -> None:
+        self.lines: list[str] = []
+
+    def add_family(self, name: str, metric_type: str, help: str, samples: list[tuple[dict[str, str], Any]]):
+        sample_name = f"{name}_total" if metric_type == "counter" else name
+
+        self.lines.append(f"# HELP {sample_name} {help}")
+        self.lines.append(f"# TYPE {sample_name} {metric_type}")
+
+        for labels, value in samples:
+            self.lines.append(f"{sample_name}{format_labels(labels)} {value}")
+
+    def get_text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    escaped = [(key, value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")) for key, value in labels.items()]
+    return "{" + ",".join(f"{key}=\"{value}\"" for key, value in escaped) + "}"
+
+
+# Serves "/metrics" (in a background thread), for Prometheus (or compatible) scrapers.
+class MetricsServer:
+    def __init__(self, registry: MetricsRegistry, address: str) -> None:
+        host, port = parse_address(address)
+        handler = create_request_handler(registry)
+
+        try:
+            self.server = ThreadingHTTPServer((host, port), handler)
+        except OSError as error:
+            raise errors.KnownError(f"cannot serve metrics on {address}", error)
+
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+
+    def start(self):
+        host, port = self.server.server_address[:2]
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def create_request_handler(registry: MetricsRegistry) -> type[BaseHTTPRequestHandler]:
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(HTTPStatus.NOT_FOUND)
+                return
+
+            body = registry.render().encode()
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any):
+            # Scrapes are frequent, do not clutter the output.
+            pass
+
+    return MetricsRequestHandler
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+
+    if not port.isdigit():
+        raise errors.UsageError(f"bad metrics address (expected 'host:port'): {address}")
+
+    return host or "localhost", int(port)
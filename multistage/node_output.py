@@ -0,0 +1,196 @@
+import asyncio
+import codecs
+import re
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from multistage.constants import (NODE_LOGS_TAIL_PERIOD,
+                                  NODE_OUTPUT_TAIL_LINES, READ_CHUNK_SIZE)
+from multistage.status_poller import NodeStatus
+
+# E.g. "################ EPOCH 5 BEGINS IN ROUND (1234) ################"
+EPOCH_BEGINS_PATTERN = re.compile(r"EPOCH (\d+) BEGINS")
+# E.g. "shard block has been committed successfully    epoch = 5 shard = 0 round = 1234 nonce = 1200 hash = ..."
+COMMITTED_BLOCK_MARKER = "has been committed successfully"
+COMMITTED_BLOCK_FIELDS_PATTERN = re.compile(r"\b(epoch|round|nonce) = (\d+)")
+ANSI_ESCAPE_PATTERN = re.compile(r"\x1b\[[0-9;]*m")
+
+
+# Follows the output of a node (its stdout & stderr, or its log files), in order to detect progress (epoch changes, committed blocks)
+# as it happens, instead of polling the node's API. Only the most recent lines are kept (e.g. for error reports).
+class NodeOutputTracker:
+    def __init__(self, tail_lines: int = NODE_OUTPUT_TAIL_LINES) -> None:
+        self.lines: deque[str] = deque(maxlen=tail_lines)
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.partial_line = ""
+        self.epoch: Optional[int] = None
+        self.nonce: Optional[int] = None
+        self.current_round: Optional[int] = None
+        self.updated_at = 0.0
+        self.changed = asyncio.Event()
+        # Cleared once the node has stopped.
+        self.is_following = True
+        # The output is parsed outside of the event loop (see "follow_pipe", "follow_logs").
+        self.lock = threading.Lock()
+
+    # Returns whether progress has been detected.
+    def feed(self, data: bytes) -> bool:
+        with self.lock:
+            text = self.partial_line + self.decoder.decode(data)
+            lines = text.split("\n")
+            self.partial_line = lines.pop()
+
+            changed = False
+
+            for line in lines:
+                self.lines.append(line)
+                changed = self._parse_line(line) or changed
+
+            if changed:
+                self.updated_at = time.perf_counter()
+
+            return changed
+
+    def _parse_line(self, line: str) -> bool:
+        # Cheap checks first: most lines are of no interest.
+        if COMMITTED_BLOCK_MARKER in line:
+            for key, value in COMMITTED_BLOCK_FIELDS_PATTERN.findall(strip_ansi(line)):
+                if key == "epoch":
+                    self.epoch = int(value)
+                elif key == "round":
+                    self.current_round = int(value)
+                else:
+                    self.nonce = int(value)
+            return True
+
+        if "BEGINS" in line:
+            match = EPOCH_BEGINS_PATTERN.search(line)
+            if match:
+                self.epoch = int(match.group(1))
+                return True
+
+        return False
+
+    def get_status(self) -> Optional[NodeStatus]:
+        with self.lock:
+            if self.epoch is None or self.nonce is None:
+                return None
+
+            return NodeStatus(
+                epoch=self.epoch,
+                nonce=self.nonce,
+                current_round=self.current_round or 0,
+                is_syncing=False,
+                probable_highest_nonce=self.nonce,
+                received_at=self.updated_at,
+            )
+
+    async def wait_for_change(self, timeout: float) -> Optional[NodeStatus]:
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except TimeoutError:
+            return None
+
+        # Changes in the meantime are coalesced: only the latest state matters.
+        self.changed.clear()
+        return self.get_status()
+
+    def get_tail(self) -> list[str]:
+        with self.lock:
+            lines = list(self.lines)
+
+        return [strip_ansi(line) for line in lines]
+
+    # The pipe (stdout & stderr of the node) is drained by a dedicated thread, as fast as data comes, whatever the load of the event loop
+    # (an asyncio stream would stop reading once its buffer is full): the node is never blocked on writing its output.
+    # Ends once all writers have closed the pipe (the node has exited).
+    async def follow_pipe(self, read_fd: int):
+        loop = asyncio.get_running_loop()
+        done: asyncio.Future[None] = loop.create_future()
+        thread = threading.Thread(target=self._drain_pipe, args=(read_fd, loop, done), name="node-output", daemon=True)
+        thread.start()
+        await done
+
+    def _drain_pipe(self, read_fd: int, loop: asyncio.AbstractEventLoop, done: "asyncio.Future[None]"):
+        try:
+            with open(read_fd, "rb", buffering=0) as pipe:
+                while data := pipe.read(READ_CHUNK_SIZE):
+                    if self.feed(data):
+                        call_soon_threadsafe(loop, self.changed.set)
+        finally:
+            call_soon_threadsafe(loop, set_result_if_pending, done)
+
+    async def follow_logs(self, folder: Path, since: float):
+        # Log files are written by the node regardless of how fast they are read: tailing them cannot block the node.
+        current_path: Optional[Path] = None
+        offset = 0
+
+        while True:
+            latest_path = find_latest_log_file(folder, since)
+
+            if latest_path is not None and latest_path != current_path:
+                # First log file, or the node has rotated its logs.
+                current_path = latest_path
+                offset = 0
+
+            data = b""
+
+            if current_path is not None:
+                data, offset = await asyncio.to_thread(read_from_offset, current_path, offset)
+
+                if data and await asyncio.to_thread(self.feed, data):
+                    self.changed.set()
+
+            # Catching up (e.g. verbose logs): read again, right away.
+            if len(data) == READ_CHUNK_SIZE:
+                continue
+            if not self.is_following:
+                break
+
+            await asyncio.sleep(NODE_LOGS_TAIL_PERIOD)
+
+
+# The loop may be closed already (e.g. the node outlived the driver).
+def call_soon_threadsafe(loop: asyncio.AbstractEventLoop, callback: Callable[..., Any], *args: Any):
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+# The waiting task may have been cancelled.
+def set_result_if_pending(future: "asyncio.Future[None]"):
+    if not future.done():
+        future.set_result(None)
+
+
+def find_latest_log_file(folder: Path, since: float) -> Optional[Path]:
+    try:
+        candidates = [(item.stat().st_mtime, item) for item in folder.glob("*.log")]
+    except FileNotFoundError:
+        return None
+
+    # Ignore logs of previous runs (stages).
+    candidates = [(modified_time, item) for modified_time, item in candidates if modified_time >= since]
+    if not candidates:
+        return None
+
+    return max(candidates)[1]
+
+
+def read_from_offset(path: Path, offset: int) -> tuple[bytes, int]:
+    try:
+        with open(path, "rb") as file:
+            file.seek(offset)
+            data = file.read(READ_CHUNK_SIZE)
+    except FileNotFoundError:
+        return b"", offset
+
+    return data, offset + len(data)
+
+
+def strip_ansi(line: str) -> str:
+    return ANSI_ESCAPE_PATTERN.sub("", line)
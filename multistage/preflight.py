@@ -0,0 +1,363 @@
+import errno
+import os
+import shutil
+import socket
+import sys
+import time
+import traceback
+import urllib.request
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+import requests
+from rich import print
+from rich.markup import escape
+from rich.panel import Panel
+from rich.table import Table
+
+from multistage import errors
+from multistage.archive_cache import ArchiveCache, create_archive_cache
+from multistage.config import LaneConfig, StageConfig
+from multistage.constants import (ARCHIVES_CACHE_DEFAULT_BUDGET_GB,
+                                  ARCHIVES_CACHE_DEFAULT_FOLDER,
+                                  DOWNLOAD_CONNECT_TIMEOUT,
+                                  DOWNLOAD_READ_TIMEOUT, LANES_WILDCARD,
+                                  ONE_GB, ONE_MB,
+                                  PREFLIGHT_DEFAULT_MIN_FREE_DISK_GB,
+                                  PREFLIGHT_MAX_LANES_SHOWN, PREFLIGHT_WORKERS)
+from multistage.downloader import create_session
+from multistage.driver import load_driver_config, resolve_lanes_names
+from multistage.stage_controller import check_node_binary
+
+# Returns details (on success), raises a "KnownError" otherwise.
+CheckFunction = Callable[[], str]
+
+
+def main(cli_args: list[str] = sys.argv[1:]):
+    try:
+        return _do_main(cli_args)
+    except errors.KnownError as err:
+        print(Panel(f"[red]{traceback.format_exc()}"))
+        print(Panel(f"[red]{err.get_pretty()}"))
+        return 1
+
+
+# Checks what the lanes will need, before starting any of them: archives, binaries (and their libraries), ports, disk space.
+# Lanes driven by agents (see "host") should be checked on their own host, as well (binaries and disks are looked up locally).
+def _do_main(cli_args: list[str]):
+    parser = ArgumentParser()
+    parser.add_argument("--config", required=True, help="path of the 'driver' configuration file")
+    parser.add_argument("--lane", action="append", default=[], help=f"which lane to check (can be repeated; default: '{LANES_WILDCARD}')")
+    parser.add_argument("--archives-cache", default=ARCHIVES_CACHE_DEFAULT_FOLDER, help="folder of the (persistent) archives cache: archives found there are not requested")
+    parser.add_argument("--min-free-disk-gb", type=float, default=PREFLIGHT_DEFAULT_MIN_FREE_DISK_GB, help="free space required per lane, on the filesystem of its working directory")
+    args = parser.parse_args(cli_args)
+
+    driver_config = load_driver_config(args.config)
+    lanes_names = resolve_lanes_names(driver_config, args.lane or [LANES_WILDCARD])
+    lanes = [driver_config.get_lane(name) for name in lanes_names]
+    archives_cache = create_archive_cache(args.archives_cache, ARCHIVES_CACHE_DEFAULT_BUDGET_GB, 1)
+
+    checks = run_preflight_checks(lanes, archives_cache, int(args.min_free_disk_gb * ONE_GB))
+    return 0 if all(check.problem is None for check in checks) else 1
+
+
+class PreflightCheck:
+    def __init__(self, kind: str, subject: str, lanes: list[str], function: CheckFunction) -> None:
+        self.kind = kind
+        self.subject = subject
+        self.lanes = lanes
+        self.function = function
+        self.details = ""
+        self.problem: Optional[str] = None
+
+    def run(self):
+        try:
+            self.details = self.function()
+        except errors.KnownError as error:
+            self.problem = error.get_pretty().strip()
+        except Exception as error:
+            self.problem = f"cannot check: {error!r}"
+
+
+# Each archive, binary, port and filesystem is checked once, whatever the number of lanes (and stages) referring to it.
+def run_preflight_checks(lanes: list[LaneConfig], archives_cache: ArchiveCache, min_free_disk_bytes: int) -> list[PreflightCheck]:
+    started_at = time.perf_counter()
+    session = create_session()
+    checks = [
+        *create_archives_checks(lanes, archives_cache, session),
+        *create_binaries_checks(lanes),
+        *create_ports_checks(lanes),
+        *create_disks_checks(lanes, min_free_disk_bytes),
+    ]
+
+    print(f"Running {len(checks)} pre-flight checks, for {len(lanes)} lanes ...")
+
+    try:
+        with ThreadPoolExecutor(PREFLIGHT_WORKERS, thread_name_prefix="preflight") as executor:
+            list(executor.map(PreflightCheck.run, checks))
+    finally:
+        session.close()
+
+    print_preflight_checks(checks)
+
+    duration = time.perf_counter() - started_at
+    failed_checks = [check for check in checks if check.problem is not None]
+
+    if failed_checks:
+        print(f"[bold red]{len(failed_checks)} of {len(checks)} pre-flight checks failed ({duration:.1f}s).")
+    else:
+        print(f"[bold green]All {len(checks)} pre-flight checks passed ({duration:.1f}s).")
+
+    return checks
+
+
+def create_archives_checks(lanes: list[LaneConfig], archives_cache: ArchiveCache, session: requests.Session) -> list[PreflightCheck]:
+    stages_by_archive: dict[tuple[str, Optional[str]], list[tuple[LaneConfig, StageConfig]]] = {}
+
+    for lane in lanes:
+        for stage in lane.stages:
+            key = (stage.configuration_archive, stage.configuration_archive_checksum)
+            stages_by_archive.setdefault(key, []).append((lane, stage))
+
+    checks: list[PreflightCheck] = []
+
+    for (url, checksum), stages in stages_by_archive.items():
+        checks.append(PreflightCheck(
+            "archive",
+            url,
+            get_lanes_names([lane for lane, _ in stages]),
+            lambda url=url, checksum=checksum: check_archive(url, checksum, archives_cache, session),
+        ))
+
+    return checks
+
+
+def create_binaries_checks(lanes: list[LaneConfig]) -> list[PreflightCheck]:
+    lanes_by_bin: dict[Path, list[LaneConfig]] = {}
+
+    for lane in lanes:
+        for stage in lane.stages:
+            lanes_by_bin.setdefault(stage.bin, []).append(lane)
+
+    return [
+        PreflightCheck("binary", str(bin / "node"), get_lanes_names(bin_lanes), lambda bin=bin: check_binary(bin))
+        for bin, bin_lanes in lanes_by_bin.items()
+    ]
+
+
+# Stages of a lane run one after the other (thus, can share ports), while lanes (of a host) run at the same time.
+# Ports are compared regardless of the interface (e.g. "localhost" and "127.0.0.1").
+def create_ports_checks(lanes: list[LaneConfig]) -> list[PreflightCheck]:
+    lanes_by_port: dict[tuple[Optional[str], int], list[LaneConfig]] = {}
+    interfaces_by_port: dict[tuple[Optional[str], int], str] = {}
+    checks: list[PreflightCheck] = []
+
+    for lane in lanes:
+        for stage in lane.stages:
+            status_address = get_status_address(stage)
+            api_address = get_rest_api_address(stage)
+
+            if api_address is not None and api_address[1] != status_address[1]:
+                problem = f"'node status url' (port {status_address[1]}) does not match --rest-api-interface (port {api_address[1]})"
+                checks.append(PreflightCheck("port", f"{lane.name} / {stage.name}", [lane.name], lambda problem=problem: raise_problem(problem)))
+
+            for host, port in {status_address, api_address or status_address}:
+                key = (lane.host, port)
+                interfaces_by_port.setdefault(key, host)
+                port_lanes = lanes_by_port.setdefault(key, [])
+                if lane not in port_lanes:
+                    port_lanes.append(lane)
+
+    for (lane_host, port), port_lanes in lanes_by_port.items():
+        host = interfaces_by_port[(lane_host, port)]
+        subject = f"{host}:{port}" if lane_host is None else f"{host}:{port} (on {lane_host})"
+        is_local = lane_host is None
+        checks.append(PreflightCheck(
+            "port",
+            subject,
+            get_lanes_names(port_lanes),
+            lambda host=host, port=port, port_lanes=port_lanes, is_local=is_local: check_port(host, port, port_lanes, is_local),
+        ))
+
+    return checks
+
+
+# Lanes whose working directories are on the same filesystem share its free space.
+def create_disks_checks(lanes: list[LaneConfig], min_free_disk_bytes: int) -> list[PreflightCheck]:
+    lanes_by_device: dict[int, list[LaneConfig]] = {}
+    paths_by_device: dict[int, Path] = {}
+
+    for lane in lanes:
+        existing_path = get_existing_ancestor(lane.working_directory)
+        device = existing_path.stat().st_dev
+        lanes_by_device.setdefault(device, []).append(lane)
+        paths_by_device.setdefault(device, existing_path)
+
+    return [
+        PreflightCheck(
+            "disk",
+            str(paths_by_device[device]),
+            get_lanes_names(device_lanes),
+            lambda device=device, device_lanes=device_lanes: check_free_space(paths_by_device[device], len(device_lanes) * min_free_disk_bytes),
+        )
+        for device, device_lanes in lanes_by_device.items()
+    ]
+
+
+def check_archive(url: str, checksum: Optional[str], archives_cache: ArchiveCache, session: requests.Session) -> str:
+    parsed_url = urlparse(url)
+
+    if parsed_url.scheme in ["", "file"]:
+        path = Path(urllib.request.url2pathname(parsed_url.path))
+        if not path.is_file():
+            raise errors.KnownError(f"file not found: {path}")
+        return f"local file, {path.stat().st_size / ONE_MB:.1f} MB"
+
+    cached_path = archives_cache.find(url, checksum)
+    if cached_path is not None:
+        return f"in cache: {cached_path.name}"
+
+    timeout = (DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)
+
+    try:
+        response = session.head(url, allow_redirects=True, timeout=timeout)
+
+        # Some servers do not support HEAD: the download is started (then abandoned), instead.
+        if response.status_code == HTTPStatus.METHOD_NOT_ALLOWED:
+            with session.get(url, allow_redirects=True, timeout=timeout, stream=True) as response:
+                pass
+    except requests.RequestException as error:
+        raise errors.KnownError(f"cannot reach {url}", error)
+
+    if response.status_code != HTTPStatus.OK:
+        raise errors.KnownError(f"HTTP {response.status_code} ({response.reason})")
+
+    content_length = response.headers.get("Content-Length")
+    size = f", {int(content_length) / ONE_MB:.1f} MB" if content_length else ""
+    return f"HTTP {response.status_code}{size}"
+
+
+def check_binary(bin: Path) -> str:
+    # The libraries of a stage are deployed (to the working directory) from its "bin" folder.
+    env = os.environ.copy()
+    env["LD_LIBRARY_PATH"] = str(bin)
+    check_node_binary(bin, env)
+
+    libraries = sorted(library.name for library in bin.glob("*.so"))
+    return f"executable, libraries: {', '.join(libraries) or 'none (in bin)'}"
+
+
+# Ports of remote hosts (agents) can only be checked for clashes (between lanes), not for availability.
+def check_port(host: str, port: int, lanes: list[LaneConfig], is_local: bool) -> str:
+    if len(lanes) > 1:
+        raise errors.KnownError(f"used by {len(lanes)} lanes: {', '.join(lane.name for lane in lanes)}")
+    if not is_local:
+        return "no clash"
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        try:
+            probe.bind((host, port))
+        except socket.gaierror as error:
+            raise errors.KnownError(f"cannot resolve {host}", error)
+        except OSError as error:
+            if error.errno == errno.EADDRINUSE:
+                raise errors.KnownError("already in use, on this host (a node left running?)")
+            if error.errno == errno.EADDRNOTAVAIL:
+                return "no clash (not a local address)"
+            raise errors.KnownError(f"cannot bind {host}:{port}", error)
+
+    return "free"
+
+
+def check_free_space(path: Path, required_bytes: int) -> str:
+    free_bytes = shutil.disk_usage(path).free
+    details = f"{free_bytes / ONE_GB:.1f} GB free, {required_bytes / ONE_GB:.1f} GB required"
+
+    if free_bytes < required_bytes:
+        raise errors.KnownError(f"not enough space: {details}")
+
+    return details
+
+
+def raise_problem(problem: str) -> str:
+    raise errors.KnownError(problem)
+
+
+# E.g. "http://localhost:8080/node/status" (default ports, according to the scheme).
+def get_status_address(stage: StageConfig) -> tuple[str, int]:
+    parsed_url = urlparse(stage.node_status_url)
+    default_port = 443 if parsed_url.scheme == "https" else 80
+    return parsed_url.hostname or "localhost", parsed_url.port or default_port
+
+
+# E.g. "--rest-api-interface=localhost:8080", or "--rest-api-interface", ":8080".
+def get_rest_api_address(stage: StageConfig) -> Optional[tuple[str, int]]:
+    for index, arg in enumerate(stage.node_arguments):
+        value = None
+
+        if arg.startswith("--rest-api-interface="):
+            value = arg.split("=", 1)[1]
+        elif arg == "--rest-api-interface" and index + 1 < len(stage.node_arguments):
+            value = stage.node_arguments[index + 1]
+
+        if value is None:
+            continue
+
+        host, _, port = value.rpartition(":")
+        if not port.isdigit():
+            raise errors.BadConfigurationError(f"for stage {stage.name}, bad --rest-api-interface: {value}")
+
+        return host or "localhost", int(port)
+
+    return None
+
+
+# The working directory (of a lane that never ran) may not exist yet.
+def get_existing_ancestor(path: Path) -> Path:
+    while not path.exists() and path != path.parent:
+        path = path.parent
+
+    return path
+
+
+def get_lanes_names(lanes: list[LaneConfig]) -> list[str]:
+    names: list[str] = []
+
+    for lane in lanes:
+        if lane.name not in names:
+            names.append(lane.name)
+
+    return names
+
+
+def print_preflight_checks(checks: list[PreflightCheck]):
+    table = Table(title="Pre-flight checks")
+    table.add_column("Check")
+    table.add_column("Subject")
+    table.add_column("Lanes")
+    table.add_column("Result")
+
+    for check in checks:
+        lanes = ", ".join(check.lanes[:PREFLIGHT_MAX_LANES_SHOWN])
+        if len(check.lanes) > PREFLIGHT_MAX_LANES_SHOWN:
+            lanes += f", ... ({len(check.lanes)} lanes)"
+
+        if check.problem is None:
+            result = f"[green]ok[/green] ({escape(check.details)})"
+        else:
+            result = f"[red]{escape(check.problem)}[/red]"
+
+        table.add_row(check.kind, escape(check.subject), escape(lanes), result)
+
+    print(table)
+
+
+if __name__ == "__main__":
+    ret = main(sys.argv[1:])
+    sys.exit(ret)
@@ -0,0 +1,225 @@
+import asyncio
+import csv
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from multistage.constants import PROFILER_SAMPLE_PERIOD
+from multistage.status_poller import NodeStatus
+
+CLOCK_TICKS_PER_SECOND = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+# Fields of "/proc/<pid>/stat", counted after the command name (which may contain spaces): "state" is the first one.
+STAT_FIELD_UTIME = 11
+STAT_FIELD_STIME = 12
+STAT_FIELD_NUM_THREADS = 17
+STAT_FIELD_RSS = 21
+
+
+class ProcessSample:
+    def __init__(self,
+                 taken_at: float,
+                 cpu_seconds: float,
+                 rss_bytes: int,
+                 threads: int,
+                 read_bytes: Optional[int],
+                 write_bytes: Optional[int],
+                 open_files: Optional[int]) -> None:
+        # Monotonic time (time.perf_counter()).
+        self.taken_at = taken_at
+        # Cumulative (user and system).
+        self.cpu_seconds = cpu_seconds
+        self.rss_bytes = rss_bytes
+        self.threads = threads
+        # Cumulative, as seen by the storage layer (thus, excluding the page cache hits). None if not readable (permissions).
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+        self.open_files = open_files
+
+
+# Costs of an epoch (or of the whole stage), as seen from the node's process.
+class EpochProfile:
+    def __init__(self, epoch: Optional[int]) -> None:
+        # None for the time before the first observed status (e.g. while the node opens its storage).
+        self.epoch = epoch
+        self.first_nonce: Optional[int] = None
+        self.last_nonce: Optional[int] = None
+        self.duration = 0.0
+        self.cpu_seconds = 0.0
+        self.read_bytes = 0
+        self.written_bytes = 0
+        self.peak_rss_bytes = 0
+        self.peak_open_files = 0
+        self.peak_threads = 0
+
+    def add_interval(self, previous: ProcessSample, sample: ProcessSample, status: Optional[NodeStatus]):
+        if status is not None:
+            self.first_nonce = status.nonce if self.first_nonce is None else min(self.first_nonce, status.nonce)
+            self.last_nonce = status.nonce if self.last_nonce is None else max(self.last_nonce, status.nonce)
+
+        self.duration += sample.taken_at - previous.taken_at
+        self.cpu_seconds += max(sample.cpu_seconds - previous.cpu_seconds, 0)
+
+        if sample.read_bytes is not None and previous.read_bytes is not None:
+            self.read_bytes += max(sample.read_bytes - previous.read_bytes, 0)
+        if sample.write_bytes is not None and previous.write_bytes is not None:
+            self.written_bytes += max(sample.write_bytes - previous.write_bytes, 0)
+
+        self.peak_rss_bytes = max(self.peak_rss_bytes, sample.rss_bytes)
+        self.peak_open_files = max(self.peak_open_files, sample.open_files or 0)
+        self.peak_threads = max(self.peak_threads, sample.threads)
+
+    def merge(self, other: "EpochProfile"):
+        for nonce in [other.first_nonce, other.last_nonce]:
+            if nonce is not None:
+                self.first_nonce = nonce if self.first_nonce is None else min(self.first_nonce, nonce)
+                self.last_nonce = nonce if self.last_nonce is None else max(self.last_nonce, nonce)
+
+        self.duration += other.duration
+        self.cpu_seconds += other.cpu_seconds
+        self.read_bytes += other.read_bytes
+        self.written_bytes += other.written_bytes
+        self.peak_rss_bytes = max(self.peak_rss_bytes, other.peak_rss_bytes)
+        self.peak_open_files = max(self.peak_open_files, other.peak_open_files)
+        self.peak_threads = max(self.peak_threads, other.peak_threads)
+
+    def get_num_blocks(self) -> Optional[int]:
+        if self.first_nonce is None or self.last_nonce is None:
+            return None
+
+        return self.last_nonce - self.first_nonce
+
+    # Average number of busy cores.
+    def get_cpu_usage(self) -> float:
+        return self.cpu_seconds / self.duration if self.duration else 0
+
+    def to_dictionary(self) -> dict[str, Any]:
+        return {
+            "epoch": self.epoch,
+            "firstNonce": self.first_nonce,
+            "lastNonce": self.last_nonce,
+            "duration": self.duration,
+            "cpuSeconds": self.cpu_seconds,
+            "readBytes": self.read_bytes,
+            "writtenBytes": self.written_bytes,
+            "peakRssBytes": self.peak_rss_bytes,
+            "peakOpenFiles": self.peak_open_files,
+            "peakThreads": self.peak_threads,
+        }
+
+
+# Samples the resource usage of the node's process (from "/proc"), and joins it with the progress of the node:
+# the usage during an interval between two samples is attributed to the epoch of the last status observed at its end.
+# Each sample costs a few small reads (plus listing the open files), thus sampling can run in the event loop.
+class NodeProfiler:
+    def __init__(self, pid: int, period: float = PROFILER_SAMPLE_PERIOD) -> None:
+        self.pid = pid
+        self.period = period
+        self.samples: list[tuple[ProcessSample, Optional[NodeStatus]]] = []
+        self.profiles: dict[Optional[int], EpochProfile] = {}
+        self.previous_sample: Optional[ProcessSample] = None
+
+    async def run(self, get_status: Callable[[], Optional[NodeStatus]]):
+        while self.take_sample(get_status()):
+            await asyncio.sleep(self.period)
+
+    # Returns whether the process is still alive.
+    def take_sample(self, status: Optional[NodeStatus]) -> bool:
+        sample = read_process_sample(self.pid)
+        if sample is None:
+            return False
+
+        self.samples.append((sample, status))
+
+        if self.previous_sample is not None:
+            epoch = status.epoch if status is not None else None
+            profile = self.profiles.setdefault(epoch, EpochProfile(epoch))
+            profile.add_interval(self.previous_sample, sample, status)
+
+        self.previous_sample = sample
+        return True
+
+    def get_profiles(self) -> list[EpochProfile]:
+        return sorted(self.profiles.values(), key=lambda profile: -1 if profile.epoch is None else profile.epoch)
+
+    def get_total(self) -> EpochProfile:
+        total = EpochProfile(None)
+
+        for profile in self.profiles.values():
+            total.merge(profile)
+
+        return total
+
+    # Writes the per-epoch summary, and the raw samples, as CSV files. Returns the path of the summary.
+    def export(self, folder: Path, name: str) -> Path:
+        folder.mkdir(parents=True, exist_ok=True)
+        summary_path = folder / f"{name}.epochs.csv"
+        samples_path = folder / f"{name}.samples.csv"
+
+        rows = [profile.to_dictionary() for profile in self.get_profiles()]
+        fields = list(EpochProfile(None).to_dictionary().keys())
+        write_csv(summary_path, fields, rows)
+
+        first_taken_at = self.samples[0][0].taken_at if self.samples else 0
+        samples_rows = [{
+            "elapsed": sample.taken_at - first_taken_at,
+            "epoch": status.epoch if status else None,
+            "nonce": status.nonce if status else None,
+            "cpuSeconds": sample.cpu_seconds,
+            "rssBytes": sample.rss_bytes,
+            "readBytes": sample.read_bytes,
+            "writeBytes": sample.write_bytes,
+            "openFiles": sample.open_files,
+            "threads": sample.threads,
+        } for sample, status in self.samples]
+        write_csv(samples_path, ["elapsed", "epoch", "nonce", "cpuSeconds", "rssBytes", "readBytes", "writeBytes", "openFiles", "threads"], samples_rows)
+
+        return summary_path
+
+
+def read_process_sample(pid: int) -> Optional[ProcessSample]:
+    taken_at = time.perf_counter()
+
+    try:
+        stat_text = Path(f"/proc/{pid}/stat").read_text()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    fields = stat_text[stat_text.rindex(")") + 2:].split()
+    cpu_seconds = (int(fields[STAT_FIELD_UTIME]) + int(fields[STAT_FIELD_STIME])) / CLOCK_TICKS_PER_SECOND
+    read_bytes, write_bytes = read_process_io(pid)
+
+    try:
+        open_files: Optional[int] = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        open_files = None
+
+    return ProcessSample(
+        taken_at=taken_at,
+        cpu_seconds=cpu_seconds,
+        rss_bytes=int(fields[STAT_FIELD_RSS]) * PAGE_SIZE,
+        threads=int(fields[STAT_FIELD_NUM_THREADS]),
+        read_bytes=read_bytes,
+        write_bytes=write_bytes,
+        open_files=open_files,
+    )
+
+
+def read_process_io(pid: int) -> tuple[Optional[int], Optional[int]]:
+    try:
+        lines = Path(f"/proc/{pid}/io").read_text().splitlines()
+    except OSError:
+        return None, None
+
+    values = dict(line.split(": ", 1) for line in lines if ": " in line)
+    read_bytes = values.get("read_bytes")
+    write_bytes = values.get("write_bytes")
+    return int(read_bytes) if read_bytes else None, int(write_bytes) if write_bytes else None
+
+
+def write_csv(path: Path, fields: list[str], rows: list[dict[str, Any]]):
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,157 @@
+from collections import deque
+from typing import Callable, Optional
+
+from multistage.config import StageConfig
+from multistage.constants import (NODE_MONITORING_MAX_PERIOD,
+                                  NODE_MONITORING_MIN_PERIOD,
+                                  NODE_MONITORING_PERIOD,
+                                  PROGRESS_ETA_FRACTION, PROGRESS_WINDOW_SIZE)
+from multistage.status_poller import NodeStatus
+
+
+class Overshoot:
+    def __init__(self, blocks: int, seconds: float, exact_blocks: bool) -> None:
+        # The boundary was crossed between two polls: "seconds" (and "blocks", if not exact) are upper bounds.
+        self.blocks = blocks
+        self.seconds = seconds
+        self.exact_blocks = exact_blocks
+
+    def __str__(self) -> str:
+        qualifier = "" if self.exact_blocks else "at most "
+        return f"{qualifier}{self.blocks} blocks past the boundary, detected at most {self.seconds:.2f}s after crossing it"
+
+
+# Tracks the progress of a node (nonce, round and epoch rates), in order to estimate the time left until the stage's target,
+# so that polling is sparse while the target is far away, and tight as it approaches.
+class ProgressEstimator:
+    def __init__(self, until_epoch: int, until_nonce: Optional[int] = None, until_round: Optional[int] = None) -> None:
+        self.until_epoch = until_epoch
+        self.until_nonce = until_nonce
+        self.until_round = until_round
+        self.samples: deque[NodeStatus] = deque(maxlen=PROGRESS_WINDOW_SIZE)
+        # First nonce observed in each epoch (thus, an upper bound of the actual first nonce).
+        self.epochs_first_nonces: dict[int, int] = {}
+        self.nonces_per_epoch: Optional[int] = None
+        self.last_before_target: Optional[NodeStatus] = None
+
+    @classmethod
+    def new_for_stage(cls, config: StageConfig):
+        return cls(config.until_epoch, config.until_nonce, config.until_round)
+
+    def add(self, status: NodeStatus):
+        previous = self.samples[-1] if self.samples else None
+
+        if previous is not None and status.epoch > previous.epoch:
+            self.epochs_first_nonces[status.epoch] = status.nonce
+
+            previous_epoch_first_nonce = self.epochs_first_nonces.get(status.epoch - 1)
+            if status.epoch - previous.epoch == 1 and previous_epoch_first_nonce is not None:
+                self.nonces_per_epoch = status.nonce - previous_epoch_first_nonce
+
+        self.samples.append(status)
+
+        if not self.is_target_reached(status):
+            self.last_before_target = status
+
+    def is_target_reached(self, status: NodeStatus) -> bool:
+        if self.until_epoch and status.epoch > self.until_epoch:
+            return True
+        if self.until_nonce is not None and status.nonce >= self.until_nonce:
+            return True
+        if self.until_round is not None and status.current_round >= self.until_round:
+            return True
+        return False
+
+    def get_nonce_rate(self) -> Optional[float]:
+        return self._get_rate(lambda status: status.nonce)
+
+    def get_round_rate(self) -> Optional[float]:
+        return self._get_rate(lambda status: status.current_round)
+
+    def _get_rate(self, get_value: Callable[[NodeStatus], int]) -> Optional[float]:
+        if len(self.samples) < 2:
+            return None
+
+        first, last = self.samples[0], self.samples[-1]
+        elapsed = last.received_at - first.received_at
+        progress = get_value(last) - get_value(first)
+
+        if elapsed <= 0 or progress <= 0:
+            return None
+
+        return progress / elapsed
+
+    def get_epochs_per_hour(self) -> Optional[float]:
+        nonce_rate = self.get_nonce_rate()
+        if nonce_rate is None or not self.nonces_per_epoch:
+            return None
+
+        return nonce_rate * 3600 / self.nonces_per_epoch
+
+    def get_eta(self) -> Optional[float]:
+        if not self.samples:
+            return None
+
+        status = self.samples[-1]
+        nonce_rate = self.get_nonce_rate()
+        round_rate = self.get_round_rate()
+        etas: list[float] = []
+
+        if self.until_nonce is not None and nonce_rate:
+            etas.append((self.until_nonce - status.nonce) / nonce_rate)
+
+        if self.until_round is not None and round_rate:
+            etas.append((self.until_round - status.current_round) / round_rate)
+
+        if self.until_epoch and nonce_rate:
+            boundary_nonce = self.get_epoch_boundary_nonce()
+            if boundary_nonce is not None:
+                etas.append((boundary_nonce - status.nonce) / nonce_rate)
+
+        if not etas:
+            return None
+
+        return max(0, min(etas))
+
+    def get_epoch_boundary_nonce(self) -> Optional[int]:
+        # Estimated first nonce of epoch "until_epoch + 1".
+        status = self.samples[-1]
+        current_epoch_first_nonce = self.epochs_first_nonces.get(status.epoch)
+
+        if self.nonces_per_epoch is None or current_epoch_first_nonce is None:
+            return None
+
+        remaining_epochs = self.until_epoch + 1 - status.epoch
+        return current_epoch_first_nonce + self.nonces_per_epoch * remaining_epochs
+
+    def get_next_poll_delay(self) -> float:
+        eta = self.get_eta()
+        if eta is None:
+            return NODE_MONITORING_PERIOD
+
+        delay = eta * PROGRESS_ETA_FRACTION
+        return min(NODE_MONITORING_MAX_PERIOD, max(NODE_MONITORING_MIN_PERIOD, delay))
+
+    def get_overshoot(self, status: NodeStatus) -> Optional[Overshoot]:
+        # Target reached at the very first poll, nothing to compare against.
+        if self.last_before_target is None:
+            return None
+
+        seconds = status.received_at - self.last_before_target.received_at
+
+        if self.until_nonce is not None and status.nonce >= self.until_nonce:
+            return Overshoot(status.nonce - self.until_nonce, seconds, exact_blocks=True)
+
+        return Overshoot(status.nonce - self.last_before_target.nonce, seconds, exact_blocks=False)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+
+    if hours:
+        return f"{hours}h{minutes:02d}m"
+    if minutes:
+        return f"{minutes}m{seconds:02d}s"
+    return f"{seconds}s"
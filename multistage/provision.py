@@ -0,0 +1,87 @@
+import json
+import sys
+import traceback
+from argparse import ArgumentParser
+from pathlib import Path
+
+from rich import print
+from rich.panel import Panel
+from rich.table import Table
+
+from multistage import errors
+from multistage.config import DriverConfig
+from multistage.constants import (IMPORT_DB_PROVISIONING_DEFAULT_THREADS,
+                                  LANES_WILDCARD, ONE_MB)
+from multistage.driver import resolve_lanes_names
+from multistage.import_db import ImportDbProvisioner
+
+
+def main(cli_args: list[str] = sys.argv[1:]):
+    try:
+        return _do_main(cli_args)
+    except errors.KnownError as err:
+        print(Panel(f"[red]{traceback.format_exc()}"))
+        print(Panel(f"[red]{err.get_pretty()}"))
+        return 1
+
+
+# Fills the "import-db" folder(s) of each lane with a copy of its "importDbSource".
+def _do_main(cli_args: list[str]):
+    parser = ArgumentParser()
+    parser.add_argument("--config", required=True, help="path of the 'driver' configuration file")
+    parser.add_argument("--lane", required=True, action="append", help=f"which lane to provision (can be repeated; '{LANES_WILDCARD}' for all lanes)")
+    parser.add_argument("--threads", type=int, default=IMPORT_DB_PROVISIONING_DEFAULT_THREADS, help="how many files to copy (or hash) in parallel")
+    parser.add_argument("--quick", action="store_true", default=False, help="skip files of same size and modification time, without comparing their content")
+    args = parser.parse_args(cli_args)
+
+    if args.threads < 1:
+        raise errors.UsageError("'--threads' must be at least 1")
+
+    config_path = Path(args.config).expanduser().resolve()
+    config_data = json.loads(config_path.read_text())
+    driver_config = DriverConfig.new_from_dictionary(config_data)
+    lanes_names = resolve_lanes_names(driver_config, args.lane)
+
+    table = Table(title="Provisioning of import-db folders")
+    table.add_column("Lane")
+    table.add_column("Folder")
+    table.add_column("Copied")
+    table.add_column("Skipped (identical)")
+    table.add_column("Removed")
+    table.add_column("Throughput")
+
+    for lane_name in lanes_names:
+        lane_config = driver_config.get_lane(lane_name)
+        import_db_paths = lane_config.get_import_db_paths()
+
+        if not import_db_paths:
+            continue
+
+        if lane_config.import_db_source is None:
+            print(f"[yellow]Lane {lane_name} has no 'importDbSource', skipping it.")
+            continue
+
+        provisioner = ImportDbProvisioner(args.threads, args.quick)
+
+        for import_db_path in import_db_paths:
+            print(f"[bold yellow]Lane {lane_name}: provisioning {import_db_path} from {lane_config.import_db_source} ...")
+            result = provisioner.provision(lane_config.import_db_source, import_db_path)
+            copied = result.copied
+            reflinked = f" ({result.num_reflinked_files} cloned)" if result.num_reflinked_files else ""
+
+            table.add_row(
+                lane_name,
+                str(import_db_path),
+                f"{copied.num_files} files, {copied.num_bytes / ONE_MB:.1f} MB{reflinked}",
+                f"{result.num_skipped_files} files, {result.num_skipped_bytes / ONE_MB:.1f} MB",
+                str(result.num_removed_files),
+                f"{copied.get_throughput():.1f} MB/s in {copied.duration:.2f}s",
+            )
+
+    print(table)
+    return 0
+
+
+if __name__ == "__main__":
+    ret = main(sys.argv[1:])
+    sys.exit(ret)
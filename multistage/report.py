@@ -0,0 +1,133 @@
+import statistics
+import sys
+import time
+import traceback
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any, Optional
+
+from rich import print
+from rich.panel import Panel
+from rich.table import Table
+
+from multistage import errors
+from multistage.constants import ONE_MB, RUN_HISTORY_DEFAULT_PATH
+from multistage.progress import format_duration
+from multistage.run_history import create_run_history
+
+
+def main(cli_args: list[str] = sys.argv[1:]):
+    try:
+        return _do_main(cli_args)
+    except errors.KnownError as err:
+        print(Panel(f"[red]{traceback.format_exc()}"))
+        print(Panel(f"[red]{err.get_pretty()}"))
+        return 1
+
+
+# Compares the throughput of stage runs (recorded by the driver) across node binaries and hosts.
+def _do_main(cli_args: list[str]):
+    parser = ArgumentParser()
+    parser.add_argument("--history", default=RUN_HISTORY_DEFAULT_PATH, help="path of the database of stage runs (recorded by the driver)")
+    parser.add_argument("--lane", action="append", help="only runs of the given lane (can be repeated)")
+    parser.add_argument("--stage", action="append", help="only runs of the given stage (can be repeated)")
+    parser.add_argument("--days", type=float, help="only runs started in the last given days")
+    args = parser.parse_args(cli_args)
+
+    history_path = Path(args.history).expanduser().resolve()
+    if not history_path.exists():
+        raise errors.UsageError(f"no history of runs at {history_path}")
+
+    history = create_run_history(str(history_path))
+    since = time.time() - args.days * 24 * 3600 if args.days is not None else None
+    runs = history.get_runs(args.lane, args.stage, since)
+
+    if not runs:
+        print("[yellow]No (finished) runs found.")
+        return 0
+
+    # Runs of a stage (on a lane) are grouped by node binary and host.
+    groups: dict[tuple[str, str, str, str], list[dict[str, Any]]] = {}
+    for run in runs:
+        key = (run["lane"], run["stage"], run["binary_checksum"] or "", run["host"])
+        groups.setdefault(key, []).append(run)
+
+    best_rates: dict[tuple[str, str], float] = {}
+    for (lane, stage, _, _), group_runs in groups.items():
+        rate = get_median_rate(group_runs)
+        if rate is not None:
+            best_rates[(lane, stage)] = max(best_rates.get((lane, stage), 0), rate)
+
+    table = Table(title=f"Stage runs ({history_path})")
+    table.add_column("Lane")
+    table.add_column("Stage")
+    table.add_column("Node binary")
+    table.add_column("Host")
+    table.add_column("Runs (completed)")
+    table.add_column("Epochs")
+    table.add_column("Blocks/s (median)")
+    table.add_column("Vs. best")
+    table.add_column("Duration (median)")
+    table.add_column("CPU (s) / 1k blocks")
+    table.add_column("Peak RSS (MB)")
+    table.add_column("Last run")
+
+    for (lane, stage, binary_checksum, host), group_runs in sorted(groups.items()):
+        rate = get_median_rate(group_runs)
+        best_rate = best_rates.get((lane, stage))
+        durations = [run["duration"] for run in group_runs if run["completed"] and not run["partial"] and run["duration"] is not None]
+        first_epochs = [run["first_epoch"] for run in group_runs if run["first_epoch"] is not None]
+        last_epochs = [run["last_epoch"] for run in group_runs if run["last_epoch"] is not None]
+        binary_path = Path(group_runs[-1]["binary_path"])
+        cpu_costs = [get_cpu_cost(run) for run in group_runs]
+        cpu_costs_known = [cost for cost in cpu_costs if cost is not None]
+        peaks_rss = [run["peak_rss_bytes"] for run in group_runs if run["peak_rss_bytes"]]
+
+        table.add_row(
+            lane,
+            stage,
+            f"{binary_path.name} ({binary_checksum[:12] or 'unknown'})",
+            host,
+            f"{len(group_runs)} ({sum(1 for run in group_runs if run['completed'])})",
+            f"{min(first_epochs)} - {max(last_epochs)}" if first_epochs and last_epochs else "-",
+            f"{rate:.1f}" if rate is not None else "-",
+            format_relative_rate(rate, best_rate),
+            format_duration(statistics.median(durations)) if durations else "-",
+            f"{statistics.median(cpu_costs_known):.1f}" if cpu_costs_known else "-",
+            f"{max(peaks_rss) / ONE_MB:.0f}" if peaks_rss else "-",
+            time.strftime("%Y-%m-%d %H:%M", time.localtime(group_runs[-1]["started_at"])),
+        )
+
+    print(table)
+    return 0
+
+
+def get_median_rate(runs: list[dict[str, Any]]) -> Optional[float]:
+    rates = [run["blocks_per_second"] for run in runs if run["blocks_per_second"]]
+    return statistics.median(rates) if rates else None
+
+
+# CPU time per 1000 blocks (comparable across runs covering different ranges).
+def get_cpu_cost(run: dict[str, Any]) -> Optional[float]:
+    if run["cpu_seconds"] is None or run["first_nonce"] is None or run["last_nonce"] is None:
+        return None
+
+    num_blocks = run["last_nonce"] - run["first_nonce"]
+    if num_blocks <= 0:
+        return None
+
+    return run["cpu_seconds"] / num_blocks * 1000
+
+
+def format_relative_rate(rate: Optional[float], best_rate: Optional[float]) -> str:
+    if rate is None or not best_rate:
+        return "-"
+    if rate >= best_rate:
+        return "[green]best"
+
+    return f"[yellow]{(rate / best_rate - 1) * 100:.0f}%"
+
+
+if __name__ == "__main__":
+    ret = main(sys.argv[1:])
+    sys.exit(ret)
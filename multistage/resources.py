@@ -0,0 +1,186 @@
+import asyncio
+import fcntl
+import os
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Optional, TextIO
+
+from rich import print
+
+from multistage.config import ResourcesConfig
+from multistage.constants import (ADMISSION_DEFAULT_FOLDER,
+                                  ADMISSION_DEFAULT_MAX_HEAVY_STAGES,
+                                  ADMISSION_RETRY_PERIOD)
+
+LAUNCHER_PATH = Path(__file__).parent / "launcher.py"
+CGROUP_CONTROLLERS = ["memory", "io"]
+
+
+# Rlimits are inherited: nodes get the (raised) limit of the driver, unless their stage sets another one.
+def raise_open_files_limit(limit: int):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = min(limit, hard)
+
+    if soft < target:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+
+    if target < limit:
+        print(f"[yellow]The limit of open files is {target} (less than the recommended {limit}).")
+
+
+def get_launcher_command(resources: ResourcesConfig) -> list[str]:
+    if not resources.requires_launcher():
+        return []
+
+    command = [sys.executable, str(LAUNCHER_PATH)]
+
+    if resources.max_open_files is not None:
+        command.append(f"--max-open-files={resources.max_open_files}")
+    if resources.nice is not None:
+        command.append(f"--nice={resources.nice}")
+    if resources.ionice_class is not None:
+        command.append(f"--ionice-class={resources.ionice_class}")
+    if resources.ionice_level is not None:
+        command.append(f"--ionice-level={resources.ionice_level}")
+    if resources.cpu_affinity is not None:
+        command.append(f"--cpu-affinity={','.join(map(str, resources.cpu_affinity))}")
+
+    command.append("--")
+    return command
+
+
+# Moves the node into its own cgroup (v2), with the configured memory & I/O limits.
+# Best effort: skipped (with a warning) if cgroups v2 are not available, or not delegated to the current user.
+def apply_cgroup_limits(resources: ResourcesConfig, name: str, pid: int) -> bool:
+    parent = resources.cgroup_parent
+    cgroup = parent / name
+
+    try:
+        if not (parent.parent / "cgroup.controllers").exists():
+            raise OSError(f"cgroups v2 not available in {parent.parent}")
+
+        parent.mkdir(exist_ok=True)
+        enable_controllers(parent)
+        cgroup.mkdir(exist_ok=True)
+
+        if resources.memory_max is not None:
+            (cgroup / "memory.max").write_text(str(resources.memory_max))
+        if resources.io_weight is not None:
+            (cgroup / "io.weight").write_text(f"default {resources.io_weight}")
+
+        (cgroup / "cgroup.procs").write_text(str(pid))
+    except OSError as error:
+        print(f"[yellow]Cannot apply cgroup limits in {cgroup}:[/yellow] {error}")
+        return False
+
+    return True
+
+
+def enable_controllers(parent: Path):
+    available = (parent / "cgroup.controllers").read_text().split()
+    missing = [controller for controller in CGROUP_CONTROLLERS if controller not in available]
+
+    if missing:
+        # Must be enabled in the "subtree_control" of the ancestors.
+        raise OSError(f"cgroup controllers not available in {parent}: {', '.join(missing)}")
+
+    enabled = (parent / "cgroup.subtree_control").read_text().split()
+
+    for controller in CGROUP_CONTROLLERS:
+        if controller not in enabled:
+            (parent / "cgroup.subtree_control").write_text(f"+{controller}")
+
+
+class AdmissionSlot:
+    def __init__(self, lock_file: TextIO) -> None:
+        self.lock_file = lock_file
+
+    def release(self):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+
+# Limits how many heavy stages (e.g. import-db) run at the same time on the host, across lanes and driver processes,
+# and spaces their starts, so that they do not all compete for disk I/O and memory at once.
+# Slots are files: holding a slot is holding a lock on one of them (released by the OS, should the driver die).
+class AdmissionScheduler:
+    def __init__(self, folder: Path, max_heavy_stages: int, stagger: float) -> None:
+        self.folder = folder
+        self.max_heavy_stages = max_heavy_stages
+        self.stagger = stagger
+
+        folder.mkdir(parents=True, exist_ok=True)
+
+    def is_enabled(self) -> bool:
+        return self.max_heavy_stages > 0 or self.stagger > 0
+
+    async def acquire(self, label: str) -> Optional[AdmissionSlot]:
+        if not self.is_enabled():
+            return None
+
+        slot: Optional[AdmissionSlot] = None
+        is_waiting = False
+
+        if self.max_heavy_stages > 0:
+            while (slot := self._try_acquire()) is None:
+                if not is_waiting:
+                    print(f"{label}: waiting for one of the {self.max_heavy_stages} slot(s) for heavy stages ...")
+                    is_waiting = True
+
+                await asyncio.sleep(ADMISSION_RETRY_PERIOD)
+
+        # Blocking (waits for the lock held by other driver processes, then syncs).
+        delay = await asyncio.to_thread(self._reserve_start_time)
+        if delay > 0:
+            print(f"{label}: heavy stage will start in {delay:.0f}s (staggered starts).")
+            await asyncio.sleep(delay)
+
+        return slot
+
+    def _try_acquire(self) -> Optional[AdmissionSlot]:
+        for index in range(self.max_heavy_stages):
+            lock_file = open(self.folder / f"slot-{index}.lock", "a")
+
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return AdmissionSlot(lock_file)
+            except BlockingIOError:
+                lock_file.close()
+
+        return None
+
+    def _reserve_start_time(self) -> float:
+        if self.stagger <= 0:
+            return 0
+
+        # The time of the last (reserved) start is shared by all driver processes.
+        with open(self.folder / "last-start", "a+") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+
+            try:
+                last_start = float(file.read() or 0)
+            except ValueError:
+                last_start = 0
+
+            now = time.time()
+            start = max(now, last_start + self.stagger)
+
+            file.seek(0)
+            file.truncate()
+            file.write(str(start))
+            file.flush()
+            os.fsync(file.fileno())
+
+        return start - now
+
+
+def create_default_admission_scheduler() -> AdmissionScheduler:
+    return create_admission_scheduler(ADMISSION_DEFAULT_FOLDER, ADMISSION_DEFAULT_MAX_HEAVY_STAGES, 0)
+
+
+def create_admission_scheduler(folder: str, max_heavy_stages: int, stagger: float) -> AdmissionScheduler:
+    folder_path = Path(folder).expanduser().resolve()
+    return AdmissionScheduler(folder_path, max_heavy_stages, stagger)
@@ -0,0 +1,209 @@
+import asyncio
+import inspect
+import json
+import os
+import socket
+import stat
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+from multistage import errors
+from multistage.constants import (RPC_CALL_TIMEOUT, RPC_CONNECT_TIMEOUT,
+                                  RPC_STREAM_LIMIT)
+
+JSONRPC_VERSION = "2.0"
+ERROR_PARSE = -32700
+ERROR_INVALID_REQUEST = -32600
+ERROR_METHOD_NOT_FOUND = -32601
+ERROR_INVALID_PARAMS = -32602
+ERROR_INTERNAL = -32603
+# Known errors (e.g. unknown lane, lane already running), raised by the handlers.
+ERROR_APPLICATION = -32000
+UNIX_ADDRESS_PREFIX = "unix:"
+
+RpcHandler = Callable[..., Awaitable[Any]]
+
+
+# JSON-RPC 2.0, one message per line, over a Unix socket ("unix:<path>") or TCP ("<host>:<port>").
+# Requests of a connection are handled in order: handlers should return quickly (e.g. start a task, instead of awaiting it).
+class RpcServer:
+    def __init__(self, handlers: dict[str, RpcHandler]) -> None:
+        self.handlers = handlers
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, address: str):
+        path, host, port = parse_rpc_address(address)
+
+        try:
+            if path is not None:
+                remove_stale_socket(path)
+                self.server = await asyncio.start_unix_server(self.serve_connection, path, limit=RPC_STREAM_LIMIT)
+                # No authentication: only the owner may connect.
+                os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+            else:
+                self.server = await asyncio.start_server(self.serve_connection, host, port, limit=RPC_STREAM_LIMIT)
+        except OSError as error:
+            raise errors.KnownError(f"cannot listen on {address}", error)
+
+    async def serve_forever(self):
+        assert self.server is not None
+        await self.server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                response = await self.handle_message(line)
+                if response is None:
+                    continue
+
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            # Client gone, or message too large: the connection is dropped.
+            pass
+        finally:
+            writer.close()
+
+    # Returns None for notifications (requests without "id").
+    async def handle_message(self, line: bytes) -> Optional[dict[str, Any]]:
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            return create_error_response(None, ERROR_PARSE, f"parse error: {error}")
+
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return create_error_response(None, ERROR_INVALID_REQUEST, "invalid request")
+
+        request_id = request.get("id")
+        is_notification = "id" not in request
+        handler = self.handlers.get(request["method"])
+        params = request.get("params") or {}
+
+        if handler is None:
+            response = create_error_response(request_id, ERROR_METHOD_NOT_FOUND, f"method not found: {request['method']}")
+        elif not isinstance(params, dict):
+            response = create_error_response(request_id, ERROR_INVALID_PARAMS, "params must be an object")
+        else:
+            response = await self.call_handler(request_id, handler, params)
+
+        return None if is_notification else response
+
+    async def call_handler(self, request_id: Any, handler: RpcHandler, params: dict[str, Any]) -> dict[str, Any]:
+        try:
+            inspect.signature(handler).bind(**params)
+        except TypeError as error:
+            return create_error_response(request_id, ERROR_INVALID_PARAMS, f"invalid params: {error}")
+
+        try:
+            result = await handler(**params)
+        except errors.KnownError as error:
+            return create_error_response(request_id, ERROR_APPLICATION, str(error))
+        except Exception as error:
+            return create_error_response(request_id, ERROR_INTERNAL, f"internal error: {error!r}")
+
+        return {"jsonrpc": JSONRPC_VERSION, "id": request_id, "result": result}
+
+
+# One connection (opened on demand, re-opened after a failure), one request at a time.
+class RpcClient:
+    def __init__(self, address: str, timeout: float = RPC_CALL_TIMEOUT) -> None:
+        self.address = address
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.lock = asyncio.Lock()
+        self.next_id = 1
+
+    # Connection failures raise a "TransientError" (the call can be retried), errors of the server a "KnownError".
+    async def call(self, method: str, **params: Any) -> Any:
+        async with self.lock:
+            request_id = self.next_id
+            self.next_id += 1
+            request = {"jsonrpc": JSONRPC_VERSION, "id": request_id, "method": method, "params": params}
+
+            try:
+                reader, writer = await self._connect()
+                writer.write(json.dumps(request).encode() + b"\n")
+                await writer.drain()
+                line = await asyncio.wait_for(reader.readline(), timeout=self.timeout)
+                if not line:
+                    raise ConnectionError("connection closed by the server")
+
+                response = json.loads(line)
+            except (OSError, TimeoutError, ValueError, asyncio.LimitOverrunError) as error:
+                self.close()
+                raise errors.TransientError(f"cannot call {method} on {self.address}", error)
+
+        if response.get("id") != request_id:
+            self.close()
+            raise errors.TransientError(f"unexpected response from {self.address} (id = {response.get('id')}, expected {request_id})")
+
+        error = response.get("error")
+        if error is not None:
+            raise errors.KnownError(f"{method} failed on {self.address}: {error.get('message')}")
+
+        return response.get("result")
+
+    async def _connect(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        if self.reader is not None and self.writer is not None:
+            return self.reader, self.writer
+
+        path, host, port = parse_rpc_address(self.address)
+
+        if path is not None:
+            connection = asyncio.open_unix_connection(path, limit=RPC_STREAM_LIMIT)
+        else:
+            connection = asyncio.open_connection(host, port, limit=RPC_STREAM_LIMIT)
+
+        self.reader, self.writer = await asyncio.wait_for(connection, timeout=RPC_CONNECT_TIMEOUT)
+        return self.reader, self.writer
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+        self.reader = None
+        self.writer = None
+
+
+def create_error_response(request_id: Any, code: int, message: str) -> dict[str, Any]:
+    return {"jsonrpc": JSONRPC_VERSION, "id": request_id, "error": {"code": code, "message": message}}
+
+
+# Returns (path, None, None) for a Unix socket, (None, host, port) for TCP.
+def parse_rpc_address(address: str) -> tuple[Optional[str], Optional[str], Optional[int]]:
+    if address.startswith(UNIX_ADDRESS_PREFIX):
+        path = address[len(UNIX_ADDRESS_PREFIX):]
+        if not path:
+            raise errors.UsageError(f"bad address (expected 'unix:<path>'): {address}")
+
+        return str(Path(path).expanduser().resolve()), None, None
+
+    host, _, port = address.rpartition(":")
+
+    if not port.isdigit():
+        raise errors.UsageError(f"bad address (expected 'unix:<path>' or '<host>:<port>'): {address}")
+
+    return None, host or "localhost", int(port)
+
+
+# A socket file left by a previous (dead) agent is removed; one still in use is not.
+def remove_stale_socket(path: str):
+    if not os.path.exists(path):
+        return
+
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise errors.UsageError(f"not a socket: {path}")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+
+    raise errors.UsageError(f"socket already in use (another agent?): {path}")
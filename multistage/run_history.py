@@ -0,0 +1,281 @@
+import json
+import socket
+import sqlite3
+import statistics
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from multistage.archive_cache import compute_file_checksum
+from multistage.config import StageConfig
+from multistage.constants import (RUN_HISTORY_BUSY_TIMEOUT,
+                                  RUN_HISTORY_DEFAULT_PATH,
+                                  RUN_HISTORY_FORECAST_RUNS,
+                                  RUN_HISTORY_SAMPLE_PERIOD,
+                                  RUN_HISTORY_SLOW_FACTOR)
+from multistage.profiler import EpochProfile
+from multistage.status_poller import NodeStatus
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    lane TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    host TEXT NOT NULL,
+    binary_path TEXT NOT NULL,
+    binary_checksum TEXT,
+    node_arguments TEXT NOT NULL,
+    partial INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    ended_at REAL,
+    duration REAL,
+    return_code INTEGER,
+    completed INTEGER,
+    first_epoch INTEGER,
+    last_epoch INTEGER,
+    first_nonce INTEGER,
+    last_nonce INTEGER,
+    blocks_per_second REAL
+);
+CREATE INDEX IF NOT EXISTS runs_by_stage ON runs (lane, stage, started_at);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    elapsed REAL NOT NULL,
+    epoch INTEGER NOT NULL,
+    nonce INTEGER NOT NULL,
+    blocks_per_second REAL
+);
+CREATE INDEX IF NOT EXISTS samples_by_run ON samples (run_id);
+"""
+
+# Changes of the schema, by version (see "PRAGMA user_version"), applied in order to existing databases.
+MIGRATIONS = [
+    (1, [
+        # Resource usage of the node (see "profiler").
+        "ALTER TABLE runs ADD COLUMN cpu_seconds REAL",
+        "ALTER TABLE runs ADD COLUMN read_bytes INTEGER",
+        "ALTER TABLE runs ADD COLUMN written_bytes INTEGER",
+        "ALTER TABLE runs ADD COLUMN peak_rss_bytes INTEGER",
+    ]),
+]
+
+
+# Expected duration (and throughput) of a stage, according to its previous runs.
+class StageForecast:
+    def __init__(self, num_runs: int, duration: Optional[float], blocks_per_second: Optional[float], same_binary: bool) -> None:
+        self.num_runs = num_runs
+        # Median of the durations of the complete runs (None if there are none).
+        self.duration = duration
+        self.blocks_per_second = blocks_per_second
+        # Whether the forecast is based on runs of the same node binary (otherwise, on runs of any binary).
+        self.same_binary = same_binary
+
+
+# Local (SQLite) database of the stage runs of all lanes, shared by all driver processes on the host.
+# Each run records its lane, stage, node binary (path and hash), node arguments, epochs and blocks covered, wall time,
+# and periodic samples of the throughput (blocks per second).
+#
+# Connections are short-lived (one per operation), thus the history can be used from any thread.
+class RunHistory:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.host = socket.gethostname()
+        # Checksums of node binaries, by (path, inode, size, modification time): lanes sharing a binary hash it once.
+        self.checksums: dict[tuple[str, int, int, int], str] = {}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._migrate(connection)
+
+    def _migrate(self, connection: sqlite3.Connection):
+        # Serialized with other processes (which may be migrating the same database).
+        connection.execute("BEGIN IMMEDIATE")
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+
+        for target_version, statements in MIGRATIONS:
+            if version >= target_version:
+                continue
+
+            for statement in statements:
+                connection.execute(statement)
+
+            connection.execute(f"PRAGMA user_version = {target_version}")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=RUN_HISTORY_BUSY_TIMEOUT)
+        connection.row_factory = sqlite3.Row
+
+        try:
+            with connection:
+                connection.execute("PRAGMA foreign_keys=ON")
+                yield connection
+        finally:
+            connection.close()
+
+    def get_binary_checksum(self, binary: Path) -> Optional[str]:
+        try:
+            stat = binary.stat()
+        except FileNotFoundError:
+            return None
+
+        key = (str(binary), stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        checksum = self.checksums.get(key) or compute_file_checksum(binary)
+        self.checksums[key] = checksum
+        return checksum
+
+    # Returns the identifier of the run. "partial" runs (e.g. resumed in the middle of the stage) are not used for forecasts.
+    def start_run(self, lane: str, stage: str, binary: Path, node_arguments: list[str], partial: bool) -> int:
+        binary_checksum = self.get_binary_checksum(binary)
+
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (lane, stage, host, binary_path, binary_checksum, node_arguments, partial, started_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (lane, stage, self.host, str(binary.parent), binary_checksum, json.dumps(node_arguments), partial, time.time()),
+            )
+
+            assert cursor.lastrowid is not None
+            return cursor.lastrowid
+
+    def add_sample(self, run_id: int, elapsed: float, epoch: int, nonce: int, blocks_per_second: Optional[float]):
+        with self._connect() as connection:
+            connection.execute("INSERT INTO samples (run_id, elapsed, epoch, nonce, blocks_per_second) VALUES (?, ?, ?, ?, ?)", (run_id, elapsed, epoch, nonce, blocks_per_second))
+
+    # "completed": the stage reached its target (or was stopped on purpose), thus the lane advanced.
+    def complete_run(self,
+                     run_id: int,
+                     duration: Optional[float],
+                     return_code: int,
+                     completed: bool,
+                     epochs: Optional[tuple[int, int]],
+                     nonces: Optional[tuple[int, int]],
+                     blocks_per_second: Optional[float],
+                     profile: Optional[EpochProfile] = None):
+        first_epoch, last_epoch = epochs or (None, None)
+        first_nonce, last_nonce = nonces or (None, None)
+        usage = (profile.cpu_seconds, profile.read_bytes, profile.written_bytes, profile.peak_rss_bytes) if profile else (None, None, None, None)
+
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE runs SET ended_at = ?, duration = ?, return_code = ?, completed = ?, first_epoch = ?, last_epoch = ?, first_nonce = ?, last_nonce = ?, blocks_per_second = ?, "
+                "cpu_seconds = ?, read_bytes = ?, written_bytes = ?, peak_rss_bytes = ? WHERE id = ?",
+                (time.time(), duration, return_code, completed, first_epoch, last_epoch, first_nonce, last_nonce, blocks_per_second, *usage, run_id),
+            )
+
+    # Based on the most recent complete runs of the stage (on the lane), preferably with the same node binary.
+    def get_forecast(self, lane: str, stage: str, binary_checksum: Optional[str]) -> StageForecast:
+        query = "SELECT duration, blocks_per_second, binary_checksum FROM runs WHERE lane = ? AND stage = ? AND completed AND NOT partial AND duration IS NOT NULL ORDER BY started_at DESC"
+
+        with self._connect() as connection:
+            rows = connection.execute(query, (lane, stage)).fetchall()
+
+        same_binary_rows = [row for row in rows if binary_checksum and row["binary_checksum"] == binary_checksum]
+        same_binary = bool(same_binary_rows)
+        rows = (same_binary_rows or rows)[:RUN_HISTORY_FORECAST_RUNS]
+
+        if not rows:
+            return StageForecast(0, None, None, False)
+
+        durations = [row["duration"] for row in rows]
+        rates = [row["blocks_per_second"] for row in rows if row["blocks_per_second"]]
+
+        return StageForecast(
+            num_runs=len(rows),
+            duration=statistics.median(durations),
+            blocks_per_second=statistics.median(rates) if rates else None,
+            same_binary=same_binary,
+        )
+
+    def get_runs(self, lanes: Optional[list[str]] = None, stages: Optional[list[str]] = None, since: Optional[float] = None) -> list[dict[str, Any]]:
+        conditions = ["ended_at IS NOT NULL"]
+        parameters: list[Any] = []
+
+        if lanes:
+            conditions.append(f"lane IN ({', '.join('?' for _ in lanes)})")
+            parameters.extend(lanes)
+        if stages:
+            conditions.append(f"stage IN ({', '.join('?' for _ in stages)})")
+            parameters.extend(stages)
+        if since is not None:
+            conditions.append("started_at >= ?")
+            parameters.append(since)
+
+        with self._connect() as connection:
+            rows = connection.execute(f"SELECT * FROM runs WHERE {' AND '.join(conditions)} ORDER BY started_at", parameters).fetchall()
+
+        return [dict(row) for row in rows]
+
+
+# Records one run of a stage (on a lane): its start, periodic samples of its progress, and its outcome.
+# Database operations are blocking (thus, should be called in a thread), the others are not.
+class RunRecorder:
+    def __init__(self, history: RunHistory, lane_name: str, stage: StageConfig, partial: bool) -> None:
+        self.history = history
+        self.lane_name = lane_name
+        self.stage = stage
+        self.partial = partial
+        self.run_id: Optional[int] = None
+        self.forecast = StageForecast(0, None, None, False)
+        self.first_status: Optional[NodeStatus] = None
+        self.last_status: Optional[NodeStatus] = None
+        self.last_sample_at = 0.0
+        self.is_flagged_slow = False
+
+    def start(self):
+        binary = self.stage.bin / "node"
+        self.forecast = self.history.get_forecast(self.lane_name, self.stage.name, self.history.get_binary_checksum(binary))
+        self.run_id = self.history.start_run(self.lane_name, self.stage.name, binary, self.stage.node_arguments, self.partial)
+
+    # Returns whether a sample is due.
+    def observe(self, status: NodeStatus) -> bool:
+        if self.first_status is None:
+            self.first_status = status
+
+        self.last_status = status
+
+        if self.run_id is None or status.received_at - self.last_sample_at < RUN_HISTORY_SAMPLE_PERIOD:
+            return False
+
+        self.last_sample_at = status.received_at
+        return True
+
+    def add_sample(self, status: NodeStatus, elapsed: float, blocks_per_second: Optional[float]):
+        assert self.run_id is not None
+        self.history.add_sample(self.run_id, elapsed, status.epoch, status.nonce, blocks_per_second)
+
+    def complete(self, duration: Optional[float], return_code: int, completed: bool, profile: Optional[EpochProfile] = None):
+        if self.run_id is None:
+            return
+
+        first, last = self.first_status, self.last_status
+        epochs = (first.epoch, last.epoch) if first and last else None
+        nonces = (first.nonce, last.nonce) if first and last else None
+        self.history.complete_run(self.run_id, duration, return_code, completed, epochs, nonces, self.get_blocks_per_second(), profile)
+
+    # Average over the whole run.
+    def get_blocks_per_second(self) -> Optional[float]:
+        first, last = self.first_status, self.last_status
+        if first is None or last is None or last.received_at <= first.received_at:
+            return None
+
+        return (last.nonce - first.nonce) / (last.received_at - first.received_at)
+
+    def is_much_slower(self, blocks_per_second: Optional[float]) -> bool:
+        expected = self.forecast.blocks_per_second
+        return bool(expected and blocks_per_second is not None and blocks_per_second * RUN_HISTORY_SLOW_FACTOR < expected)
+
+    def is_much_longer(self, duration: Optional[float]) -> bool:
+        expected = self.forecast.duration
+        return bool(expected and duration is not None and not self.partial and duration > expected * RUN_HISTORY_SLOW_FACTOR)
+
+
+def create_default_run_history() -> RunHistory:
+    return create_run_history(RUN_HISTORY_DEFAULT_PATH)
+
+
+def create_run_history(path: str) -> RunHistory:
+    return RunHistory(Path(path).expanduser().resolve())
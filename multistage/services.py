@@ -0,0 +1,40 @@
+import asyncio
+from typing import Optional
+
+from multistage import errors
+from multistage.archive_cache import ArchiveCache, create_default_archive_cache
+from multistage.artifact_store import (ArtifactStore,
+                                       create_default_artifact_store)
+from multistage.constants import DEFAULT_MAX_PARALLEL_TRANSITIONS
+from multistage.events import EventsWriter
+from multistage.metrics import MetricsRegistry
+from multistage.resources import (AdmissionScheduler,
+                                  create_default_admission_scheduler)
+from multistage.run_history import RunHistory
+from multistage.status_poller import StatusPoller
+
+
+# Resources shared by all the lanes handled by one driver process.
+class SharedServices:
+    def __init__(self,
+                 max_parallel_transitions: int = DEFAULT_MAX_PARALLEL_TRANSITIONS,
+                 archives_cache: Optional[ArchiveCache] = None,
+                 admission: Optional[AdmissionScheduler] = None,
+                 artifact_store: Optional[ArtifactStore] = None,
+                 history: Optional[RunHistory] = None) -> None:
+        if max_parallel_transitions < 1:
+            raise errors.UsageError("the number of parallel transitions must be at least 1")
+
+        self.transitions = asyncio.Semaphore(max_parallel_transitions)
+        self.status_poller = StatusPoller()
+        self.archives_cache = archives_cache or create_default_archive_cache()
+        self.admission = admission or create_default_admission_scheduler()
+        self.artifact_store = artifact_store or create_default_artifact_store()
+        # None if stage runs are not recorded (e.g. benchmarks).
+        self.history = history
+        self.metrics = MetricsRegistry()
+        self.events = EventsWriter()
+
+    def close(self):
+        self.status_poller.close()
+        self.events.close()
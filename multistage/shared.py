@@ -1,35 +1,130 @@
+import os
 import shutil
 import tempfile
-import urllib.request
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator, Optional
 from urllib.parse import urlparse
 
 from rich import print
 
 from multistage import errors
+from multistage.archive_cache import ArchiveCache, normalize_checksum
 from multistage.constants import TEMPORARY_DIRECTORIES_PREFIX
+from multistage.downloader import Downloader
+from multistage.extraction import (extract_archive, extract_tar,
+                                   is_streamable_format)
 
 
-def fetch_archive(archive_url: str, destination_path: Path):
-    archive_url_parsed = urlparse(archive_url)
-    file_name = Path(archive_url_parsed.path).name
+# Returns the checksum of the archive.
+# With "stream", tar archives are extracted while being downloaded (bypassing the cache): they are never written to disk.
+def fetch_archive(archive_url: str,
+                  destination_path: Path,
+                  cache: Optional[ArchiveCache] = None,
+                  checksum: Optional[str] = None,
+                  stream: bool = False) -> str:
+    if stream and is_streamable_format(guess_archive_format(archive_url)):
+        return stream_archive(archive_url, destination_path, checksum)
+
+    if cache:
+        with cache.acquire(archive_url, checksum) as download_path:
+            unpack_archive(archive_url, download_path, destination_path)
+            # Blobs are named by their checksum.
+            return download_path.name
+
+    file_name = get_archive_file_name(archive_url)
 
     with tempfile.TemporaryDirectory(prefix=TEMPORARY_DIRECTORIES_PREFIX) as tmpdirname:
         download_path = Path(tmpdirname) / file_name
-        extraction_path = Path(tmpdirname) / "extracted"
+        downloader = Downloader()
+
+        try:
+            result = downloader.download(archive_url, download_path, normalize_checksum(checksum))
+        finally:
+            downloader.close()
+
+        unpack_archive(archive_url, download_path, destination_path)
+        return result.checksum
+
+
+def stream_archive(archive_url: str, destination_path: Path, checksum: Optional[str] = None) -> str:
+    downloader = Downloader()
+
+    try:
+        with downloader.open_stream(archive_url) as download_stream, stage_extraction(archive_url, destination_path) as extraction_path:
+            print(f"Unpacking archive {archive_url} (while downloading it) to {extraction_path} ...")
+            statistics = extract_tar(download_stream, extraction_path)
+            # A corrupted archive is discarded (the destination is left untouched).
+            result = download_stream.finish(normalize_checksum(checksum))
+    finally:
+        downloader.close()
+
+    print(f"Unpacked {archive_url}: {statistics}.")
+    return result.checksum
+
+
+def unpack_archive(archive_url: str, archive_path: Path, destination_path: Path):
+    archive_format = guess_archive_format(archive_url)
+
+    with stage_extraction(archive_url, destination_path) as extraction_path:
+        print(f"Unpacking archive {archive_path} to {extraction_path} ...")
+        statistics = extract_archive(archive_path, archive_format, extraction_path)
+
+    print(f"Unpacked {archive_url}: {statistics}.")
+
 
-        print(f"Downloading archive {archive_url} to {download_path} ...")
-        urllib.request.urlretrieve(archive_url, download_path)
+# Archives are extracted in a staging folder next to the destination (thus, on the same filesystem): the (single) top-level item
+# is then moved into place by a rename, instead of being copied again. On errors, the destination is left untouched.
+@contextmanager
+def stage_extraction(archive_url: str, destination_path: Path) -> Iterator[Path]:
+    destination_path.parent.mkdir(parents=True, exist_ok=True)
+    staging_path = Path(tempfile.mkdtemp(prefix=f".{destination_path.name}.extracting-", dir=destination_path.parent))
 
-        print(f"Unpacking archive {download_path} to {extraction_path} ...")
-        shutil.unpack_archive(download_path, extraction_path)
+    try:
+        yield staging_path
 
-        items = list(extraction_path.glob("*"))
+        items = list(staging_path.glob("*"))
         if len(items) != 1:
             raise errors.KnownError(f"archive {archive_url} should have contained only one top-level item")
 
-        top_level_item = items[0]
+        print(f"Moving {items[0]} to {destination_path} ...")
+        replace_path(items[0], destination_path)
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+
+def replace_path(source: Path, destination: Path):
+    previous_path = destination.with_name(f".{destination.name}.previous-{os.getpid()}")
+    has_previous = destination.exists() or destination.is_symlink()
+
+    if has_previous:
+        remove_path(previous_path)
+        destination.rename(previous_path)
+
+    source.rename(destination)
+
+    if has_previous:
+        remove_path(previous_path)
+
+
+def remove_path(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def get_archive_file_name(archive_url: str) -> str:
+    archive_url_parsed = urlparse(archive_url)
+    return Path(archive_url_parsed.path).name
+
+
+def guess_archive_format(archive_url: str) -> Optional[str]:
+    # Cached archives are stored without an extension, thus the format is deduced from the URL.
+    file_name = get_archive_file_name(archive_url)
+
+    for archive_format, extensions, _ in shutil.get_unpack_formats():
+        if any(file_name.endswith(extension) for extension in extensions):
+            return archive_format
 
-        print(f"Moving {top_level_item} to {destination_path} ...")
-        shutil.rmtree(destination_path, ignore_errors=True)
-        shutil.move(top_level_item, destination_path)
+    return None
@@ -0,0 +1,231 @@
+import json
+import os
+import shutil
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+
+from rich import print
+
+from multistage import errors
+from multistage.config import LaneConfig, SnapshotsConfig
+from multistage.constants import (SNAPSHOT_ARCHIVE_COMPRESSION_LEVEL,
+                                  SNAPSHOT_MANIFEST_FILE_NAME)
+from multistage.file_copy import (TransferStatistics, copy_sparse_file,
+                                  list_files, try_reflink)
+
+# Table files of LevelDB are never modified once written (only deleted), thus they can be shared (hardlinked) by the database and its snapshots.
+# Other files (e.g. logs, manifests) are modified in place, thus have to be copied.
+IMMUTABLE_FILES_SUFFIXES = [".ldb", ".sst"]
+
+
+# Copies files, preferring (in this order): reflinks, hardlinks (for immutable files only), plain copies.
+class FileCloner:
+    def __init__(self, allow_reflinks: bool, allow_hardlinks: bool) -> None:
+        self.allow_reflinks = allow_reflinks
+        self.allow_hardlinks = allow_hardlinks
+
+    # Returns how the file has been cloned: "reflink", "hardlink" or "copy".
+    def clone(self, source: Path, destination: Path) -> str:
+        if self.allow_reflinks:
+            if try_reflink(source, destination):
+                return "reflink"
+
+            # Reflinks are tried until the first "not supported" error (the filesystem will not change in the meantime).
+            self.allow_reflinks = False
+
+        if self.allow_hardlinks and source.suffix in IMMUTABLE_FILES_SUFFIXES:
+            os.link(source, destination)
+            return "hardlink"
+
+        copy_sparse_file(source, destination)
+        return "copy"
+
+
+# Snapshots of the database of a lane (one per stage boundary), each in a folder named after the stage it can be restored for.
+# A snapshot is either a tree of files (reflinks, hardlinks or copies), or a set of compressed archives (chunks), written and read in parallel.
+class SnapshotStore:
+    def __init__(self, config: SnapshotsConfig) -> None:
+        self.folder = config.folder
+        self.keep = config.keep
+        self.method = config.method
+        self.threads = config.threads
+
+    @classmethod
+    def new_for_lane(cls, config: LaneConfig) -> Optional["SnapshotStore"]:
+        if config.snapshots is None:
+            return None
+
+        return cls(config.snapshots)
+
+    # The snapshot holds the database as of the start of "next_stage".
+    def take(self, database_path: Path, previous_stage_name: str, next_stage_name: str) -> TransferStatistics:
+        if not database_path.is_dir():
+            raise errors.KnownError(f"cannot take snapshot, database not found: {database_path}")
+
+        started_at = time.perf_counter()
+        files = list_files(database_path)
+        num_bytes = sum(size for _, size in files)
+
+        self.folder.mkdir(parents=True, exist_ok=True)
+        partial_path = self.folder / f".{next_stage_name}.partial"
+        shutil.rmtree(partial_path, ignore_errors=True)
+        partial_path.mkdir()
+
+        method = self._resolve_method(database_path)
+        num_chunks = 0
+
+        if method == "archive":
+            num_chunks = self._archive(database_path, files, partial_path)
+        else:
+            methods = self._clone_tree(database_path, files, partial_path / "db", allow_reflinks=method != "hardlink", allow_hardlinks=method != "reflink")
+
+            if method == "reflink" and "copy" in methods:
+                shutil.rmtree(partial_path, ignore_errors=True)
+                raise errors.KnownError(f"reflinks are not supported for snapshots in {self.folder}")
+
+            method = "hardlink" if "hardlink" in methods else "reflink" if "reflink" in methods else "copy"
+
+        duration = time.perf_counter() - started_at
+        manifest = {
+            "stage": next_stage_name,
+            "previousStage": previous_stage_name,
+            "method": method,
+            "chunks": num_chunks,
+            "files": len(files),
+            "bytes": num_bytes,
+            "createdAt": time.time(),
+            "duration": duration,
+        }
+
+        (partial_path / SNAPSHOT_MANIFEST_FILE_NAME).write_text(json.dumps(manifest, indent=4))
+
+        # Replace the previous snapshot for the same stage (if any) only once the new one is complete.
+        snapshot_path = self.folder / next_stage_name
+        shutil.rmtree(snapshot_path, ignore_errors=True)
+        partial_path.rename(snapshot_path)
+
+        self.apply_retention()
+        return TransferStatistics(len(files), num_bytes, duration)
+
+    def restore(self, stage_name: str, database_path: Path) -> TransferStatistics:
+        snapshot_path = self.folder / stage_name
+        manifest = self.load_manifest(snapshot_path)
+
+        if manifest is None:
+            available = ", ".join(item["stage"] for item in self.list_snapshots()) or "none"
+            raise errors.KnownError(f"no snapshot for stage {stage_name} in {self.folder} (available: {available})")
+
+        started_at = time.perf_counter()
+        database_path.parent.mkdir(parents=True, exist_ok=True)
+        restoring_path = database_path.parent / f"{database_path.name}.restoring"
+        previous_path = database_path.parent / f"{database_path.name}.previous"
+        shutil.rmtree(restoring_path, ignore_errors=True)
+
+        if manifest["method"] == "archive":
+            self._extract(snapshot_path, restoring_path)
+        else:
+            snapshot_database_path = snapshot_path / "db"
+            files = list_files(snapshot_database_path)
+            allow_hardlinks = snapshot_database_path.stat().st_dev == database_path.parent.stat().st_dev
+            self._clone_tree(snapshot_database_path, files, restoring_path, allow_reflinks=True, allow_hardlinks=allow_hardlinks)
+
+        # Swap: the current database is only removed once the restored one is in place.
+        shutil.rmtree(previous_path, ignore_errors=True)
+        if database_path.exists():
+            database_path.rename(previous_path)
+        restoring_path.rename(database_path)
+        shutil.rmtree(previous_path, ignore_errors=True)
+
+        return TransferStatistics(manifest["files"], manifest["bytes"], time.perf_counter() - started_at)
+
+    def _resolve_method(self, database_path: Path) -> str:
+        if self.method != "auto":
+            if self.method != "archive" and not is_same_filesystem(database_path, self.folder):
+                raise errors.KnownError(f"snapshots by {self.method} require {self.folder} to be on the same filesystem as {database_path}")
+            return self.method
+
+        # Reflinks are tried first, then hardlinks.
+        return "link" if is_same_filesystem(database_path, self.folder) else "archive"
+
+    # Returns the set of methods used (see "FileCloner").
+    def _clone_tree(self, source: Path, files: list[tuple[Path, int]], destination: Path, allow_reflinks: bool, allow_hardlinks: bool) -> set[str]:
+        cloner = FileCloner(allow_reflinks, allow_hardlinks)
+
+        for folder in sorted({(destination / relative_path).parent for relative_path, _ in files} | {destination}):
+            folder.mkdir(parents=True, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = [executor.submit(cloner.clone, source / relative_path, destination / relative_path) for relative_path, _ in files]
+            return {future.result() for future in futures}
+
+    def _archive(self, source: Path, files: list[tuple[Path, int]], destination: Path) -> int:
+        chunks = split_into_chunks(files, self.threads)
+
+        def write_chunk(index: int, chunk: list[Path]):
+            with tarfile.open(destination / f"chunk-{index:03}.tar.gz", "w:gz", compresslevel=SNAPSHOT_ARCHIVE_COMPRESSION_LEVEL) as archive:
+                for relative_path in chunk:
+                    archive.add(source / relative_path, arcname=str(relative_path))
+
+        # Compression (zlib) releases the GIL: chunks are compressed in parallel.
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = [executor.submit(write_chunk, index, chunk) for index, chunk in enumerate(chunks)]
+
+            for future in futures:
+                future.result()
+
+        return len(chunks)
+
+    def _extract(self, snapshot_path: Path, destination: Path):
+        destination.mkdir(parents=True)
+
+        def extract_chunk(chunk_path: Path):
+            with tarfile.open(chunk_path, "r:gz") as archive:
+                archive.extractall(destination, filter="data")
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = [executor.submit(extract_chunk, chunk_path) for chunk_path in sorted(snapshot_path.glob("chunk-*.tar.gz"))]
+
+            for future in futures:
+                future.result()
+
+    def apply_retention(self):
+        snapshots = sorted(self.list_snapshots(), key=lambda item: item["createdAt"], reverse=True)
+
+        for manifest in snapshots[self.keep:]:
+            print(f"Removing old snapshot: {self.folder / manifest['stage']}")
+            shutil.rmtree(self.folder / manifest["stage"], ignore_errors=True)
+
+    def list_snapshots(self) -> list[dict[str, Any]]:
+        if not self.folder.exists():
+            return []
+
+        manifests = [self.load_manifest(item) for item in self.folder.iterdir() if not item.name.startswith(".")]
+        return [manifest for manifest in manifests if manifest is not None]
+
+    def load_manifest(self, snapshot_path: Path) -> Optional[dict[str, Any]]:
+        # Snapshots without a manifest are incomplete.
+        try:
+            return json.loads((snapshot_path / SNAPSHOT_MANIFEST_FILE_NAME).read_text())
+        except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+            return None
+
+
+# Balances the chunks by size (largest files first, each to the smallest chunk so far).
+def split_into_chunks(files: list[tuple[Path, int]], num_chunks: int) -> list[list[Path]]:
+    chunks: list[list[Path]] = [[] for _ in range(min(num_chunks, len(files)) or 1)]
+    sizes = [0] * len(chunks)
+
+    for relative_path, size in sorted(files, key=lambda item: item[1], reverse=True):
+        index = sizes.index(min(sizes))
+        chunks[index].append(relative_path)
+        sizes[index] += size
+
+    return chunks
+
+
+def is_same_filesystem(path: Path, other_path: Path) -> bool:
+    other_path.mkdir(parents=True, exist_ok=True)
+    return path.stat().st_dev == other_path.stat().st_dev
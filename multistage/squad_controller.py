@@ -0,0 +1,118 @@
+import asyncio
+from typing import Optional
+
+from rich import print
+from rich.markup import escape
+from rich.table import Table
+
+from multistage.archive_cache import ArchiveCache
+from multistage.artifact_store import ArtifactStore
+from multistage.lane_controller import LaneController
+from multistage.metrics import MetricsServer
+from multistage.resources import AdmissionScheduler
+from multistage.run_history import RunHistory
+from multistage.services import SharedServices
+
+
+class SquadController:
+    def __init__(self,
+                 lanes: list[LaneController],
+                 max_parallel_transitions: int,
+                 archives_cache: Optional[ArchiveCache] = None,
+                 metrics_address: Optional[str] = None,
+                 admission: Optional[AdmissionScheduler] = None,
+                 artifact_store: Optional[ArtifactStore] = None,
+                 history: Optional[RunHistory] = None) -> None:
+        self.lanes = lanes
+        self.max_parallel_transitions = max_parallel_transitions
+        self.archives_cache = archives_cache
+        self.admission = admission
+        self.artifact_store = artifact_store
+        self.history = history
+        self.metrics_address = metrics_address
+        self.errors_by_lane: dict[str, BaseException] = {}
+
+    def start(self) -> bool:
+        try:
+            asyncio.run(self._do_start())
+        except KeyboardInterrupt:
+            print("Processing squad interrupted.")
+
+        self.print_summary()
+        return all(self.get_lane_error(lane) is None and lane.succeeded for lane in self.lanes)
+
+    async def _do_start(self):
+        services = SharedServices(self.max_parallel_transitions, self.archives_cache, self.admission, self.artifact_store, self.history)
+
+        metrics_server = MetricsServer(services.metrics, self.metrics_address) if self.metrics_address else None
+
+        for lane in self.lanes:
+            lane.services = services
+
+        if metrics_server is not None:
+            metrics_server.start()
+
+        try:
+            tasks = [asyncio.create_task(lane.run(), name=lane.config.name) for lane in self.lanes]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+            for lane, result in zip(self.lanes, results):
+                if isinstance(result, BaseException):
+                    print(f"[red]Lane {lane.config.name} failed:[/red] {escape(repr(result))}")
+                    self.errors_by_lane[lane.config.name] = result
+        finally:
+            if metrics_server is not None:
+                metrics_server.close()
+
+            services.close()
+
+    def get_lane_error(self, lane: LaneController) -> Optional[BaseException]:
+        return self.errors_by_lane.get(lane.config.name)
+
+    def print_summary(self):
+        table = Table(title="Lanes")
+        table.add_column("Lane")
+        table.add_column("Last stage")
+        table.add_column("Return code")
+        table.add_column("Slowest shutdown")
+        table.add_column("Slowest recovery")
+        table.add_column("Restarts")
+        table.add_column("Outcome")
+
+        for lane in self.lanes:
+            error = self.get_lane_error(lane)
+
+            if error is not None:
+                outcome = f"[red]error: {escape(str(error))}"
+            elif lane.succeeded:
+                outcome = "[green]done"
+            else:
+                outcome = "[red]stopped"
+
+            table.add_row(
+                lane.config.name,
+                lane.current_stage_name or "-",
+                str(lane.return_code) if lane.return_code is not None else "-",
+                format_slowest(lane.shutdowns_durations),
+                format_slowest(lane.recoveries_durations),
+                format_restarts(lane.restarts),
+                outcome,
+            )
+
+        print(table)
+
+
+def format_restarts(restarts: list[tuple[str, Optional[float]]]) -> str:
+    if not restarts:
+        return "-"
+
+    downtime = sum(downtime or 0 for _, downtime in restarts)
+    return f"{len(restarts)} ({downtime:.0f}s down)"
+
+
+def format_slowest(durations_by_stage: dict[str, float]) -> str:
+    if not durations_by_stage:
+        return "-"
+
+    stage_name, duration = max(durations_by_stage.items(), key=lambda item: item[1])
+    return f"{duration:.2f}s ({stage_name})"
@@ -1,89 +1,363 @@
 import asyncio
 import os
 import shutil
+import signal
+import subprocess
+import time
 from asyncio.subprocess import Process
-from http import HTTPStatus
 from pathlib import Path
 from typing import Optional
 
-import requests
 from rich import print
+from rich.markup import escape
+from rich.panel import Panel
 
+from multistage import errors
+from multistage.archive_cache import ArchiveCache
+from multistage.artifact_store import (ArtifactStore,
+                                       create_default_artifact_store)
 from multistage.config import StageConfig
-from multistage.constants import NODE_PROCESS_ULIMIT
+from multistage.constants import (NODE_LOGS_FOLDER_NAME,
+                                  NODE_MONITORING_PERIOD,
+                                  NODE_OUTPUT_DRAIN_TIMEOUT,
+                                  NODE_RETURN_CODE_SIGKILL,
+                                  NODE_RETURN_CODE_SUCCESS,
+                                  STAGING_DIRECTORY_NAME)
+from multistage.node_output import NodeOutputTracker
+from multistage.profiler import NodeProfiler
+from multistage.resources import apply_cgroup_limits, get_launcher_command
 from multistage.shared import fetch_archive
+from multistage.status_poller import NodeStatus, StatusPoller
 
 
 class StageController:
-    def __init__(self, config: StageConfig) -> None:
+    def __init__(self,
+                 config: StageConfig,
+                 lane_name: str = "",
+                 status_poller: Optional[StatusPoller] = None,
+                 archives_cache: Optional[ArchiveCache] = None,
+                 artifact_store: Optional[ArtifactStore] = None) -> None:
         self.config = config
+        self.lane_name = lane_name
+        self.status_poller = status_poller or StatusPoller()
+        self.archives_cache = archives_cache
+        self.artifact_store = artifact_store or create_default_artifact_store()
+        # Checksum of the configuration archive, once prepared.
+        self.prepared_checksum: Optional[str] = None
         self.process: Optional[Process] = None
         self.return_code = -1
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        # Whether the node was stopped on purpose (e.g. target reached), regardless of its return code.
+        self.stop_requested = False
+        # Whether the node was stopped before the end of the stage (e.g. the lane was stopped): the stage is then not over.
+        self.interrupted = False
+        # Set if the node was stopped for making no progress (see the supervisor): for how long it made none.
+        self.stall_duration: Optional[float] = None
+        self.stop_requested_at: Optional[float] = None
+        self.stop_escalated = False
+        # Set once the node has exited (and its outcome is known).
+        self.exited = asyncio.Event()
+        # Only if the progress is detected from the node's output (instead of its API).
+        self.output_tracker: Optional[NodeOutputTracker] = None
+        self.output_task: Optional[asyncio.Task[None]] = None
+        # Resource usage of the node, joined with the last observed status.
+        self.profiler: Optional[NodeProfiler] = None
+        self.profiler_task: Optional[asyncio.Task[None]] = None
+        self.last_status: Optional[NodeStatus] = None
 
     def configure(self, working_directory: Path):
+        self.prepare(working_directory)
+        self.install_prepared(working_directory)
+
+    # Can run while the node of the previous stage is still running: the configuration is unpacked in a staging directory,
+    # (on the same filesystem as the working directory), and the binary of the stage is checked.
+    def prepare(self, working_directory: Path):
+        staging_directory = self.get_staging_directory(working_directory)
+        shutil.rmtree(staging_directory, ignore_errors=True)
+        staging_directory.mkdir(parents=True, exist_ok=True)
+
+        print(f"{self.get_log_prefix()}Preparing stage {self.config.name} in {staging_directory} ...")
+        self.prepared_checksum = fetch_archive(self.config.configuration_archive, staging_directory / "config", self.archives_cache, self.config.configuration_archive_checksum)
+        self.check_binary(working_directory)
+
+    # Should only run while no node is running in the working directory.
+    def install_prepared(self, working_directory: Path):
+        staging_directory = self.get_staging_directory(working_directory)
+        staged_config_directory = staging_directory / "config"
         config_directory = working_directory / "config"
-        shutil.rmtree(config_directory, ignore_errors=True)
-        fetch_archive(self.config.configuration_archive, config_directory)
+        previous_config_directory = staging_directory.parent / "previous-config"
+
+        if not staged_config_directory.is_dir():
+            raise errors.KnownError(f"stage {self.config.name} is not prepared (missing {staged_config_directory})")
+
+        shutil.rmtree(previous_config_directory, ignore_errors=True)
+
+        if config_directory.exists():
+            os.rename(config_directory, previous_config_directory)
+
+        os.rename(staged_config_directory, config_directory)
+        self.deploy_libraries(working_directory)
+
+    # The shared libraries of the node (e.g. wasmer) are loaded from the working directory (see "LD_LIBRARY_PATH").
+    # They are linked to the artifact store, thus stored once, whatever the number of lanes.
+    def deploy_libraries(self, working_directory: Path):
+        for library in self.config.bin.glob("*.so"):
+            self.artifact_store.add_and_deploy(library, working_directory / library.name)
+
+    def clean_staging(self, working_directory: Path):
+        staging_directory = self.get_staging_directory(working_directory)
+        shutil.rmtree(staging_directory, ignore_errors=True)
+        shutil.rmtree(staging_directory.parent / "previous-config", ignore_errors=True)
+
+    def get_staging_directory(self, working_directory: Path) -> Path:
+        return working_directory / STAGING_DIRECTORY_NAME / self.config.name
+
+    def check_binary(self, working_directory: Path):
+        # The libraries of the stage are only deployed (to the working directory) on install.
+        env = self.get_environment(working_directory)
+        env["LD_LIBRARY_PATH"] = f"{self.config.bin}:{working_directory}"
+        check_node_binary(self.config.bin, env)
 
     async def start(self, working_directory: Path):
+        await self.spawn(working_directory)
+        await self.wait()
+
+    async def spawn(self, working_directory: Path):
         program = self.config.bin / "node"
         args = self.config.node_arguments
 
         # Handle "~" in args:
         args = [arg.replace("~", str(Path.home())) for arg in args]
 
-        print(f"Starting node in {working_directory} ...")
+        print(f"{self.get_log_prefix()}Starting node in {working_directory} ...")
         print(args)
 
-        env = os.environ.copy()
-        env["LD_LIBRARY_PATH"] = str(working_directory)
+        progress_source = self.config.progress_source
+        capture_output = progress_source == "output"
+        spawned_at = time.time()
+
+        resources = self.config.resources
+        # Limits & priorities are applied by a launcher (which then becomes the node), so that they hold for all the node's threads.
+        launcher_command = get_launcher_command(resources)
 
-        self.process = await asyncio.create_subprocess_exec(
-            program,
-            *args,
-            stdout=asyncio.subprocess.DEVNULL,
-            cwd=working_directory,
-            limit=NODE_PROCESS_ULIMIT,
-            env=env,
-        )
+        # Captured output goes through a plain pipe, drained by a thread (see "follow_pipe").
+        read_fd, write_fd = os.pipe() if capture_output else (-1, -1)
+
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *launcher_command,
+                program,
+                *args,
+                stdout=write_fd if capture_output else asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.STDOUT if capture_output else None,
+                cwd=working_directory,
+                env=self.get_environment(working_directory),
+            )
+        except BaseException:
+            if capture_output:
+                os.close(read_fd)
+            raise
+        finally:
+            # Only the node holds the writing end: the pipe ends (EOF) when the node exits.
+            if capture_output:
+                os.close(write_fd)
+
+        self.started_at = time.perf_counter()
+
+        if resources.requires_cgroup():
+            apply_cgroup_limits(resources, self.lane_name or self.config.name, self.process.pid)
+
+        self.profiler = NodeProfiler(self.process.pid)
+        self.profiler_task = asyncio.create_task(self.profiler.run(lambda: self.last_status))
+
+        if progress_source == "status":
+            return
+
+        self.output_tracker = NodeOutputTracker()
+
+        if capture_output:
+            self.output_task = asyncio.create_task(self.output_tracker.follow_pipe(read_fd))
+        else:
+            self.output_task = asyncio.create_task(self.output_tracker.follow_logs(working_directory / NODE_LOGS_FOLDER_NAME, spawned_at))
+
+    async def wait(self):
+        assert self.process is not None
 
         return_code = await self.process.wait()
-        print(f"Node stopped, with return code = {return_code}. See node's logs.")
+        self.stopped_at = time.perf_counter()
+        self.stop_profiling()
+        failed = (return_code != NODE_RETURN_CODE_SUCCESS and not self.stop_requested) or self.stall_duration is not None
+        await self.stop_following_output(drain=failed)
+        print(f"{self.get_log_prefix()}Node stopped, with return code = {return_code}. See node's logs.")
+
+        if failed and self.output_tracker is not None:
+            self.report_output_tail(self.output_tracker)
+
+        shutdown_duration = self.get_shutdown_duration()
+        if shutdown_duration is not None:
+            # The node might have exited on its own, just before being killed.
+            killed = self.stop_escalated and return_code == NODE_RETURN_CODE_SIGKILL
+            escalation_text = " (killed after the grace period)" if killed else ""
+            print(f"{self.get_log_prefix()}Node shutdown took {shutdown_duration:.2f}s{escalation_text}.")
 
         self.process = None
         self.return_code = return_code
 
-    def stop(self):
-        assert self.process is not None
+        # The monitoring should not sleep until its next poll (e.g. the node was stopped by a request, or crashed).
+        self.exited.set()
+        if self.output_tracker is not None:
+            self.output_tracker.changed.set()
 
-        print("Stopping node ...")
-        self.process.kill()
-        self.process = None
+    def stop_profiling(self):
+        if self.profiler_task is not None:
+            self.profiler_task.cancel()
+            self.profiler_task = None
+
+    async def stop_following_output(self, drain: bool):
+        task = self.output_task
+        if task is None:
+            return
+
+        assert self.output_tracker is not None
+        self.output_tracker.is_following = False
+
+        # Captured output ends (EOF) right after the process; log files are read one last time, only if needed.
+        if drain or self.config.progress_source == "output":
+            await asyncio.wait([task], timeout=NODE_OUTPUT_DRAIN_TIMEOUT)
+
+        task.cancel()
+        self.output_task = None
+
+    def report_output_tail(self, tracker: NodeOutputTracker):
+        tail = tracker.get_tail()
+        if not tail:
+            return
+
+        print(Panel(escape("\n".join(tail)), title=f"{self.get_log_prefix()}last {len(tail)} lines of the node's output", border_style="red"))
+
+    def get_environment(self, working_directory: Path) -> dict[str, str]:
+        env = os.environ.copy()
+        env["LD_LIBRARY_PATH"] = str(working_directory)
+        return env
+
+    # Asks the node to shut down (so that it can close its storage cleanly), then kills it if the grace period expires.
+    async def stop(self, interrupted: bool = False):
+        process = self.process
+        assert process is not None
+
+        if self.stop_requested:
+            # Already stopping (e.g. target reached, while the lane is being stopped).
+            return
+
+        self.interrupted = interrupted
+        stop_signal = self.config.stop_signal
+        grace_period = self.config.stop_grace_period
+
+        self.stop_requested = True
+        self.stop_requested_at = time.perf_counter()
+
+        print(f"{self.get_log_prefix()}Stopping node ({stop_signal.name}, grace period = {grace_period}s) ...")
+
+        # The shutdown is not part of the last epoch (thus, not profiled).
+        if self.profiler is not None:
+            self.profiler.take_sample(self.last_status)
+            self.stop_profiling()
+
+        try:
+            process.send_signal(stop_signal)
+        except ProcessLookupError:
+            # Already exited.
+            return
+
+        if stop_signal == signal.SIGKILL:
+            return
+
+        try:
+            await asyncio.wait_for(asyncio.shield(process.wait()), timeout=grace_period)
+        except TimeoutError:
+            print(f"{self.get_log_prefix()}[yellow]Node did not stop within {grace_period}s, killing it ...")
+            self.stop_escalated = True
+
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+
+    # Whether the stage is over (thus, the lane can advance): the node reached its target (and was stopped on purpose),
+    # or exited on its own, successfully.
+    def is_completed(self) -> bool:
+        if self.interrupted:
+            return False
+
+        return self.stop_requested or self.return_code == NODE_RETURN_CODE_SUCCESS
+
+    def get_duration(self) -> Optional[float]:
+        if self.started_at is None or self.stopped_at is None:
+            return None
+
+        return self.stopped_at - self.started_at
+
+    def get_shutdown_duration(self) -> Optional[float]:
+        if self.stop_requested_at is None or self.stopped_at is None:
+            return None
+
+        return self.stopped_at - self.stop_requested_at
 
     def is_running(self) -> bool:
         return self.process is not None
 
-    def should_stop(self) -> bool:
-        epoch = self.get_current_epoch()
-        return epoch > self.config.until_epoch
+    # Either polls the node's API (after the given delay), or waits for progress to show in the node's output.
+    # Returns early if the node exits.
+    async def wait_for_status(self, delay: float) -> Optional[NodeStatus]:
+        if self.output_tracker is None:
+            try:
+                await asyncio.wait_for(self.exited.wait(), delay)
+            except TimeoutError:
+                pass
+
+            status = await self.get_status() if self.is_running() else None
+        else:
+            status = await self.output_tracker.wait_for_change(NODE_MONITORING_PERIOD)
 
-    def get_current_epoch(self) -> int:
+        if status is not None:
+            self.last_status = status
+
+        return status
+
+    async def get_status(self) -> Optional[NodeStatus]:
         status_url = self.config.node_status_url
+        status = await self.status_poller.poll(status_url)
 
-        try:
-            response = requests.get(status_url)
+        if status is None:
+            error = self.status_poller.get_last_error(status_url)
+            print(f"{self.get_log_prefix()}[red]Error:[/red] node status not available ({error}).")
+
+        return status
+
+    def get_log_prefix(self) -> str:
+        return f"{self.lane_name}: " if self.lane_name else ""
+
+
+# Also used by the pre-flight checks (before any lane is started).
+def check_node_binary(bin: Path, env: dict[str, str]):
+    program = bin / "node"
+
+    if not program.is_file() or not os.access(program, os.X_OK):
+        raise errors.KnownError(f"node binary is missing or not executable: {program}")
 
-            if response.status_code != HTTPStatus.OK:
-                return 0
+    missing_libraries = find_missing_libraries(program, env)
+    if missing_libraries:
+        raise errors.KnownError(f"node binary {program} has missing shared libraries: {', '.join(missing_libraries)}")
 
-            data = response.json().get("data", {})
-            metrics = data.get("metrics", {})
-            epoch = int(metrics.get("drt_epoch_number", 0))
-            block_nonce = int(metrics.get("drt_nonce", 0))
 
-            print(f"Epoch = {epoch}, block = {block_nonce}")
+def find_missing_libraries(program: Path, env: dict[str, str]) -> list[str]:
+    try:
+        result = subprocess.run(["ldd", str(program)], env=env, capture_output=True, text=True)
+    except FileNotFoundError:
+        # "ldd" not available, cannot check.
+        return []
 
-            return epoch
-        except Exception as error:
-            print(f"[red]Error:[/red] {error}")
-            return 0
+    # E.g. "libwasmer_linux_amd64.so => not found"
+    missing_lines = [line for line in result.stdout.splitlines() if "not found" in line]
+    return [line.split("=>")[0].strip() for line in missing_lines]
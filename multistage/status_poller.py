@@ -0,0 +1,113 @@
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from multistage.constants import (NODE_STATUS_BACKOFF_BASE,
+                                  NODE_STATUS_BACKOFF_MAX,
+                                  NODE_STATUS_MAX_CONNECTIONS,
+                                  NODE_STATUS_TIMEOUT)
+
+
+class NodeStatus:
+    def __init__(self,
+                 epoch: int,
+                 nonce: int,
+                 current_round: int,
+                 is_syncing: bool,
+                 probable_highest_nonce: int,
+                 received_at: float) -> None:
+        self.epoch = epoch
+        self.nonce = nonce
+        self.current_round = current_round
+        self.is_syncing = is_syncing
+        self.probable_highest_nonce = probable_highest_nonce
+        # Monotonic time (time.perf_counter()).
+        self.received_at = received_at
+
+    @classmethod
+    def new_from_metrics(cls, metrics: dict[str, Any], received_at: float):
+        return cls(
+            epoch=int(metrics.get("drt_epoch_number", 0)),
+            nonce=int(metrics.get("drt_nonce", 0)),
+            current_round=int(metrics.get("drt_current_round", 0)),
+            is_syncing=bool(int(metrics.get("drt_is_syncing", 0))),
+            probable_highest_nonce=int(metrics.get("drt_probable_highest_nonce", 0)),
+            received_at=received_at,
+        )
+
+
+class PollingState:
+    def __init__(self) -> None:
+        self.in_flight: Optional[asyncio.Future[Optional[NodeStatus]]] = None
+        self.consecutive_failures = 0
+        self.retry_after = 0.0
+        self.last_error: Optional[str] = None
+
+
+# Polls "/node/status" of many nodes through a fixed number of (keep-alive) connections & worker threads.
+# Concurrent polls of the same URL share a single request. While a node's API is not reachable,
+# polls are answered (with None) without making requests, until a jittered, exponential backoff expires.
+class StatusPoller:
+    def __init__(self, max_connections: int = NODE_STATUS_MAX_CONNECTIONS, timeout: float = NODE_STATUS_TIMEOUT) -> None:
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_connections, thread_name_prefix="status")
+        self.states: dict[str, PollingState] = {}
+
+    async def poll(self, url: str) -> Optional[NodeStatus]:
+        state = self.states.setdefault(url, PollingState())
+
+        if state.in_flight is not None:
+            return await asyncio.shield(state.in_flight)
+
+        if time.perf_counter() < state.retry_after:
+            return None
+
+        loop = asyncio.get_running_loop()
+        in_flight: asyncio.Future[Optional[NodeStatus]] = loop.create_future()
+        state.in_flight = in_flight
+        status: Optional[NodeStatus] = None
+
+        try:
+            status = await loop.run_in_executor(self.executor, self._fetch, url)
+            state.consecutive_failures = 0
+            state.retry_after = 0
+            state.last_error = None
+        except Exception as error:
+            state.consecutive_failures += 1
+            state.last_error = str(error)
+            delay = min(NODE_STATUS_BACKOFF_MAX, NODE_STATUS_BACKOFF_BASE * 2 ** (state.consecutive_failures - 1))
+            state.retry_after = time.perf_counter() + delay * random.uniform(0.5, 1.5)
+        finally:
+            # Also reached on cancellation, so that other waiters are not left hanging.
+            state.in_flight = None
+            in_flight.set_result(status)
+
+        return status
+
+    def get_last_error(self, url: str) -> Optional[str]:
+        state = self.states.get(url)
+        return state.last_error if state else None
+
+    def _fetch(self, url: str) -> NodeStatus:
+        response = self.session.get(url, timeout=self.timeout)
+
+        if response.status_code != HTTPStatus.OK:
+            raise requests.HTTPError(f"HTTP {response.status_code}")
+
+        data = response.json().get("data", {})
+        metrics = data.get("metrics", {})
+        return NodeStatus.new_from_metrics(metrics, time.perf_counter())
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
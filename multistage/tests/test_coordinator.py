@@ -0,0 +1,268 @@
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Iterator
+
+import pytest
+
+from multistage.agent import Agent
+from multistage.benchmark.harness import (create_bin_folder,
+                                          create_configuration_archive,
+                                          start_status_server)
+from multistage.config import DriverConfig
+from multistage.coordinator import CoordinatedLane, Coordinator
+from multistage.driver import add_services_arguments, load_driver_config
+from multistage.rpc import RpcClient
+
+NONCES_PER_EPOCH = 100
+BLOCKS_PER_SECOND = 50
+TIMEOUT = 15
+
+
+# A squad spanning two hosts ("a" and "b"), each with its own agent (in-process, on a Unix socket), running the fake node
+# of the benchmark, whose status is served by the stand-in status server.
+class Squad:
+    def __init__(self, workspace: Path, status_port: int) -> None:
+        self.workspace = workspace
+        self.status_port = status_port
+        self.bin_folder = create_bin_folder(workspace)
+        self.configuration_archive = create_configuration_archive(workspace)
+
+    def create_driver_config(self, lanes: dict[str, str]) -> DriverConfig:
+        config_path = self.workspace / "driver.json"
+        config = {
+            "agents": {host: f"unix:{self.workspace / f'agent-{host}.sock'}" for host in ["a", "b"]},
+            "lanes": [self.create_lane_record(name, host) for name, host in lanes.items()],
+        }
+
+        config_path.write_text(json.dumps(config, indent=4))
+        return load_driver_config(str(config_path))
+
+    def create_lane_record(self, name: str, host: str) -> dict[str, Any]:
+        stage: dict[str, Any] = {
+            "nodeStatusUrl": f"http://localhost:{self.status_port}/{name}/node/status",
+            "configurationArchive": self.configuration_archive.as_uri(),
+            "bin": str(self.bin_folder),
+            "nodeArguments": [f"--blocks-per-second={BLOCKS_PER_SECOND}"],
+            "stopGracePeriod": 5,
+        }
+
+        return {
+            "name": name,
+            "host": host,
+            "workingDirectory": str(self.workspace / "lanes" / name),
+            "stages": [
+                {**stage, "name": "light", "untilEpoch": 1000},
+                {**stage, "name": "heavy", "untilEpoch": 2000, "heavy": True},
+            ],
+        }
+
+    @asynccontextmanager
+    async def run_agents(self, driver_config: DriverConfig) -> AsyncIterator[dict[str, Agent]]:
+        agents: dict[str, Agent] = {}
+        tasks: list[asyncio.Task[None]] = []
+
+        for host, address in driver_config.agents.items():
+            # Each agent only knows the lanes of its host.
+            lanes = [lane for lane in driver_config.lanes if lane.host == host]
+            agent = Agent(DriverConfig(lanes, driver_config.agents)) if lanes else None
+            if agent is None:
+                continue
+
+            agents[host] = agent
+            tasks.append(asyncio.create_task(agent._do_start(self.create_agent_args(host, address))))
+
+        try:
+            for host, address in driver_config.agents.items():
+                if host in agents:
+                    await wait_for(lambda: Path(address.removeprefix("unix:")).exists())
+
+            yield agents
+        finally:
+            # Nodes are not left behind (e.g. if the test failed).
+            for agent in agents.values():
+                for name, agent_lane in agent.lanes.items():
+                    if agent_lane.is_running():
+                        await agent.stop_lane(name)
+
+            await wait_for(lambda: not any(agent_lane.is_running() for agent in agents.values() for agent_lane in agent.lanes.values()))
+
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def create_agent_args(self, host: str, address: str):
+        parser = ArgumentParser()
+        parser.add_argument("--listen")
+        add_services_arguments(parser)
+
+        return parser.parse_args([
+            f"--listen={address}",
+            f"--archives-cache={self.workspace / 'cache'}",
+            f"--artifacts-store={self.workspace / 'artifacts'}",
+            f"--history={self.workspace / f'history-{host}.sqlite'}",
+        ])
+
+
+@pytest.fixture
+def squad(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Squad]:
+    # Nothing is written to the actual home folder (e.g. the admission state of the agents).
+    monkeypatch.setenv("HOME", str(tmp_path))
+    status_server, port = start_status_server(tmp_path / "lanes", NONCES_PER_EPOCH)
+
+    try:
+        yield Squad(tmp_path, port)
+    finally:
+        status_server.terminate()
+        status_server.wait()
+
+
+def create_coordinator(driver_config: DriverConfig, initial_stage_name: str, max_heavy_stages: int = 0) -> Coordinator:
+    lanes = [CoordinatedLane(lane, initial_stage_name) for lane in driver_config.lanes]
+    return Coordinator(driver_config, lanes, resume=False, max_heavy_stages=max_heavy_stages, stagger=0, poll_period=0.1)
+
+
+def get_lane(coordinator: Coordinator, name: str) -> CoordinatedLane:
+    return next(lane for lane in coordinator.lanes if lane.config.name == name)
+
+
+async def wait_for(predicate: Callable[[], bool]):
+    deadline = time.time() + TIMEOUT
+
+    while not predicate():
+        assert time.time() < deadline, "timed out"
+        await asyncio.sleep(0.05)
+
+
+async def poll_until(coordinator: Coordinator, predicate: Callable[[], bool]):
+    deadline = time.time() + TIMEOUT
+
+    while True:
+        await coordinator.poll()
+        if predicate():
+            return
+
+        assert time.time() < deadline, f"timed out, lanes: {[(lane.config.name, lane.state, lane.status) for lane in coordinator.lanes]}"
+        await asyncio.sleep(0.1)
+
+
+async def stop_all(coordinator: Coordinator):
+    await coordinator.stop_lanes()
+    await poll_until(coordinator, lambda: all(lane.is_final() for lane in coordinator.lanes))
+
+    for agent in coordinator.agents.values():
+        agent.close()
+
+
+def test_start_status_skip_stage_and_stop(squad: Squad):
+    driver_config = squad.create_driver_config({"x": "a", "y": "b"})
+
+    async def scenario():
+        async with squad.run_agents(driver_config):
+            coordinator = create_coordinator(driver_config, "light")
+            x, y = get_lane(coordinator, "x"), get_lane(coordinator, "y")
+
+            await coordinator.start_pending_lanes()
+            assert [x.state, y.state] == ["running", "running"]
+
+            # Status, as reported by each agent (of its own lanes only).
+            await poll_until(coordinator, lambda: (x.status.get("nonce") or 0) > 0 and (y.status.get("nonce") or 0) > 0)
+            assert [x.status["stage"], y.status["stage"]] == ["light", "light"]
+            status_of_b = await coordinator.agents["b"].call("status")
+            assert [lane["lane"] for lane in status_of_b["lanes"]] == ["y"]
+            assert status_of_b["lanes"][0]["stages"] == ["light", "heavy"]
+
+            # Not coordinated (nothing to enforce): the heavy stage starts at once.
+            skipped = await coordinator.agents["a"].call("skipStage", lane="x")
+            assert skipped["lane"] == "x"
+            await poll_until(coordinator, lambda: x.status.get("stage") == "heavy" and x.is_running_heavy_stage())
+            assert y.status["stage"] == "light"
+
+            await stop_all(coordinator)
+            assert [x.state, y.state] == ["stopped", "stopped"]
+            assert [x.status["stage"], y.status["stage"]] == ["heavy", "light"]
+
+    asyncio.run(scenario())
+
+
+def test_agent_refuses_bad_requests(squad: Squad):
+    driver_config = squad.create_driver_config({"x": "a", "y": "b"})
+
+    async def scenario():
+        async with squad.run_agents(driver_config):
+            client = RpcClient(driver_config.agents["a"])
+
+            try:
+                with pytest.raises(Exception, match="unknown lane: y"):
+                    await client.call("start", lane="y")
+                with pytest.raises(Exception, match="lane x is not running"):
+                    await client.call("stop", lane="x")
+
+                await client.call("start", lane="x", stage="light")
+                with pytest.raises(Exception, match="lane x is already running"):
+                    await client.call("start", lane="x")
+                with pytest.raises(Exception, match="lane x is not waiting for a grant"):
+                    await client.call("admit", lane="x")
+
+                await client.call("stop", lane="x")
+                await wait_for_state(client, "x", "stopped")
+            finally:
+                client.close()
+
+    asyncio.run(scenario())
+
+
+async def wait_for_state(client: RpcClient, lane: str, state: str):
+    deadline = time.time() + TIMEOUT
+
+    while True:
+        status = await client.call("status")
+        if next(item for item in status["lanes"] if item["lane"] == lane)["state"] == state:
+            return
+
+        assert time.time() < deadline, "timed out"
+        await asyncio.sleep(0.1)
+
+
+def test_grant_heavy_stages_least_loaded_host_first(squad: Squad):
+    driver_config = squad.create_driver_config({"a1": "a", "a2": "a", "b1": "b"})
+
+    async def scenario():
+        async with squad.run_agents(driver_config):
+            coordinator = create_coordinator(driver_config, "heavy", max_heavy_stages=2)
+            a1, a2, b1 = get_lane(coordinator, "a1"), get_lane(coordinator, "a2"), get_lane(coordinator, "b1")
+
+            await coordinator.start_pending_lanes()
+            await poll_until(coordinator, lambda: all(lane.is_awaiting_grant() for lane in coordinator.lanes))
+
+            # "a2" waits for longer than "b1", but host "a" will already run a heavy stage (that of "a1").
+            a1.awaiting_grant_since = 1
+            a2.awaiting_grant_since = 2
+            b1.awaiting_grant_since = 3
+
+            await coordinator.grant_heavy_stages()
+            assert a1.is_running_heavy_stage()
+            assert b1.is_running_heavy_stage()
+            assert a2.is_awaiting_grant()
+
+            # As seen by the agents, as well.
+            await poll_until(coordinator, lambda: (a1.status.get("nonce") or 0) > 0 and (b1.status.get("nonce") or 0) > 0)
+            assert a2.is_awaiting_grant()
+            assert not a2.status.get("nonce")
+
+            # The limit (across hosts) is reached: no more grants, until a heavy stage is over.
+            await coordinator.grant_heavy_stages()
+            assert a2.is_awaiting_grant()
+
+            await coordinator.stop_lane(b1)
+            await poll_until(coordinator, lambda: b1.state == "stopped")
+            await coordinator.grant_heavy_stages()
+            assert a2.is_running_heavy_stage()
+
+            await stop_all(coordinator)
+
+    asyncio.run(scenario())
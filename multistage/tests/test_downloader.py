@@ -0,0 +1,290 @@
+import hashlib
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import pytest
+
+from multistage import downloader, errors
+from multistage.downloader import (Downloader, get_partial_path,
+                                   get_validator_path)
+
+CONTENT = bytes(range(256)) * 4096
+OTHER_CONTENT = bytes(reversed(range(256))) * 4096
+
+
+# Serves in-memory files, with single ranges ("Range", "If-Range") and a strong ETag per version of each file.
+# Transfers can be cut short (see "FilesServer.cuts"), to simulate connections that drop in the middle of a download.
+class FilesHandler(BaseHTTPRequestHandler):
+    server: "FilesServer"
+
+    def do_HEAD(self):
+        self.send_file(with_body=False)
+
+    def do_GET(self):
+        self.send_file(with_body=True)
+
+    def send_file(self, with_body: bool):
+        self.server.requests.append((self.command, self.path, dict(self.headers)))
+        entry = self.server.files.get(self.path)
+
+        if entry is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        content, etag = entry
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        status = HTTPStatus.OK
+        start, end = 0, len(content) - 1
+
+        if range_header and if_range in [None, etag]:
+            first, _, last = range_header.removeprefix("bytes=").partition("-")
+            start = int(first)
+            end = min(int(last), end) if last else end
+
+            if start >= len(content):
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            status = HTTPStatus.PARTIAL_CONTENT
+
+        body = content[start:end + 1]
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(content)}")
+        self.end_headers()
+
+        if not with_body:
+            return
+
+        cut_after = self.server.pop_cut(self.path, start)
+        if cut_after is None:
+            self.wfile.write(body)
+            return
+
+        self.wfile.write(body[:cut_after])
+        self.wfile.flush()
+        self.close_connection = True
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+
+class FilesServer(ThreadingHTTPServer):
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), FilesHandler)
+        self.files: dict[str, tuple[bytes, str]] = {}
+        self.requests: list[tuple[str, str, dict[str, str]]] = []
+        # (path, start of the requested range) => number of bytes sent before dropping the connection (first GET only).
+        self.cuts: dict[tuple[str, int], int] = {}
+        self.lock = threading.Lock()
+
+    def pop_cut(self, path: str, start: int) -> Optional[int]:
+        with self.lock:
+            return self.cuts.pop((path, start), None)
+
+    def get_url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+    def get_ranges(self) -> list[str]:
+        return [headers["Range"] for command, _, headers in self.requests if command == "GET" and "Range" in headers]
+
+    def get_range_request(self, range_header: str) -> dict[str, str]:
+        return next(headers for command, _, headers in self.requests if command == "GET" and headers.get("Range") == range_header)
+
+
+@pytest.fixture
+def server() -> Iterator[FilesServer]:
+    server = FilesServer()
+    server.files["/archive.zip"] = (CONTENT, '"v1"')
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_partial(destination: Path, data: bytes, validator: str):
+    get_partial_path(destination).write_bytes(data)
+    get_validator_path(get_partial_path(destination)).write_text(validator)
+
+
+def test_download(server: FilesServer, tmp_path: Path):
+    destination = tmp_path / "archive.zip"
+    result = Downloader(segments=1).download(server.get_url("/archive.zip"), destination, sha256(CONTENT))
+
+    assert destination.read_bytes() == CONTENT
+    assert result.checksum == sha256(CONTENT)
+    assert result.downloaded_size == len(CONTENT)
+    assert not get_partial_path(destination).exists()
+    assert not get_validator_path(get_partial_path(destination)).exists()
+
+
+def test_resume_partial_of_previous_run(server: FilesServer, tmp_path: Path):
+    destination = tmp_path / "archive.zip"
+    offset = len(CONTENT) // 3
+    write_partial(destination, CONTENT[:offset], '"v1"')
+
+    result = Downloader(segments=1).download(server.get_url("/archive.zip"), destination, sha256(CONTENT))
+
+    assert destination.read_bytes() == CONTENT
+    assert result.size == len(CONTENT)
+    assert result.downloaded_size == len(CONTENT) - offset
+    assert server.get_ranges() == [f"bytes={offset}-"]
+
+
+def test_resume_after_connection_dropped_mid_transfer(server: FilesServer, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_RETRY_BASE_DELAY", 0)
+    # Chunks received before the connection drops are kept (thus, the cut falls on a chunk boundary).
+    monkeypatch.setattr(downloader, "DOWNLOAD_CHUNK_SIZE", 1024)
+    destination = tmp_path / "archive.zip"
+    cut_after = 300 * 1024
+    server.cuts[("/archive.zip", 0)] = cut_after
+
+    result = Downloader(segments=1).download(server.get_url("/archive.zip"), destination, sha256(CONTENT))
+
+    assert destination.read_bytes() == CONTENT
+    assert result.checksum == sha256(CONTENT)
+    assert server.get_ranges() == [f"bytes={cut_after}-"]
+    assert server.get_range_request(f"bytes={cut_after}-")["If-Range"] == '"v1"'
+
+
+def test_complete_partial_answered_with_416(server: FilesServer, tmp_path: Path):
+    destination = tmp_path / "archive.zip"
+    write_partial(destination, CONTENT, '"v1"')
+
+    result = Downloader(segments=1).download(server.get_url("/archive.zip"), destination, sha256(CONTENT))
+
+    assert destination.read_bytes() == CONTENT
+    assert result.downloaded_size == 0
+
+
+def test_non_prefix_partial_answered_with_416(server: FilesServer, tmp_path: Path):
+    destination = tmp_path / "archive.zip"
+    write_partial(destination, CONTENT + b"garbage", '"v1"')
+
+    result = Downloader(segments=1).download(server.get_url("/archive.zip"), destination)
+
+    assert destination.read_bytes() == CONTENT
+    assert result.checksum == sha256(CONTENT)
+    assert result.downloaded_size == len(CONTENT)
+
+
+def test_corrupted_partial_is_caught_by_checksum(server: FilesServer, tmp_path: Path):
+    destination = tmp_path / "archive.zip"
+    offset = len(CONTENT) // 2
+    write_partial(destination, b"\0" * offset, '"v1"')
+
+    with pytest.raises(errors.KnownError, match="checksum mismatch"):
+        Downloader(segments=1).download(server.get_url("/archive.zip"), destination, sha256(CONTENT))
+
+    assert not destination.exists()
+    # Not resumed from, next time.
+    assert not get_partial_path(destination).exists()
+    assert not get_validator_path(get_partial_path(destination)).exists()
+
+
+def test_checksum_mismatch_raises(server: FilesServer, tmp_path: Path):
+    destination = tmp_path / "archive.zip"
+
+    with pytest.raises(errors.KnownError, match="checksum mismatch"):
+        Downloader(segments=1).download(server.get_url("/archive.zip"), destination, sha256(b"something else"))
+
+    assert not destination.exists()
+    assert not get_partial_path(destination).exists()
+
+
+def test_partial_of_changed_file_is_not_resumed(server: FilesServer, tmp_path: Path):
+    destination = tmp_path / "archive.zip"
+    write_partial(destination, OTHER_CONTENT[:1000], '"v0"')
+
+    result = Downloader(segments=1).download(server.get_url("/archive.zip"), destination)
+
+    # "If-Range" does not match: the whole (new) file is sent, instead of being spliced onto the old one.
+    assert destination.read_bytes() == CONTENT
+    assert result.checksum == sha256(CONTENT)
+    assert result.downloaded_size == len(CONTENT)
+
+
+def test_partial_without_validator_is_not_resumed(server: FilesServer, tmp_path: Path):
+    destination = tmp_path / "archive.zip"
+    get_partial_path(destination).write_bytes(OTHER_CONTENT[:1000])
+
+    result = Downloader(segments=1).download(server.get_url("/archive.zip"), destination)
+
+    assert destination.read_bytes() == CONTENT
+    assert result.downloaded_size == len(CONTENT)
+    assert server.get_ranges() == []
+
+
+def test_segmented_download(server: FilesServer, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_SEGMENTED_THRESHOLD", 1024)
+    destination = tmp_path / "archive.zip"
+
+    result = Downloader(segments=4).download(server.get_url("/archive.zip"), destination, sha256(CONTENT))
+
+    assert destination.read_bytes() == CONTENT
+    assert result.downloaded_size == len(CONTENT)
+    assert len(server.get_ranges()) == 4
+    assert [path.name for path in tmp_path.iterdir()] == ["archive.zip"]
+
+
+def test_segmented_download_resumes_segment_dropped_mid_transfer(server: FilesServer, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_SEGMENTED_THRESHOLD", 1024)
+    monkeypatch.setattr(downloader, "DOWNLOAD_RETRY_BASE_DELAY", 0)
+    monkeypatch.setattr(downloader, "DOWNLOAD_CHUNK_SIZE", 1024)
+    destination = tmp_path / "archive.zip"
+    segment_size = len(CONTENT) // 4
+    cut_after = 100 * 1024
+    server.cuts[("/archive.zip", segment_size)] = cut_after
+
+    result = Downloader(segments=4).download(server.get_url("/archive.zip"), destination, sha256(CONTENT))
+
+    assert destination.read_bytes() == CONTENT
+    assert result.checksum == sha256(CONTENT)
+    assert len(server.get_ranges()) == 5
+    resumed_range = f"bytes={segment_size + cut_after}-{2 * segment_size - 1}"
+    assert server.get_range_request(resumed_range)["If-Range"] == '"v1"'
+
+
+def test_segmented_download_resumes_segments_of_same_version(server: FilesServer, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_SEGMENTED_THRESHOLD", 1024)
+    destination = tmp_path / "archive.zip"
+    partial_path = get_partial_path(destination)
+    segment_size = len(CONTENT) // 4
+    get_validator_path(partial_path).write_text('"v1"')
+    partial_path.with_name(f"{partial_path.name}.0").write_bytes(CONTENT[:segment_size])
+    partial_path.with_name(f"{partial_path.name}.1").write_bytes(CONTENT[segment_size:segment_size + 100])
+
+    result = Downloader(segments=4).download(server.get_url("/archive.zip"), destination, sha256(CONTENT))
+
+    assert destination.read_bytes() == CONTENT
+    assert result.downloaded_size == len(CONTENT) - segment_size - 100
+    assert f"bytes={segment_size + 100}-{2 * segment_size - 1}" in server.get_ranges()
+
+
+def test_segmented_download_drops_segments_of_changed_file(server: FilesServer, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(downloader, "DOWNLOAD_SEGMENTED_THRESHOLD", 1024)
+    destination = tmp_path / "archive.zip"
+    partial_path = get_partial_path(destination)
+    get_validator_path(partial_path).write_text('"v0"')
+    partial_path.with_name(f"{partial_path.name}.0").write_bytes(OTHER_CONTENT[:len(CONTENT) // 4])
+
+    result = Downloader(segments=4).download(server.get_url("/archive.zip"), destination)
+
+    assert destination.read_bytes() == CONTENT
+    assert result.checksum == sha256(CONTENT)
+    assert result.downloaded_size == len(CONTENT)
@@ -0,0 +1,118 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Any, Optional
+
+import pytest
+
+from multistage import errors
+from multistage.rpc import (ERROR_APPLICATION, ERROR_INTERNAL,
+                            ERROR_INVALID_PARAMS, ERROR_INVALID_REQUEST,
+                            ERROR_METHOD_NOT_FOUND, ERROR_PARSE, RpcClient,
+                            RpcServer)
+
+
+async def echo(text: str, repeat: int = 1) -> str:
+    return text * repeat
+
+
+async def refuse(lane: str) -> None:
+    raise errors.KnownError(f"lane {lane} is already running")
+
+
+async def crash() -> None:
+    raise RuntimeError("boom")
+
+
+def create_server() -> RpcServer:
+    return RpcServer({"echo": echo, "refuse": refuse, "crash": crash})
+
+
+def handle(server: RpcServer, request: Any) -> Optional[dict[str, Any]]:
+    line = request if isinstance(request, bytes) else json.dumps(request).encode()
+    return asyncio.run(server.handle_message(line))
+
+
+def get_error_code(response: Optional[dict[str, Any]]) -> int:
+    assert response is not None
+    return response["error"]["code"]
+
+
+def test_result():
+    response = handle(create_server(), {"jsonrpc": "2.0", "id": 7, "method": "echo", "params": {"text": "ab", "repeat": 2}})
+    assert response == {"jsonrpc": "2.0", "id": 7, "result": "abab"}
+
+
+@pytest.mark.parametrize("params", [{}, {"text": "a", "unknown": 1}, {"repeat": 2}])
+def test_invalid_params(params: dict[str, Any]):
+    response = handle(create_server(), {"jsonrpc": "2.0", "id": 1, "method": "echo", "params": params})
+
+    assert get_error_code(response) == ERROR_INVALID_PARAMS
+    assert response is not None and response["id"] == 1
+
+
+def test_params_not_an_object():
+    response = handle(create_server(), {"jsonrpc": "2.0", "id": 1, "method": "echo", "params": ["a"]})
+    assert get_error_code(response) == ERROR_INVALID_PARAMS
+
+
+def test_unknown_method():
+    response = handle(create_server(), {"jsonrpc": "2.0", "id": 1, "method": "reboot"})
+
+    assert get_error_code(response) == ERROR_METHOD_NOT_FOUND
+    assert response is not None and "reboot" in response["error"]["message"]
+
+
+def test_known_error_of_handler():
+    response = handle(create_server(), {"jsonrpc": "2.0", "id": 1, "method": "refuse", "params": {"lane": "x"}})
+
+    assert get_error_code(response) == ERROR_APPLICATION
+    assert response is not None and response["error"]["message"] == "lane x is already running"
+
+
+def test_unexpected_error_of_handler():
+    response = handle(create_server(), {"jsonrpc": "2.0", "id": 1, "method": "crash"})
+    assert get_error_code(response) == ERROR_INTERNAL
+
+
+def test_malformed_requests():
+    server = create_server()
+
+    assert get_error_code(handle(server, b"{not json")) == ERROR_PARSE
+    assert get_error_code(handle(server, [1, 2])) == ERROR_INVALID_REQUEST
+    assert get_error_code(handle(server, {"jsonrpc": "2.0", "id": 1})) == ERROR_INVALID_REQUEST
+
+
+def test_notification_has_no_response():
+    assert handle(create_server(), {"jsonrpc": "2.0", "method": "echo", "params": {"text": "a"}}) is None
+
+
+def test_client_over_unix_socket(tmp_path: Path):
+    async def scenario():
+        address = f"unix:{tmp_path / 'agent.sock'}"
+        server = create_server()
+        await server.start(address)
+        client = RpcClient(address)
+
+        try:
+            assert await client.call("echo", text="a", repeat=3) == "aaa"
+
+            # Errors of the server are not transient (the call should not be retried).
+            with pytest.raises(errors.KnownError, match="refuse failed on .*: lane x is already running") as error_info:
+                await client.call("refuse", lane="x")
+            assert not isinstance(error_info.value, errors.TransientError)
+
+            with pytest.raises(errors.KnownError, match="invalid params"):
+                await client.call("echo", txt="a")
+
+            # The connection survives the errors above.
+            assert await client.call("echo", text="b") == "b"
+        finally:
+            client.close()
+            server.close()
+
+        # No agent listening.
+        with pytest.raises(errors.TransientError):
+            await RpcClient(address).call("echo", text="a")
+
+    asyncio.run(scenario())